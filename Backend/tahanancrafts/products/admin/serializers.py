@@ -6,7 +6,7 @@ from products.models import Product, Order, OrderItem
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ["import_batch"]  # bulk importer bookkeeping
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -8,6 +8,7 @@ from .views import (
     AdminTopArtisanView,
     AdminRecentOrdersView,
     AdminTopSellingProductsView,
+    AdminSearchAnalyticsView,
 )
 
 urlpatterns = [
@@ -40,5 +41,6 @@ urlpatterns = [
     path("top-artisan/", AdminTopArtisanView.as_view()),
     path("top-products/", AdminTopSellingProductsView.as_view()),
     path("recent-orders/", AdminRecentOrdersView.as_view()),
+    path("search-analytics/", AdminSearchAnalyticsView.as_view()),
 
 ]
@@ -10,7 +10,9 @@ from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
 from decimal import Decimal
 
 from users.models import CustomUser, Artisan
-from products.models import Product, Order, OrderItem
+from products.models import Product, Order, OrderItem, ProductLeaderboard
+from products.leaderboards import get_entries, parse_window
+from search.querylog import parse_window as parse_search_window, search_report
 from .serializers import (
     ProductSerializer,
     CustomerSerializer,
@@ -18,6 +20,7 @@ from .serializers import (
     OrderSerializer,
 )
 from .permission import IsAdmin
+from products.streaming import StreamingListMixin
 
 class AdminDashboardAnalyticsView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
@@ -74,12 +77,14 @@ class AdminDashboardAnalyticsView(APIView):
             }
         })
 
+# Admin list views page by default; "?stream=true" streams every row
+# (e.g. for exports) via products/streaming.py.
 class AdminPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = "page_size"  # optional
     max_page_size = 5
 
-class AdminProductListView(ListAPIView):
+class AdminProductListView(StreamingListMixin, ListAPIView):
     queryset = Product.objects.select_related("artisan").prefetch_related(
         "categories", "materials", "images"
     ).order_by("-created_at")   # ✅ FIX warning + stable pagination
@@ -97,7 +102,7 @@ class AdminProductListView(ListAPIView):
         "brandName",
     ]
         
-class AdminOrderListView(ListAPIView):
+class AdminOrderListView(StreamingListMixin, ListAPIView):
     queryset = Order.objects.select_related(
         "artisan", "shipping_address"
     ).prefetch_related("items")
@@ -105,13 +110,13 @@ class AdminOrderListView(ListAPIView):
     permission_classes = [IsAuthenticated, IsAdmin]
     pagination_class = AdminPagination
 
-class AdminCustomerListView(ListAPIView):
+class AdminCustomerListView(StreamingListMixin, ListAPIView):
     queryset = CustomUser.objects.filter(role="customer")
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated, IsAdmin]
     pagination_class = AdminPagination
 
-class AdminArtisanListView(ListAPIView):
+class AdminArtisanListView(StreamingListMixin, ListAPIView):
     queryset = Artisan.objects.all()
     serializer_class = ArtisanSerializer
     permission_classes = [IsAuthenticated, IsAdmin]
@@ -147,20 +152,27 @@ class AdminTopSellingProductsView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        SOLD_STATUSES = ["completed", "delivered", "to_review"]
-
-        products = (
-            OrderItem.objects
-            .filter(order__status__in=SOLD_STATUSES)
-            .values(
-                "product__id",
-                "product__name",
-                "product__main_image",
-                "product__artisan__name"
-            )
-            .annotate(total_sold=Sum("quantity"))
-            .order_by("-total_sold")[:3]
-        )
+        # Ranked by units sold, precomputed in products/leaderboards.py
+        window = parse_window(request.query_params.get("window"))
+        entries = get_entries([ProductLeaderboard.METRIC_SOLD], window=window)[ProductLeaderboard.METRIC_SOLD][:3]
+
+        details = {
+            row["id"]: row
+            for row in Product.objects.filter(id__in=[pid for pid, _ in entries])
+            .values("id", "name", "main_image", "artisan__name")
+        }
+
+        products = [
+            {
+                "product__id": pid,
+                "product__name": details[pid]["name"],
+                "product__main_image": details[pid]["main_image"],
+                "product__artisan__name": details[pid]["artisan__name"],
+                "total_sold": total_sold,
+            }
+            for pid, total_sold in entries
+            if pid in details
+        ]
 
         return Response(products)
 
@@ -180,4 +192,13 @@ class AdminRecentOrdersView(APIView):
             )
         )
 
-        return Response(orders)
\ No newline at end of file
+        return Response(orders)
+
+
+class AdminSearchAnalyticsView(APIView):
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        # Daily rollups of the search log, refreshed by search/querylog.py
+        window = parse_search_window(request.query_params.get("window"))
+        return Response(search_report(window))
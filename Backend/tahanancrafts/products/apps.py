@@ -6,6 +6,9 @@ class ProductsConfig(AppConfig):
     name = "products"
 
     def ready(self):
+        import products.product.signals  # Import signals so they get registered
+        import products.checks  # register the deploy checks
+
         # prevent double-run
         if os.environ.get("RUN_MAIN") != "true":
             return
@@ -18,3 +21,12 @@ class ProductsConfig(AppConfig):
             print("✅ Delivery Scheduler Running Every 30 Seconds")
         except Exception as e:
             print("❌ Failed to start delivery simulator:", e)
+
+        # recommendations, leaderboards and search rollups; in production
+        # these run in one `manage.py run_scheduler` process instead
+        try:
+            from .scheduler import start_scheduler as start_jobs
+            start_jobs()
+            print("✅ Recommendation, leaderboard and search rollup jobs scheduled")
+        except Exception as e:
+            print("❌ Failed to start the job scheduler:", e)
@@ -0,0 +1,129 @@
+import logging
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# PREBUILT ARTIFACTS ON DISK
+# ---------------------------------------------------------
+# Indexes and models built by management commands / scheduled jobs and
+# loaded by web workers, stored as pickles under ARTIFACT_DIR. Each
+# carries a format number so a worker never loads one written by an
+# incompatible version of the code.
+
+
+def artifact_path(name):
+    return os.path.join(settings.ARTIFACT_DIR, name)
+
+
+def save_artifact(name, payload, format_version, path=None):
+    path = path or artifact_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # written aside and renamed, so a reader never sees half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        pickle.dump({"format": format_version, "payload": payload}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+    return path
+
+
+def load_artifact(name, format_version, path=None):
+    """ The saved payload, or None when it is missing, unreadable or of another format. """
+    try:
+        with open(path or artifact_path(name), "rb") as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception("Could not read artifact %s", name)
+        return None
+
+    if data.get("format") != format_version:
+        return None
+    return data["payload"]
+
+
+def artifact_mtime(name, path=None):
+    """ Modification time (ns) of the artifact, or None if it doesn't exist. """
+    try:
+        return os.stat(path or artifact_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+# ---------------------------------------------------------
+# MEMORY-MAPPED ARRAYS
+# ---------------------------------------------------------
+# Large numeric artifacts are saved as one .npy file per array in a
+# versioned directory and opened with mmap_mode="r", so every process using
+# a version shares one copy through the page cache instead of unpickling
+# its own. A small pointer file names the current version and is swapped
+# atomically; the oldest versions are removed as new ones are saved (open
+# maps of a removed version stay readable until they are closed).
+
+KEEP_VERSIONS = 3
+
+
+def _pointer_path(name):
+    return artifact_path(f"{name}.current")
+
+
+def _version_path(name, version):
+    return artifact_path(f"{name}.{version}")
+
+
+def array_version(name):
+    """ The current version of an array artifact, or None if none was saved. """
+    try:
+        with open(_pointer_path(name)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_arrays(name, arrays):
+    """ Save {array name: array} as a new version, make it current and return the version. """
+    version = str(time.time_ns())
+    directory = _version_path(name, version)
+    os.makedirs(directory)
+    for key, array in arrays.items():
+        np.save(os.path.join(directory, f"{key}.npy"), np.ascontiguousarray(array))
+
+    pointer = _pointer_path(name)
+    temporary = f"{pointer}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(version)
+    os.replace(temporary, pointer)
+
+    prefix = f"{name}."
+    versions = sorted(
+        int(entry[len(prefix):]) for entry in os.listdir(settings.ARTIFACT_DIR)
+        if entry.startswith(prefix) and entry[len(prefix):].isdigit()
+    )
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(_version_path(name, old), ignore_errors=True)
+    return version
+
+
+def load_arrays(name, version=None, mmap_mode="r"):
+    """ {array name: array over a read-only memory map} of a version (default: the current one), or None. """
+    version = version or array_version(name)
+    if version is None:
+        return None
+    directory = _version_path(name, version)
+    try:
+        # plain ndarray views of the maps: np.memmap slices cost several times more
+        return {
+            entry[:-len(".npy")]: np.asarray(np.load(os.path.join(directory, entry), mmap_mode=mmap_mode))
+            for entry in os.listdir(directory) if entry.endswith(".npy")
+        }
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,424 @@
+import csv
+import io
+import json
+import os
+import posixpath
+import uuid
+import zipfile
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from products.images import queue_variants
+from products.models import Category, Material, Product, ProductImage, ProductStats
+from products.product.cache import CATALOG, SNAPSHOT, TAXONOMY, artisan_scope, bump_version
+from search import autocomplete
+from search.index import reindex_products
+
+# ---------------------------------------------------------
+# FILE FORMAT
+# ---------------------------------------------------------
+# Same columns for CSV and JSONL. In CSV, list columns are "|" separated;
+# in JSONL they may be lists or "|" separated strings. Image columns hold
+# file names from the uploaded archive, or the media path of an image an
+# earlier import stored for the same artisan (as exports write them).
+
+COLUMNS = [
+    "name", "brandName", "description", "long_description",
+    "stock_quantity", "regular_price", "sales_price", "is_preorder",
+    "categories", "materials", "main_image", "images",
+]
+LIST_SEPARATOR = "|"
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+
+CHUNK_SIZE = 500
+
+MAIN_IMAGE_DIR = Product._meta.get_field("main_image").upload_to
+GALLERY_IMAGE_DIR = ProductImage._meta.get_field("image").upload_to
+
+
+def detect_format(filename, requested=None):
+    if requested in (FORMAT_CSV, FORMAT_JSONL):
+        return requested
+    if filename and filename.lower().endswith((".jsonl", ".ndjson")):
+        return FORMAT_JSONL
+    return FORMAT_CSV
+
+
+def read_rows(binary_file, file_format):
+    """ Yield dict rows from a binary file object without loading it all. """
+    text = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+
+    if file_format == FORMAT_JSONL:
+        for line in text:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else {"__invalid__": line[:100]}
+    else:
+        yield from csv.DictReader(text)
+
+
+def _split(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in str(value).split(LIST_SEPARATOR) if v.strip()]
+
+
+def _text(value):
+    return "" if value is None else str(value).strip()
+
+
+def _decimal(value, field, errors, required=True):
+    value = _text(value)
+    if not value:
+        if required:
+            errors[field] = "This field is required."
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        errors[field] = "A valid number is required."
+        return None
+    if number < 0 or number >= Decimal("100000000"):
+        errors[field] = "Must be between 0 and 99999999.99."
+        return None
+    return number.quantize(Decimal("0.01"))
+
+
+def clean_row(row):
+    """ Returns (cleaned_data, errors) for one input row. """
+    if "__invalid__" in row:
+        return None, {"row": "Not a valid JSON object."}
+
+    errors = {}
+    data = {}
+
+    data["name"] = _text(row.get("name"))[:255]
+    if not data["name"]:
+        errors["name"] = "This field is required."
+
+    data["brandName"] = _text(row.get("brandName"))[:255] or "Unknown Brand"
+
+    data["description"] = _text(row.get("description"))
+    if not data["description"]:
+        errors["description"] = "This field is required."
+
+    data["long_description"] = _text(row.get("long_description")) or None
+
+    stock = _text(row.get("stock_quantity"))
+    try:
+        data["stock_quantity"] = int(stock)
+        if data["stock_quantity"] < 0:
+            raise ValueError
+    except ValueError:
+        errors["stock_quantity"] = "A non-negative whole number is required."
+
+    data["regular_price"] = _decimal(row.get("regular_price"), "regular_price", errors)
+    data["sales_price"] = _decimal(row.get("sales_price"), "sales_price", errors, required=False)
+
+    data["is_preorder"] = _text(row.get("is_preorder")).lower() in ("1", "true", "yes", "y")
+
+    data["categories"] = _split(row.get("categories"))
+    data["materials"] = _split(row.get("materials"))
+
+    data["main_image"] = _text(row.get("main_image"))
+    if not data["main_image"]:
+        errors["main_image"] = "This field is required."
+    data["images"] = _split(row.get("images"))
+
+    return data, errors
+
+
+# ---------------------------------------------------------
+# IMPORT
+# ---------------------------------------------------------
+class ProductImporter:
+    """
+    Chunked bulk import for one artisan.
+
+    run() is a generator yielding one report per chunk so callers can
+    stream progress; the totals end up in self.summary.
+    """
+
+    def __init__(self, artisan, image_archive=None, chunk_size=CHUNK_SIZE, dry_run=False):
+        self.artisan = artisan
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+
+        # archive images are stored in the artisan's own directories, and rows
+        # may only point at files there: anyone can call the import endpoint
+        self.main_image_dir = posixpath.join(MAIN_IMAGE_DIR, f"artisan_{artisan.id}")
+        self.gallery_image_dir = posixpath.join(GALLERY_IMAGE_DIR, f"artisan_{artisan.id}")
+
+        self.archive = zipfile.ZipFile(image_archive) if image_archive else None
+        self.archive_names = {}
+        if self.archive:
+            for info in self.archive.infolist():
+                if not info.is_dir():
+                    self.archive_names.setdefault(os.path.basename(info.filename), info.filename)
+
+        # name -> id, loaded once and extended as new names are created
+        self.category_ids = {n.lower(): i for i, n in Category.objects.values_list("id", "name")}
+        self.material_ids = {n.lower(): i for i, n in Material.objects.values_list("id", "name")}
+
+        # archive member -> stored name, so a shared image is saved once
+        self.stored_images = {}
+        self.queued_images = set()
+        self.taxonomy_changed = False
+
+        self.summary = {"rows": 0, "created": 0, "failed": 0, "errors": []}
+
+    # ---------- images ----------
+    def _image_exists(self, name):
+        """ An archive member, or a file stored in this artisan's image directories. """
+        if os.path.basename(name) in self.archive_names:
+            return True
+        path = posixpath.normpath(name)
+        if not path.startswith((self.main_image_dir + "/", self.gallery_image_dir + "/")):
+            return False
+        try:
+            return default_storage.exists(path)
+        except (SuspiciousFileOperation, ValueError):
+            return False
+
+    def _discard_images(self, keys):
+        """ Delete images stored for a chunk that was rolled back. """
+        for key in keys:
+            default_storage.delete(self.stored_images.pop(key))
+
+    def _store_image(self, name, directory):
+        """ Copy an archive image into storage; existing media paths are reused. """
+        member = self.archive_names.get(os.path.basename(name))
+        if member is None:
+            return posixpath.normpath(name)
+        key = (member, directory)
+        if key not in self.stored_images:
+            content = ContentFile(self.archive.read(member))
+            self.stored_images[key] = default_storage.save(os.path.join(directory, os.path.basename(name)), content)
+        return self.stored_images[key]
+
+    # ---------- categories / materials ----------
+    def _resolve(self, names, id_map, model):
+        """ Create categories/materials not seen yet (case-insensitive); returns their ids. """
+        missing = {}
+        for name in names:
+            if name.lower() not in id_map:
+                missing.setdefault(name.lower(), name)
+        created = []
+        if missing and not self.dry_run:
+            missing = list(missing.values())
+            model.objects.bulk_create([model(name=n) for n in missing], ignore_conflicts=True)
+            for pk, name in model.objects.filter(name__in=missing).values_list("id", "name"):
+                id_map[name.lower()] = pk
+                created.append(pk)
+            self.taxonomy_changed = True
+        return created
+
+    # ---------- chunks ----------
+    def _validate(self, numbered_rows):
+        valid, errors = [], []
+        for number, row in numbered_rows:
+            data, row_errors = clean_row(row)
+            if data:
+                if data["main_image"] and not self._image_exists(data["main_image"]):
+                    row_errors["main_image"] = f"Image '{data['main_image']}' not found."
+                missing = [n for n in data["images"] if not self._image_exists(n)]
+                if missing:
+                    row_errors["images"] = f"Images not found: {', '.join(missing)}."
+
+            if row_errors:
+                errors.append({"row": number, "errors": row_errors})
+            else:
+                valid.append((number, data))
+        return valid, errors
+
+    def _insert_products(self, products):
+        if connection.features.can_return_rows_from_bulk_insert:
+            return Product.objects.bulk_create(products)
+
+        # MySQL does not hand back ids from a multi-row INSERT: tag the rows
+        # with a batch id and read theirs back, in insertion order.
+        batch = uuid.uuid4()
+        for product in products:
+            product.import_batch = batch
+        Product.objects.bulk_create(products)
+        inserted = list(Product.objects.filter(import_batch=batch).order_by("id").values_list("id", "name"))
+        if [name for _, name in inserted] != [p.name for p in products]:
+            raise RuntimeError("Could not match inserted products to their ids.")
+        for product, (pk, _) in zip(products, inserted):
+            product.pk = product.id = pk
+        return products
+
+    def _write_chunk(self, valid):
+        stored_before = set(self.stored_images)
+        try:
+            products, images = self._insert_chunk(valid)
+        except Exception:
+            # files are not part of the transaction: remove the ones no row points at
+            self._discard_images(set(self.stored_images) - stored_before)
+            raise
+
+        # bulk_create skips post_save, so resize the images ourselves, once
+        # per distinct file, and publish the products to search
+        names = {p.main_image.name for p in products} | {i.image.name for i in images}
+        queue_variants(*(names - self.queued_images))
+        self.queued_images |= names
+        reindex_products([p.pk for p in products])
+        autocomplete.refresh(autocomplete.PRODUCT, [p.pk for p in products])
+
+        return products
+
+    def _insert_chunk(self, valid):
+        """ Write one chunk in a transaction; returns (products, gallery images). """
+        new_categories = self._resolve({n for _, d in valid for n in d["categories"]}, self.category_ids, Category)
+        new_materials = self._resolve({n for _, d in valid for n in d["materials"]}, self.material_ids, Material)
+        # committed already, whatever happens to the products
+        autocomplete.refresh(autocomplete.CATEGORY, new_categories)
+        autocomplete.refresh(autocomplete.MATERIAL, new_materials)
+
+        products = []
+        for _, data in valid:
+            products.append(Product(
+                artisan=self.artisan,
+                name=data["name"],
+                brandName=data["brandName"],
+                description=data["description"],
+                long_description=data["long_description"],
+                stock_quantity=data["stock_quantity"],
+                regular_price=data["regular_price"],
+                sales_price=data["sales_price"],
+                is_preorder=data["is_preorder"],
+                main_image=self._store_image(data["main_image"], self.main_image_dir),
+            ))
+
+        with transaction.atomic():
+            products = self._insert_products(products)
+
+            category_links, material_links, images = [], [], []
+            CategoryLink = Product.categories.through
+            MaterialLink = Product.materials.through
+
+            for product, (_, data) in zip(products, valid):
+                for name in dict.fromkeys(n.lower() for n in data["categories"]):
+                    category_links.append(CategoryLink(product_id=product.pk, category_id=self.category_ids[name]))
+                for name in dict.fromkeys(n.lower() for n in data["materials"]):
+                    material_links.append(MaterialLink(product_id=product.pk, material_id=self.material_ids[name]))
+                for name in data["images"]:
+                    images.append(ProductImage(product_id=product.pk, image=self._store_image(name, self.gallery_image_dir)))
+
+            CategoryLink.objects.bulk_create(category_links)
+            MaterialLink.objects.bulk_create(material_links)
+            ProductImage.objects.bulk_create(images)
+            # bulk_create skips post_save, so create the stats rows here
+            ProductStats.objects.bulk_create([ProductStats(product_id=p.pk) for p in products])
+
+        return products, images
+
+    def run(self, rows):
+        chunk = []
+        for number, row in enumerate(rows, start=1):
+            chunk.append((number, row))
+            if len(chunk) >= self.chunk_size:
+                yield self._process(chunk)
+                chunk = []
+        if chunk:
+            yield self._process(chunk)
+
+        # bulk_create sends no signals: refresh caches and facet snapshots,
+        # and the artisan's completion weight (it counts their products)
+        if self.summary["created"] and not self.dry_run:
+            bump_version(CATALOG, SNAPSHOT, artisan_scope(self.artisan.id))
+            autocomplete.refresh(autocomplete.ARTISAN, [self.artisan.id])
+        if self.taxonomy_changed:
+            bump_version(TAXONOMY)
+
+    def _process(self, chunk):
+        valid, errors = self._validate(chunk)
+        created = 0
+
+        if valid and not self.dry_run:
+            try:
+                created = len(self._write_chunk(valid))
+            except Exception as e:
+                errors.extend({"row": number, "errors": {"row": str(e)}} for number, _ in valid)
+
+        elif self.dry_run:
+            created = len(valid)
+
+        self.summary["rows"] += len(chunk)
+        self.summary["created"] += created
+        self.summary["failed"] += len(chunk) - created
+        self.summary["errors"].extend(errors)
+
+        return {
+            "first_row": chunk[0][0],
+            "last_row": chunk[-1][0],
+            "created": created,
+            "errors": errors,
+        }
+
+
+# ---------------------------------------------------------
+# EXPORT
+# ---------------------------------------------------------
+def _export_row(product):
+    return {
+        "name": product.name,
+        "brandName": product.brandName,
+        "description": product.description,
+        "long_description": product.long_description or "",
+        "stock_quantity": product.stock_quantity,
+        "regular_price": str(product.regular_price),
+        "sales_price": "" if product.sales_price is None else str(product.sales_price),
+        "is_preorder": product.is_preorder,
+        "categories": [c.name for c in product.categories.all()],
+        "materials": [m.name for m in product.materials.all()],
+        "main_image": product.main_image.name if product.main_image else "",
+        "images": [img.image.name for img in product.images.all()],
+    }
+
+
+def export_products(artisan_id, file_format=FORMAT_CSV, chunk_size=CHUNK_SIZE):
+    """
+    Yield the artisan's catalog as CSV or JSONL text, one line at a time.
+    The queryset is read in chunks with relations prefetched per chunk.
+    """
+    products = (
+        Product.objects.filter(artisan_id=artisan_id)
+        .order_by("id")
+        .prefetch_related("categories", "materials", "images")
+        .iterator(chunk_size=chunk_size)
+    )
+
+    if file_format == FORMAT_JSONL:
+        for product in products:
+            yield json.dumps(_export_row(product), ensure_ascii=False) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+    writer.writeheader()
+
+    for product in products:
+        row = _export_row(product)
+        for field in ("categories", "materials", "images"):
+            row[field] = LIST_SEPARATOR.join(row[field])
+        writer.writerow(row)
+
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import BulkImportProductsView, BulkExportProductsView
+
+urlpatterns = [
+    path('import/', BulkImportProductsView.as_view(), name='bulk-import-products'),
+    path('export/<int:artisan_id>/', BulkExportProductsView.as_view(), name='bulk-export-products'),
+]
@@ -0,0 +1,76 @@
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.views import APIView
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework import status
+from users.models import Artisan
+
+from .services import (
+    FORMAT_JSONL, ProductImporter, detect_format, export_products, read_rows,
+)
+
+
+class BulkImportProductsView(APIView):
+    """
+    POST form-data:
+      artisan_id  - owner of the new products
+      file        - .csv or .jsonl (see products/bulk/services.py for columns)
+      images      - optional .zip with the referenced image files
+      dry_run     - "true" to only validate
+
+    Streams one JSON line per processed chunk, then a summary line.
+    """
+    permission_classes = [AllowAny]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        artisan_id = request.data.get("artisan_id")
+        upload = request.FILES.get("file")
+
+        if not artisan_id or not upload:
+            return Response(
+                {"error": "artisan_id and file are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            artisan = Artisan.objects.get(id=artisan_id)
+        except (Artisan.DoesNotExist, ValueError):
+            return Response({"error": "Invalid artisan_id"}, status=404)
+
+        file_format = detect_format(upload.name, request.data.get("file_format"))
+        dry_run = str(request.data.get("dry_run", "")).lower() in ("1", "true", "yes")
+
+        try:
+            importer = ProductImporter(artisan, image_archive=request.FILES.get("images"), dry_run=dry_run)
+        except Exception:
+            return Response({"error": "images must be a valid .zip archive."}, status=400)
+
+        def stream():
+            for report in importer.run(read_rows(upload.file, file_format)):
+                yield json.dumps({"type": "chunk", **report}) + "\n"
+            summary = {k: v for k, v in importer.summary.items() if k != "errors"}
+            yield json.dumps({"type": "summary", "dry_run": dry_run, **summary}) + "\n"
+
+        return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+
+class BulkExportProductsView(APIView):
+    """ GET ?output=csv|jsonl - streams the artisan's catalog in the import format. """
+    permission_classes = [AllowAny]
+
+    def get(self, request, artisan_id):
+        if not Artisan.objects.filter(id=artisan_id).exists():
+            return Response({"error": "Artisan not found"}, status=404)
+
+        file_format = detect_format(None, request.query_params.get("output"))
+        extension, content_type = (
+            ("jsonl", "application/x-ndjson") if file_format == FORMAT_JSONL else ("csv", "text/csv")
+        )
+
+        response = StreamingHttpResponse(export_products(artisan_id, file_format), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="artisan-{artisan_id}-products.{extension}"'
+        return response
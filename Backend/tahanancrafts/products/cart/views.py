@@ -41,7 +41,7 @@ class CartView(APIView):
         UserActivity.objects.create(
             user=user,
             product=product,
-            action="Added to cart"
+            action=UserActivity.ACTION_CART
         )
 
         return Response({"message": "✅ Added to cart successfully!"}, status=status.HTTP_201_CREATED)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Catalog versions, change feeds and cached responses live in the default
+    cache (products/product/cache.py); with a per-process cache each worker
+    would see only its own writes.
+    """
+    backend = settings.CACHES["default"]["BACKEND"]
+    if backend.endswith(("LocMemCache", "DummyCache")):
+        return [Error(
+            "The default cache is per-process, so workers do not share catalog versions or change feeds.",
+            hint="Set REDIS_URL.",
+            id="products.E001",
+        )]
+    return []
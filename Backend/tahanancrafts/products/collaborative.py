@@ -0,0 +1,178 @@
+import logging
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+from sklearn.preprocessing import normalize
+
+from products.models import Cart, Order, OrderItem, ProductLike, UserActivity
+from products.recommender import (
+    ACTION_WEIGHTS, BLOCK_BYTES, SIMILARITY_TOP_K, SimilarityIndex, top_k_index, top_neighbours,
+)
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# ITEM-ITEM COLLABORATIVE FILTERING
+# ---------------------------------------------------------
+# Purchases, cart entries, likes and logged views are implicit ratings in
+# a users x products matrix: each (user, product) pair gets the weighted
+# sum of its interactions, log-damped so repeated views do not drown out a
+# purchase. Two products are similar when the same users interact with
+# both, i.e. the cosine of their columns (co-occurrence normalized by each
+# product's popularity). The top K per product come from the same blocked
+# multiplication as the content index (sparse x sparse here: few products
+# share buyers), so memory stays O(N*K) plus the sparse matrix, which is
+# read in pages of READ_CHUNK rows per table.
+
+SIGNAL_WEIGHTS = ACTION_WEIGHTS
+# likes and purchases have tables of their own
+ACTIVITY_SIGNALS = (UserActivity.ACTION_VIEW, UserActivity.ACTION_CART)
+READ_CHUNK = 50_000
+
+
+def interaction_sources():
+    """ (signal, queryset, user id field, time field) for every table of interactions. """
+    sources = [
+        (
+            UserActivity.ACTION_PURCHASE, OrderItem.objects.exclude(order__status=Order.STATUS_CANCELLED),
+            "order__user_id", "order__created_at",
+        ),
+        (UserActivity.ACTION_CART, Cart.objects.all(), "user_id", "created_at"),
+        (UserActivity.ACTION_LIKE, ProductLike.objects.all(), "user_id", "created_at"),
+    ]
+    sources += [
+        (
+            action, UserActivity.objects.filter(action=action, user__isnull=False, product__isnull=False),
+            "user_id", "timestamp",
+        )
+        for action in ACTIVITY_SIGNALS
+    ]
+    return sources
+
+
+def read_pages(queryset, fields, chunk=READ_CHUNK):
+    """ Yield a tuple of values per field, `chunk` rows at a time in primary key order. """
+    last = 0
+    while True:
+        page = list(queryset.filter(pk__gt=last).order_by("pk").values_list("pk", *fields)[:chunk])
+        if not page:
+            return
+        last = page[-1][0]
+        _, *columns = zip(*page)
+        yield columns
+
+
+def interaction_matrix(rows, n_products, weights=None, chunk=READ_CHUNK):
+    """
+    Sparse users x products matrix of log-damped interaction weights; row
+    u is user id u, columns are the rows of `rows` (a RowMap) and
+    interactions with products it does not know are left out.
+    """
+    weights = weights or SIGNAL_WEIGHTS
+    total = sp.csr_matrix((1, n_products), dtype=np.float32)
+    for signal, queryset, user_field, _ in interaction_sources():
+        for users, product_ids in read_pages(queryset, (user_field, "product_id"), chunk):
+            users = np.array(users, dtype=np.int64)
+            columns = product_columns(rows, product_ids)
+            known = columns >= 0
+            users, columns = users[known], columns[known]
+            if not len(users):
+                continue
+            page = sp.csr_matrix(
+                (np.full(len(users), weights[signal], dtype=np.float32), (users, columns)),
+                shape=(max(int(users.max()) + 1, total.shape[0]), n_products),
+            )
+            total.resize(page.shape)
+            total = total + page
+    total.data = np.log1p(total.data)
+    return total
+
+
+def product_columns(rows, product_ids):
+    """ Row of each product id in a RowMap, -1 for unknown ones. """
+    return np.fromiter((rows.get(int(pid), -1) for pid in product_ids), dtype=np.int64, count=len(product_ids))
+
+
+def index_from_interactions(interactions, like, k=SIMILARITY_TOP_K, block_bytes=BLOCK_BYTES):
+    """ Top-k cosine neighbours of the columns of a users x products matrix, over the rows of index `like`. """
+    items = interactions.T.tocsr()
+    n = items.shape[0]
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    active = np.flatnonzero(np.diff(items.indptr) > 0)
+    if len(active):
+        for block, top, top_scores in top_neighbours(
+            normalize(items, norm="l2"), active, k, block_bytes, sparse_blocks=True,
+        ):
+            neighbours[block] = top
+            scores[block] = top_scores
+    return SimilarityIndex(like.product_ids, neighbours, scores, like.rows)
+
+
+def build_collaborative_index(like, k=SIMILARITY_TOP_K, block_bytes=BLOCK_BYTES, weights=None, chunk=READ_CHUNK):
+    """
+    Top-k co-occurrence neighbours of every product, over the same rows as
+    index `like`. Returns (index, stats) with the read / build seconds and
+    the interaction matrix's size and density.
+    """
+    started = time.monotonic()
+    interactions = interaction_matrix(like.rows, len(like), weights, chunk)
+    interactions = interactions[np.diff(interactions.indptr) > 0]     # users with no interactions
+    read = time.monotonic()
+    index = index_from_interactions(interactions, like, k, block_bytes)
+
+    users, n = interactions.shape
+    stats = {
+        "users": users,
+        "products": n,
+        "products_with_interactions": int((interactions.getnnz(axis=0) > 0).sum()),
+        "interactions": interactions.nnz,
+        "density": interactions.nnz / (users * n) if users and n else 0.0,
+        "read_seconds": read - started,
+        "build_seconds": time.monotonic() - read,
+    }
+    return index, stats
+
+
+# ---------------------------------------------------------
+# BLENDED WITH CONTENT SIMILARITY
+# ---------------------------------------------------------
+# A product's neighbours are scored content_weight * content similarity +
+# collaborative_weight * co-occurrence similarity over the union of both
+# lists, so products nobody has bought yet still get (and appear as)
+# neighbours through their text alone. The recommendation job personalizes
+# from the blended index, saved under its own name so its versions are not
+# pruned by content refits.
+
+BLENDED_ARRAYS = "recommender_blended"
+
+
+def blend(content, collaborative, content_weight, collaborative_weight, k=SIMILARITY_TOP_K):
+    """ Index of the top-k weighted sums of two indexes over the same rows. """
+    combined = content_weight * content.to_sparse() + collaborative_weight * collaborative.to_sparse()
+    return top_k_index(combined, content, k)
+
+
+def blended_index(content, content_weight=None, collaborative_weight=None):
+    """
+    The content index blended with one built from interactions, weighted by
+    the RECOMMENDATION_*_WEIGHT settings by default. Returns (index, stats
+    of the collaborative build, or None when its weight is 0).
+    """
+    if content_weight is None:
+        content_weight = settings.RECOMMENDATION_CONTENT_WEIGHT
+    if collaborative_weight is None:
+        collaborative_weight = settings.RECOMMENDATION_COLLABORATIVE_WEIGHT
+    if collaborative_weight <= 0:
+        return top_k_index(content_weight * content.to_sparse(), content, content.neighbours.shape[1]), None
+
+    collaborative, stats = build_collaborative_index(content, content.neighbours.shape[1])
+    logger.info(
+        "Collaborative index: %s users x %s products, %s interactions (density %.2e), read %.1fs, built %.1fs",
+        stats["users"], stats["products"], stats["interactions"], stats["density"],
+        stats["read_seconds"], stats["build_seconds"],
+    )
+    blended = blend(content, collaborative, content_weight, collaborative_weight, content.neighbours.shape[1])
+    return blended, stats
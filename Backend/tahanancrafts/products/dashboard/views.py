@@ -3,8 +3,10 @@ from django.db.models import (
 )
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from products.models import Product, Order, OrderItem
+from products.models import Product, Order, OrderItem, ProductLeaderboard
+from products.leaderboards import get_entries
 from products.dashboard.serializers import DashboardSerializer
+from products.streaming import StreamingJSONResponse, chunked
 from rest_framework.permissions import AllowAny
 from django.db.models.functions import Round
 from django.db.models import Sum, F, FloatField, ExpressionWrapper
@@ -162,15 +164,27 @@ class ArtisanDashboardView(APIView):
         )["avg_rating"]
 
         # ---------- TOP SELLING PRODUCTS ----------
-        top_selling_products = (
-            OrderItem.objects.filter(
-                order__status__in=delivered_statuses,
-                product__artisan_id=artisan_id
-            )
-            .values("product__id", "product__name", "product__main_image")
-            .annotate(num_orders=Count("order_id", distinct=True))
-            .order_by("-num_orders")[:4]
-        )
+        # precomputed in products/leaderboards.py (delivered-type orders)
+        top_entries = get_entries(
+            [ProductLeaderboard.METRIC_ORDERS], artisan_id=artisan_id
+        )[ProductLeaderboard.METRIC_ORDERS][:4]
+
+        top_details = {
+            row["id"]: row
+            for row in Product.objects.filter(id__in=[pid for pid, _ in top_entries])
+            .values("id", "name", "main_image")
+        }
+
+        top_selling_products = [
+            {
+                "product__id": pid,
+                "product__name": top_details[pid]["name"],
+                "product__main_image": top_details[pid]["main_image"],
+                "num_orders": num_orders,
+            }
+            for pid, num_orders in top_entries
+            if pid in top_details
+        ]
 
         # ---------- FINAL RESPONSE ----------
         data = {
@@ -207,28 +221,28 @@ class ArtisanTransactionHistoryView(APIView):
             .distinct()
         )
 
-        history = []
-
-        for order in orders:
-            for item in order.items.all():
-
-                history.append({
-                    "order_id": order.id,
-                    "status": order.status,
-                    "created_at": order.created_at,
-                    "product_name": item.product.name,
-                    "product_description": item.product.description,
-                    "quantity": item.quantity,
-                    "unit_price": float(item.price),
-                    "item_total": float(item.price * item.quantity),
-
-                    # FIXED — Return URL string only
-                    "image": (
-                        item.product.main_image.url 
-                        if item.product.main_image 
-                        else None
-                    )
-                })
-
-        return Response(history)
+        def history():
+            # orders (and their items) are fetched chunk by chunk while streaming
+            for order in chunked(orders):
+                for item in order.items.all():
+
+                    yield {
+                        "order_id": order.id,
+                        "status": order.status,
+                        "created_at": order.created_at,
+                        "product_name": item.product.name,
+                        "product_description": item.product.description,
+                        "quantity": item.quantity,
+                        "unit_price": float(item.price),
+                        "item_total": float(item.price * item.quantity),
+
+                        # FIXED — Return URL string only
+                        "image": (
+                            item.product.main_image.url 
+                            if item.product.main_image 
+                            else None
+                        )
+                    }
+
+        return StreamingJSONResponse(history())
 
@@ -0,0 +1,190 @@
+import time
+import tracemalloc
+
+import numpy as np
+import scipy.sparse as sp
+
+from products.collaborative import (
+    READ_CHUNK, SIGNAL_WEIGHTS, blend, index_from_interactions, interaction_sources, product_columns, read_pages,
+)
+from products.recommender import BLOCK_BYTES, SIMILARITY_TOP_K, RowMap, personalize
+
+# ---------------------------------------------------------
+# OFFLINE EVALUATION OF RECOMMENDATION STRATEGIES
+# ---------------------------------------------------------
+# Interactions before a cutoff time train each strategy; the products a
+# user first touched after it are what a good list should have held. Every
+# strategy recommends k products each user had not seen before the cutoff,
+# for every user with history on both sides, and is scored by
+# precision@k, recall@k, NDCG@k and catalog coverage. Its build and
+# scoring are timed (users scored per second) and their peak Python
+# memory is taken with tracemalloc.
+
+TEST_FRACTION = 0.2
+EVALUATION_K = 10
+
+
+class History:
+    """
+    One entry per interaction: user id, column (the product's row in a
+    similarity index), signal weight and unix time.
+    """
+
+    def __init__(self, product_ids, users, columns, weights, times):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.user_ids, self.users = np.unique(np.asarray(users, dtype=np.int64), return_inverse=True)
+        self.columns = np.asarray(columns, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.times = np.asarray(times, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.users)
+
+    def matrix(self, mask):
+        """ users x products matrix of the log-damped weights of the masked entries. """
+        matrix = sp.csr_matrix(
+            (self.weights[mask], (self.users[mask], self.columns[mask])),
+            shape=(len(self.user_ids), len(self.product_ids)),
+        )
+        matrix.data = np.log1p(matrix.data)
+        return matrix
+
+
+def load_history(product_ids, weights=None, chunk=READ_CHUNK):
+    """ Every interaction with one of `product_ids` (columns in that order), read in pages. """
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    rows = RowMap(product_ids)
+    weights = weights or SIGNAL_WEIGHTS
+    users, columns, signal_weights, times = [], [], [], []
+    for signal, queryset, user_field, time_field in interaction_sources():
+        fields = (user_field, "product_id", time_field)
+        for page_users, page_products, page_times in read_pages(queryset, fields, chunk):
+            page_columns = product_columns(rows, page_products)
+            known = page_columns >= 0
+            users.append(np.array(page_users, dtype=np.int64)[known])
+            columns.append(page_columns[known])
+            signal_weights.append(np.full(known.sum(), weights[signal], dtype=np.float32))
+            times.append(np.array([moment.timestamp() for moment in page_times])[known])
+    if not users:
+        return History(product_ids, [], [], [], [])
+    return History(
+        product_ids, np.concatenate(users), np.concatenate(columns),
+        np.concatenate(signal_weights), np.concatenate(times),
+    )
+
+
+def _measure(step):
+    """ (result, seconds, peak traced bytes) of calling `step`. """
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = step()
+        return result, time.perf_counter() - started, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _personalized(index, seen, k, block_bytes, seed):
+    rng = np.random.default_rng(seed)
+    recommended = []
+    for _, lists in personalize(index, seen, k, rng, block_bytes):
+        recommended += lists
+    return recommended
+
+
+def _popular(product_ids, popularity, seen, k):
+    """ The k most popular products each user has not seen. """
+    ranked = np.argsort(-popularity, kind="stable")
+    recommended = []
+    for row in range(seen.shape[0]):
+        excluded = seen.indices[seen.indptr[row]:seen.indptr[row + 1]]
+        top = ranked[:k + len(excluded)]
+        recommended.append(product_ids[top[~np.isin(top, excluded)][:k]].tolist())
+    return recommended
+
+
+def _accuracy(recommended, truth, k, n_products):
+    """ Mean precision@k, recall@k and NDCG@k over users, and catalog coverage. """
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    precision = recall = ndcg = 0.0
+    shown = set()
+    for products, relevant in zip(recommended, truth):
+        products = products[:k]
+        shown.update(products)
+        hits = [rank for rank, pid in enumerate(products) if pid in relevant]
+        precision += len(hits) / k
+        recall += len(hits) / len(relevant)
+        ndcg += discounts[hits].sum() / discounts[:min(len(relevant), k)].sum()
+    users = max(len(truth), 1)
+    return {
+        "precision": precision / users,
+        "recall": recall / users,
+        "ndcg": ndcg / users,
+        "coverage": len(shown) / max(n_products, 1),
+    }
+
+
+def evaluate(
+    history, build_content, k=EVALUATION_K, test_fraction=TEST_FRACTION, content_weight=0.6,
+    collaborative_weight=0.4, neighbours=SIMILARITY_TOP_K, block_bytes=BLOCK_BYTES, seed=0,
+):
+    """
+    Split `history` at the time that leaves `test_fraction` of it for
+    testing and evaluate the popularity, content (`build_content()` returns
+    its index), collaborative and blended strategies. Returns (split
+    summary, one report per strategy).
+    """
+    cutoff = np.quantile(history.times, 1 - test_fraction) if len(history) else 0.0
+    before = history.times < cutoff
+    train = history.matrix(before)
+    test = history.matrix(~before)
+    test = (test - test.multiply(train > 0)).tocsr()    # only products new to the user
+    test.eliminate_zeros()
+
+    users = np.flatnonzero((np.diff(train.indptr) > 0) & (np.diff(test.indptr) > 0))
+    seen = train[users]
+    truth = [
+        set(history.product_ids[test.indices[test.indptr[row]:test.indptr[row + 1]]].tolist()) for row in users
+    ]
+    split = {
+        "cutoff": cutoff,
+        "train": int(before.sum()),
+        "test": int((~before).sum()),
+        "users": len(users),
+        "products": len(history.product_ids),
+    }
+
+    built = {}
+
+    def content():
+        built["content"] = build_content()
+        return built["content"]
+
+    def collaborative():
+        built["collaborative"] = index_from_interactions(train, built["content"], neighbours, block_bytes)
+        return built["collaborative"]
+
+    def blended():
+        return blend(built["content"], built["collaborative"], content_weight, collaborative_weight, neighbours)
+
+    def popularity():
+        return np.asarray(train.getnnz(axis=0), dtype=np.float64)
+
+    strategies = [
+        ("popularity", popularity, lambda model: _popular(history.product_ids, model, seen, k)),
+        ("content", content, lambda model: _personalized(model, seen, k, block_bytes, seed)),
+        ("collaborative", collaborative, lambda model: _personalized(model, seen, k, block_bytes, seed)),
+        ("blended", blended, lambda model: _personalized(model, seen, k, block_bytes, seed)),
+    ]
+    reports = []
+    for name, build, recommend in strategies:
+        model, build_seconds, build_peak = _measure(build)
+        recommended, score_seconds, score_peak = _measure(lambda: recommend(model))
+        reports.append({
+            "strategy": name,
+            **_accuracy(recommended, truth, k, len(history.product_ids)),
+            "build_seconds": build_seconds,
+            "peak_bytes": max(build_peak, score_peak),
+            "users_per_second": len(users) / max(score_seconds, 1e-9),
+        })
+    return split, reports
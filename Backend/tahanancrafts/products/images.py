@@ -0,0 +1,174 @@
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connections, transaction
+from PIL import Image, ImageOps
+
+from products.models import Product, ProductImage
+from products.product.cache import CATALOG, artisan_scope, bump_version
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# RESIZED IMAGE VARIANTS
+# ---------------------------------------------------------
+# After an upload, every width below is written as WebP and JPEG next to
+# the original and listed on the row's image_variants field. Work runs on
+# a small thread pool after the transaction commits (Pillow releases the
+# GIL while resizing / encoding), never on the request thread.
+
+WIDTHS = (240, 480, 960)
+FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}),
+           "jpeg": ("JPEG", {"quality": 80, "optimize": True, "progressive": True})}
+LISTING_WIDTH = 480
+VARIANT_DIR = "media/products/variants/"
+WORKERS = 2
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="image-variants")
+
+
+def _variant_name(source, width, fmt):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    digest = hashlib.sha1(source.encode()).hexdigest()[:8]
+    return f"{VARIANT_DIR}{stem}-{digest}-{width}w.{fmt}"
+
+
+def _flatten(image):
+    """ JPEG has no alpha: put transparent images on white. """
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def build_variants(source):
+    """ Write every variant of one stored image; returns their metadata. """
+    with default_storage.open(source, "rb") as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    # never upscale: widths past the original are replaced by one copy at its own size
+    widths = [w for w in WIDTHS if w < image.width]
+    if image.width <= WIDTHS[-1]:
+        widths.append(image.width)
+
+    variants = []
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+
+        for fmt, (pil_format, options) in FORMATS.items():
+            frame = _flatten(resized) if fmt == "jpeg" else resized
+            if fmt == "webp" and frame.mode not in ("RGB", "RGBA"):
+                frame = frame.convert("RGBA" if "A" in frame.getbands() else "RGB")
+
+            buffer = io.BytesIO()
+            frame.save(buffer, pil_format, **options)
+
+            name = _variant_name(source, width, fmt)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            name = default_storage.save(name, ContentFile(buffer.getvalue()))
+
+            variants.append({
+                "name": name,
+                "format": fmt,
+                "width": width,
+                "height": height,
+                "bytes": buffer.tell(),
+            })
+
+    return variants
+
+
+# ---------------------------------------------------------
+# PROCESSING ONE STORED IMAGE
+# ---------------------------------------------------------
+# Jobs are keyed by the stored file name, so an image shared by many rows
+# (e.g. from a bulk import) is resized once and every row gets the result.
+
+def process_source(source):
+    variants = build_variants(source)
+
+    products = Product.objects.filter(main_image=source)
+    gallery = ProductImage.objects.filter(image=source)
+    artisan_ids = set(products.values_list("artisan_id", flat=True))
+    artisan_ids.update(gallery.values_list("product__artisan_id", flat=True))
+
+    # update() sends no signals, so no job is queued again
+    products.update(image_variants=variants)
+    gallery.update(image_variants=variants)
+    bump_version(CATALOG, *[artisan_scope(a) for a in artisan_ids])
+    return variants
+
+
+def run_job(source):
+    """ Entry point for pool workers (threads here, processes in the backfill). """
+    close_old_connections()
+    try:
+        return process_source(source)
+    except Exception:
+        logger.exception("Could not build image variants for %s", source)
+        return None
+    finally:
+        close_old_connections()
+
+
+def queue_variants(*sources):
+    """ Build variants in the background once the current transaction commits. """
+    def submit():
+        for source in dict.fromkeys(sources):
+            if source:
+                _executor.submit(run_job, source)
+
+    transaction.on_commit(submit)
+
+
+def init_worker_process():
+    """ ProcessPoolExecutor initializer for the backfill command. """
+    import django
+    django.setup()
+    connections.close_all()
+
+
+# ---------------------------------------------------------
+# READING VARIANTS
+# ---------------------------------------------------------
+def variant_urls(variants):
+    return [
+        {
+            "url": default_storage.url(v["name"]),
+            "format": v["format"],
+            "width": v["width"],
+            "height": v["height"],
+            "bytes": v["bytes"],
+        }
+        for v in variants or []
+    ]
+
+
+def pick_variant(variants, width=LISTING_WIDTH, fmt="webp"):
+    """ Smallest variant of `fmt` at least `width` wide (else the widest), or None. """
+    candidates = [v for v in variants or [] if v["format"] == fmt]
+    if not candidates:
+        return None
+    wide_enough = [v for v in candidates if v["width"] >= width]
+    if wide_enough:
+        return min(wide_enough, key=lambda v: v["width"])
+    return max(candidates, key=lambda v: v["width"])
+
+
+def thumbnail_url(image_field, variants, width=LISTING_WIDTH):
+    """ Listing-size variant URL, falling back to the original upload. """
+    variant = pick_variant(variants, width)
+    if variant:
+        return default_storage.url(variant["name"])
+    return image_field.url if image_field else None
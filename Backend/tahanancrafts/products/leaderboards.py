@@ -0,0 +1,168 @@
+import heapq
+import logging
+import os
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from products.models import OrderItem, ProductLeaderboard, ProductLike, UserActivity
+from products.product.stats import SOLD_STATUSES
+
+logger = logging.getLogger(__name__)
+
+TOP_N = 20
+REFRESH_LOCK = "leaderboards-refresh"
+REFRESH_LOCK_TIMEOUT = 60 * 5
+
+WINDOW_DAYS = {
+    ProductLeaderboard.WINDOW_7_DAYS: 7,
+    ProductLeaderboard.WINDOW_30_DAYS: 30,
+    ProductLeaderboard.WINDOW_ALL_TIME: None,
+}
+
+
+# ---------------------------------------------------------
+# ONE GROUPED QUERY PER (METRIC, WINDOW)
+# ---------------------------------------------------------
+# Each returns rows of (product_id, artisan_id, score).
+
+def _sold_scores(since):
+    qs = OrderItem.objects.filter(order__status__in=SOLD_STATUSES)
+    if since:
+        qs = qs.filter(order__created_at__gte=since)
+    return qs.values_list("product_id", "product__artisan_id").annotate(score=Sum("quantity"))
+
+
+def _order_scores(since):
+    qs = OrderItem.objects.filter(order__status__in=SOLD_STATUSES)
+    if since:
+        qs = qs.filter(order__created_at__gte=since)
+    return qs.values_list("product_id", "product__artisan_id").annotate(
+        score=Count("order_id", distinct=True)
+    )
+
+
+def _like_scores(since):
+    qs = ProductLike.objects.all()
+    if since:
+        qs = qs.filter(created_at__gte=since)
+    return qs.values_list("product_id", "product__artisan_id").annotate(score=Count("id"))
+
+
+def _view_scores(since):
+    qs = UserActivity.objects.filter(action=UserActivity.ACTION_VIEW, product__isnull=False)
+    if since:
+        qs = qs.filter(timestamp__gte=since)
+    return qs.values_list("product_id", "product__artisan_id").annotate(score=Count("id"))
+
+
+METRIC_SOURCES = {
+    ProductLeaderboard.METRIC_SOLD: _sold_scores,
+    ProductLeaderboard.METRIC_ORDERS: _order_scores,
+    ProductLeaderboard.METRIC_LIKES: _like_scores,
+    ProductLeaderboard.METRIC_VIEWS: _view_scores,
+}
+
+
+def _rank(rows, top_n):
+    """ [(product_id, score)] -> best first, ties broken by newest product id """
+    best = heapq.nlargest(top_n, rows, key=lambda row: (row[1], row[0]))
+    return [[pid, score] for pid, score in best]
+
+
+def refresh_leaderboards(top_n=TOP_N):
+    """
+    Rebuild every leaderboard (global + per artisan, every window and metric).
+    Costs one grouped query per (metric, window) regardless of artisan count.
+    """
+    now = timezone.now()
+    boards = []
+
+    for window, days in WINDOW_DAYS.items():
+        since = now - timedelta(days=days) if days else None
+
+        for metric, source in METRIC_SOURCES.items():
+            per_artisan = defaultdict(list)
+            everything = []
+
+            for product_id, artisan_id, score in source(since):
+                everything.append((product_id, score))
+                per_artisan[artisan_id].append((product_id, score))
+
+            boards.append(ProductLeaderboard(
+                artisan_id=None, window=window, metric=metric, entries=_rank(everything, top_n)
+            ))
+            for artisan_id, rows in per_artisan.items():
+                boards.append(ProductLeaderboard(
+                    artisan_id=artisan_id, window=window, metric=metric, entries=_rank(rows, top_n)
+                ))
+
+    with transaction.atomic():
+        ProductLeaderboard.objects.all().delete()
+        ProductLeaderboard.objects.bulk_create(boards, batch_size=500)
+
+    logger.info("Refreshed %s leaderboards", len(boards))
+    return len(boards)
+
+
+# ---------------------------------------------------------
+# READ SIDE
+# ---------------------------------------------------------
+# The table is filled by the scheduled job (products/scheduler.py), which
+# may not have run yet on a fresh deploy; the first read that finds it
+# empty builds it instead of serving empty leaderboards until then. A
+# refresh always writes the global boards, so this happens once.
+
+def ensure_leaderboards():
+    """ Build the leaderboards if they have never been built; one worker at a time. """
+    if ProductLeaderboard.objects.exists():
+        return
+    if not cache.add(REFRESH_LOCK, os.getpid(), REFRESH_LOCK_TIMEOUT):
+        return    # another worker is building them
+    try:
+        refresh_leaderboards()
+    finally:
+        cache.delete(REFRESH_LOCK)
+
+
+def parse_window(value):
+    return value if value in WINDOW_DAYS else ProductLeaderboard.WINDOW_ALL_TIME
+
+
+def get_entries(metrics, window=ProductLeaderboard.WINDOW_ALL_TIME, artisan_id=None):
+    """
+    Ordered [[product_id, score], ...] for each metric, in one query.
+    Returns {metric: entries}; metrics without a board map to [].
+    """
+    boards = ProductLeaderboard.objects.filter(
+        artisan_id=artisan_id, window=window, metric__in=metrics
+    ).values_list("metric", "entries")
+
+    found = dict(boards)
+    if not found:
+        ensure_leaderboards()
+        found = dict(boards.all())
+    return {metric: found.get(metric, []) for metric in metrics}
+
+
+def first_ranked(metrics, window=ProductLeaderboard.WINDOW_ALL_TIME, artisan_id=None, limit=4):
+    """
+    Entries of the first metric (in the given priority order) that has any,
+    e.g. purchases, then likes, then views.
+    """
+    entries = get_entries(metrics, window=window, artisan_id=artisan_id)
+    for metric in metrics:
+        if entries[metric]:
+            return entries[metric][:limit]
+    return []
+
+
+def in_rank_order(queryset, entries):
+    """ Fetch the ranked products with one id__in query, keeping the ranking. """
+    position = {pid: i for i, (pid, _) in enumerate(entries)}
+    products = queryset.filter(id__in=position.keys())
+    return sorted(products, key=lambda p: position[p.id])
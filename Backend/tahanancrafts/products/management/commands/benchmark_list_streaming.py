@@ -0,0 +1,121 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from products.models import Category, Material, Product, ProductImage, ProductStats
+from products.product.views import LIST_FIELDS, ProductListView
+from products.streaming import chunked, iter_json_array
+from users.models import Artisan, CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the buffered and streamed product list: time to first row, "
+        "total time and peak Python memory (tracemalloc)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000, help="Products to benchmark with.")
+        parser.add_argument(
+            "--seed",
+            action="store_true",
+            help="Insert synthetic products up to --rows inside a transaction that is rolled back.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options["seed"]:
+                self.seed(options["rows"])
+            elif Product.objects.count() < options["rows"]:
+                raise CommandError("Not enough products; pass --seed to add synthetic ones.")
+
+            view = ProductListView()
+            fields = list(LIST_FIELDS)
+
+            # the buffered run goes second so its caches don't help the streamed one
+            for name, run in (("streamed", self.streamed), ("buffered", self.buffered)):
+                products = view.get_queryset(fields)[: options["rows"]]
+                first_row, total, size, peak = self.measure(run, view, products, fields)
+                self.stdout.write(
+                    f"{name:<9} first row {first_row * 1000:8.1f} ms | total {total:6.2f} s | "
+                    f"body {size / 1e6:6.1f} MB | peak memory {peak / 1e6:7.1f} MB"
+                )
+
+            transaction.set_rollback(True)
+
+    def measure(self, run, view, products, fields):
+        tracemalloc.start()
+        started = time.perf_counter()
+        first_row = None
+        size = 0
+
+        for piece in run(view, products, fields):
+            if first_row is None and len(piece) > 1:
+                first_row = time.perf_counter() - started
+            size += len(piece)
+
+        total = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return first_row or total, total, size, peak
+
+    def buffered(self, view, products, fields):
+        # what Response(list) used to do: every row, then the whole body
+        yield JSONRenderer().render(list(view.serialize(products, fields)))
+
+    def streamed(self, view, products, fields):
+        yield from iter_json_array(view.serialize(chunked(products), fields))
+
+    def seed(self, rows):
+        missing = rows - Product.objects.count()
+        if missing <= 0:
+            return
+
+        artisan = Artisan.objects.first()
+        if artisan is None:
+            user = CustomUser.objects.create_user(
+                email="benchmark@example.com", password=None, name="Benchmark", role="seller"
+            )
+            artisan = Artisan.objects.create(user=user, name="Benchmark Artisan")
+
+        category, _ = Category.objects.get_or_create(name="Benchmark")
+        material, _ = Material.objects.get_or_create(name="Benchmark")
+
+        self.stdout.write(f"Seeding {missing} products...")
+        Product.objects.bulk_create(
+            (
+                Product(
+                    artisan=artisan,
+                    name=f"Benchmark product {i}",
+                    description="Handwoven benchmark product " * 4,
+                    stock_quantity=10,
+                    regular_price=100 + i % 500,
+                    main_image="products/main/benchmark.png",
+                )
+                for i in range(missing)
+            ),
+            batch_size=2000,
+        )
+
+        new_ids = list(
+            Product.objects.filter(artisan=artisan, name__startswith="Benchmark product")
+            .values_list("id", flat=True)
+        )
+        Product.categories.through.objects.bulk_create(
+            [Product.categories.through(product_id=pid, category_id=category.id) for pid in new_ids],
+            batch_size=2000,
+        )
+        Product.materials.through.objects.bulk_create(
+            [Product.materials.through(product_id=pid, material_id=material.id) for pid in new_ids],
+            batch_size=2000,
+        )
+        ProductImage.objects.bulk_create(
+            [ProductImage(product_id=pid, image="products/others/benchmark.png") for pid in new_ids],
+            batch_size=2000,
+        )
+        ProductStats.objects.bulk_create(
+            [ProductStats(product_id=pid) for pid in new_ids], batch_size=2000, ignore_conflicts=True
+        )
@@ -0,0 +1,88 @@
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import scipy.sparse as sp
+from django.core.management.base import BaseCommand
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from products.management.commands.benchmark_similarity import synthetic_texts
+from products.recommender import (
+    PERSONALIZED_TOP_N, build_similarity_index, get_recommendations_for_product, personalize,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Users per second of the batch personalization engine against the old per-user loop, "
+        "on a synthetic catalog and synthetic interactions (no database writes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--users", type=int, default=20000)
+        parser.add_argument("--interactions", type=int, default=8, help="Average interactions per active user.")
+        parser.add_argument("--active", type=float, default=0.6, help="Share of users with any interaction.")
+        parser.add_argument("--loop-sample", type=int, default=2000, help="Users timed with the per-user loop.")
+        parser.add_argument("--top-n", type=int, default=PERSONALIZED_TOP_N)
+
+    def handle(self, *args, **options):
+        rng = random.Random(11)
+        np_rng = np.random.default_rng(11)
+        n, users, top_n = options["products"], options["users"], options["top_n"]
+
+        matrix = TfidfVectorizer(stop_words="english").fit_transform(synthetic_texts(rng, n))
+        started = time.perf_counter()
+        index = build_similarity_index(matrix, list(range(1, n + 1)))
+        self.stdout.write(f"Similarity index for {n} products built in {time.perf_counter() - started:.1f} s")
+
+        interactions = self.interactions(np_rng, users, n, options["interactions"], options["active"])
+        self.stdout.write(f"{users} users, {interactions.nnz} distinct (user, product) interactions")
+
+        started = time.perf_counter()
+        produced = sum(len(block) for _, block in personalize(index, interactions, top_n, np_rng))
+        seconds = time.perf_counter() - started
+        self.stdout.write(f"batch engine : {produced / seconds:10.0f} users/s ({seconds:.2f} s for {produced})")
+
+        sample = min(options["loop_sample"], users)
+        products = [SimpleNamespace(id=pid) for pid in index.product_ids.tolist()]
+        started = time.perf_counter()
+        for row in range(sample):
+            self.per_user(interactions.getrow(row), products, index, top_n)
+        seconds = time.perf_counter() - started
+        self.stdout.write(f"per-user loop: {sample / seconds:10.0f} users/s ({seconds:.2f} s for {sample})")
+
+    def interactions(self, rng, users, n, per_user, active):
+        active_users = np.flatnonzero(rng.random(users) < active)
+        counts = rng.poisson(per_user, len(active_users)) + 1
+        rows = np.repeat(active_users, counts)
+        # a few popular products take most of the interactions
+        columns = np.minimum(rng.zipf(1.3, len(rows)) - 1, n - 1)
+        columns = (columns * 7919) % n
+        matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(users, n))
+        matrix.sum_duplicates()
+        return matrix
+
+    def per_user(self, row, products, index, top_n):
+        """ The per-user loop the batch engine replaced, without its queries. """
+        counts = Counter({products[c].id: int(w) for c, w in zip(row.indices, row.data)})
+        if not counts:
+            shuffled = products.copy()
+            random.shuffle(shuffled)
+            return [p.id for p in shuffled[:top_n]]
+
+        weighted = []
+        for pid, weight in counts.items():
+            for product in get_recommendations_for_product(pid, products, None, index, top_n=top_n):
+                weighted.append((product.id, weight))
+        weighted.sort(key=lambda x: x[1], reverse=True)
+
+        final = list(dict.fromkeys(pid for pid, _ in weighted))
+        if len(final) < top_n:
+            chosen = set(final)
+            remaining = [p.id for p in products if p.id not in chosen]
+            random.shuffle(remaining)
+            final.extend(remaining)
+        return final[:top_n]
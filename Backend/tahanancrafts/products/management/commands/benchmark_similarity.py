@@ -0,0 +1,77 @@
+import random
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from products.recommender import SIMILARITY_TOP_K, build_similarity_index
+
+ADJECTIVES = ["handwoven", "handmade", "native", "embroidered", "carved", "painted", "braided", "natural"]
+MATERIALS = ["abaca", "rattan", "bamboo", "buri", "pandan", "pina", "capiz", "coconut", "nito", "narra"]
+ITEMS = ["bag", "basket", "mat", "banig", "lamp", "tray", "hat", "coaster", "runner", "bayong", "fan", "bowl"]
+PLACES = ["romblon", "iloilo", "bohol", "aklan", "antique", "cebu", "pampanga", "batangas", "ifugao"]
+SYLLABLES = ["ba", "ka", "la", "ma", "na", "pa", "sa", "ta", "yo", "ngi", "bu", "ri", "to", "li", "ha", "wi"]
+
+
+def synthetic_texts(rng, size):
+    """ Product-like texts: a few shared craft words plus a made-up maker name. """
+    texts = []
+    for _ in range(size):
+        maker = "".join(rng.choice(SYLLABLES) for _ in range(3))
+        words = [rng.choice(ADJECTIVES), rng.choice(MATERIALS), rng.choice(ITEMS), maker]
+        words += rng.sample(ADJECTIVES + MATERIALS + ITEMS + PLACES, 6)
+        texts.append(" ".join(words))
+    return texts
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the dense cosine matrix with the blocked top-K similarity index on synthetic "
+        "product texts: build time, peak Python memory (tracemalloc) and lookup time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated product counts.")
+        parser.add_argument("--k", type=int, default=SIMILARITY_TOP_K)
+        parser.add_argument(
+            "--dense-limit", type=int, default=10000,
+            help="Largest size to run the dense N x N matrix for; larger ones are only estimated.",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        for size in sorted(int(s) for s in options["sizes"].split(",")):
+            matrix = TfidfVectorizer(stop_words="english").fit_transform(synthetic_texts(rng, size))
+            ids = list(range(1, size + 1))
+
+            index, seconds, peak = self.measure(lambda: build_similarity_index(matrix, ids, options["k"]))
+            lookups = rng.sample(ids, min(1000, size))
+            started = time.perf_counter()
+            for pid in lookups:
+                index.similar(pid, 8)
+            lookup_us = (time.perf_counter() - started) / len(lookups) * 1e6
+            self.stdout.write(
+                f"{size:>7} products | top-{options['k']} index: build {seconds:6.2f} s, "
+                f"peak {peak / 1e6:8.1f} MB, stored {(index.neighbours.nbytes + index.scores.nbytes) / 1e6:6.1f} MB, "
+                f"lookup {lookup_us:6.1f} us"
+            )
+
+            if size <= options["dense_limit"]:
+                _, seconds, peak = self.measure(lambda: cosine_similarity(matrix, matrix))
+                self.stdout.write(f"{'':>7}          | dense matrix: build {seconds:6.2f} s, peak {peak / 1e6:8.1f} MB")
+            else:
+                self.stdout.write(
+                    f"{'':>7}          | dense matrix: skipped, would need {size * size * 8 / 1e9:.1f} GB"
+                )
+
+    def measure(self, build):
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, seconds, peak
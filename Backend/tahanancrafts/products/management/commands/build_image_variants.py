@@ -0,0 +1,62 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from products.images import init_worker_process, pick_variant, run_job
+from products.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = "Build resized WebP/JPEG variants for existing product and gallery images, in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+        parser.add_argument("--force", action="store_true", help="Rebuild images that already have variants.")
+
+    def handle(self, *args, **options):
+        sources = self.collect_sources(options["force"])
+        if not sources:
+            self.stdout.write("Nothing to do.")
+            return
+
+        self.stdout.write(f"Building variants for {len(sources)} images with {options['workers']} workers...")
+        started = time.monotonic()
+        done = failed = original_bytes = listing_bytes = 0
+
+        # forked workers must not share the parent's DB connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker_process) as pool:
+            futures = {pool.submit(run_job, source): source for source in sources}
+            for future in as_completed(futures):
+                variants = future.result()
+                if not variants:
+                    failed += 1
+                    continue
+
+                done += 1
+                original_bytes += default_storage.size(futures[future])
+                listing_bytes += pick_variant(variants)["bytes"]
+                if done % 100 == 0:
+                    self.stdout.write(f"  {done}/{len(sources)}")
+
+        saved = 100 * (1 - listing_bytes / original_bytes) if original_bytes else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {done} images ({failed} failed) in {time.monotonic() - started:.1f}s. "
+            f"Listing images: {listing_bytes / 1e6:.1f} MB instead of {original_bytes / 1e6:.1f} MB "
+            f"({saved:.0f}% smaller)."
+        ))
+
+    def collect_sources(self, force):
+        sources = {}
+        for queryset, field in (
+            (Product.objects.all(), "main_image"),
+            (ProductImage.objects.all(), "image"),
+        ):
+            for name, variants in queryset.values_list(field, "image_variants").iterator(chunk_size=2000):
+                if name and (force or not variants):
+                    sources[name] = True
+        return list(sources)
@@ -0,0 +1,136 @@
+import random
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from products.collaborative import SIGNAL_WEIGHTS, interaction_sources
+from products.evaluation import EVALUATION_K, TEST_FRACTION, History, evaluate, load_history
+from products.management.commands.benchmark_similarity import MATERIALS, synthetic_texts
+from products.models import Product
+from products.recommender import SIMILARITY_TOP_K, build_similarity_index, fit_tfidf_model
+from users.models import CustomUser
+
+# smallest "our scale" for --synthetic, when the database holds less
+BASE_PRODUCTS = 1000
+BASE_USERS = 2000
+BASE_INTERACTIONS = 50_000
+
+SIGNAL_SHARES = {"view": 0.7, "cart": 0.15, "like": 0.1, "purchase": 0.05}
+FAVOURITE_SHARE = 0.8
+HISTORY_DAYS = 90
+
+
+def synthetic_history(seed, products, users, interactions):
+    """
+    (product texts, History) with structure to find: every user favours
+    one material and most of their interactions go to its products, a few
+    popular ones most of all; the rest are spread over the catalog.
+    """
+    rng = np.random.default_rng(seed)
+    texts = synthetic_texts(random.Random(seed), products)
+    materials = np.array([MATERIALS.index(text.split()[1]) for text in texts])
+    favourite = rng.integers(0, len(MATERIALS), users)
+
+    activity = rng.lognormal(0, 1, users)
+    user_of = rng.choice(users, interactions, p=activity / activity.sum())
+    columns = rng.integers(0, products, interactions)
+    own = rng.random(interactions) < FAVOURITE_SHARE
+    for material in range(len(MATERIALS)):
+        members = np.flatnonzero(materials == material)
+        picked = own & (favourite[user_of] == material)
+        if len(members):
+            columns[picked] = members[np.minimum(rng.zipf(1.5, picked.sum()) - 1, len(members) - 1)]
+
+    signals = rng.choice(list(SIGNAL_SHARES), interactions, p=list(SIGNAL_SHARES.values()))
+    weights = np.array([SIGNAL_WEIGHTS[signal] for signal in signals], dtype=np.float32)
+    times = time.time() - rng.uniform(0, HISTORY_DAYS * 86400, interactions)
+    return texts, History(np.arange(1, products + 1), user_of, columns, weights, times)
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate the popularity, content, collaborative and blended recommenders offline: train on "
+        "interactions before a cutoff time, test on the products users touched after it. Reports "
+        "precision@k, recall@k, NDCG@k, coverage, build time, peak Python memory (tracemalloc) and "
+        "users scored per second. --synthetic runs on generated data --scale times the database's size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--k", type=int, default=EVALUATION_K)
+        parser.add_argument("--test-fraction", type=float, default=TEST_FRACTION)
+        parser.add_argument("--neighbours", type=int, default=SIMILARITY_TOP_K)
+        parser.add_argument("--content-weight", type=float, default=settings.RECOMMENDATION_CONTENT_WEIGHT)
+        parser.add_argument(
+            "--collaborative-weight", type=float, default=settings.RECOMMENDATION_COLLABORATIVE_WEIGHT,
+        )
+        parser.add_argument("--synthetic", action="store_true", help="Generate the history instead of reading it.")
+        parser.add_argument("--scale", type=float, default=1.0, help="Synthetic size as a multiple of ours.")
+        parser.add_argument("--products", type=int, help="Synthetic products (overrides --scale).")
+        parser.add_argument("--users", type=int, help="Synthetic users (overrides --scale).")
+        parser.add_argument("--interactions", type=int, help="Synthetic interactions (overrides --scale).")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options["synthetic"]:
+            products, users, interactions = self.synthetic_size(options)
+            texts, history = synthetic_history(options["seed"], products, users, interactions)
+            matrix = TfidfVectorizer(stop_words="english").fit_transform(texts)
+            product_ids = history.product_ids
+        else:
+            catalog = list(Product.objects.all().prefetch_related("materials", "categories"))
+            if not catalog:
+                raise CommandError("No products.")
+            model = fit_tfidf_model(catalog)
+            matrix, product_ids = model.matrix, model.product_ids
+            history = load_history(product_ids)
+        if not len(history):
+            raise CommandError("No interactions to evaluate.")
+        self.stdout.write(
+            f"{len(history.product_ids)} products, {len(history.user_ids)} users, {len(history)} interactions "
+            f"({'generated' if options['synthetic'] else 'read'} in {time.perf_counter() - started:.1f}s)"
+        )
+
+        split, reports = evaluate(
+            history,
+            lambda: build_similarity_index(matrix, product_ids, options["neighbours"]),
+            k=options["k"],
+            test_fraction=options["test_fraction"],
+            content_weight=options["content_weight"],
+            collaborative_weight=options["collaborative_weight"],
+            neighbours=options["neighbours"],
+            seed=options["seed"],
+        )
+        self.stdout.write(
+            f"train {split['train']} / test {split['test']} interactions, "
+            f"{split['users']} users with history on both sides"
+        )
+
+        k = options["k"]
+        self.stdout.write(
+            f"{'strategy':<14} {f'P@{k}':>7} {f'R@{k}':>7} {f'NDCG@{k}':>8} {'cover':>6} "
+            f"{'build s':>8} {'peak MB':>8} {'users/s':>9}"
+        )
+        for report in reports:
+            self.stdout.write(
+                f"{report['strategy']:<14} {report['precision']:7.4f} {report['recall']:7.4f} "
+                f"{report['ndcg']:8.4f} {report['coverage']:6.3f} {report['build_seconds']:8.2f} "
+                f"{report['peak_bytes'] / 1e6:8.1f} {report['users_per_second']:9.0f}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            "Blended build time is the blend alone; it needs the content and collaborative indexes above."
+        ))
+
+    def synthetic_size(self, options):
+        """ (products, users, interactions): ours times --scale, unless given. """
+        interactions = sum(queryset.count() for _, queryset, _, _ in interaction_sources())
+        ours = (
+            max(Product.objects.count(), BASE_PRODUCTS),
+            max(CustomUser.objects.count(), BASE_USERS),
+            max(interactions, BASE_INTERACTIONS),
+        )
+        given = (options["products"], options["users"], options["interactions"])
+        return tuple(value or max(1, int(base * options["scale"])) for value, base in zip(given, ours))
@@ -0,0 +1,24 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from products.bulk.services import FORMAT_CSV, FORMAT_JSONL, detect_format, export_products
+
+
+class Command(BaseCommand):
+    help = "Export an artisan's products as CSV or JSONL (the import format)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--artisan", type=int, required=True)
+        parser.add_argument("--output", help="File to write; defaults to stdout.")
+        parser.add_argument("--format", choices=[FORMAT_CSV, FORMAT_JSONL], dest="file_format")
+
+    def handle(self, *args, **options):
+        file_format = detect_format(options["output"], options["file_format"])
+        target = open(options["output"], "w", encoding="utf-8", newline="") if options["output"] else sys.stdout
+        try:
+            for chunk in export_products(options["artisan"], file_format):
+                target.write(chunk)
+        finally:
+            if options["output"]:
+                target.close()
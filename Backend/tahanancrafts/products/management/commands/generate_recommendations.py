@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from products.scheduler import generate_all_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the similarity index and the recommendations of users with new activity "
+        "(or every user with --full-sweep), optionally in parallel worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, help="Worker processes (default: RECOMMENDATION_WORKERS).")
+        parser.add_argument("--shard-size", type=int, help="Users per shard (default: RECOMMENDATION_SHARD_SIZE).")
+        parser.add_argument(
+            "--full-sweep", action="store_true",
+            help="Redo every user, not only those with new activity or changed recommendations.",
+        )
+
+    def handle(self, *args, **options):
+        shards = generate_all_recommendations(
+            workers=options["workers"], shard_size=options["shard_size"], full_sweep=options["full_sweep"],
+        )
+        for shard in shards:
+            self.stdout.write(
+                f"shard {shard['shard']:>3} | users {shard['first_user']}-{shard['last_user']} ({shard['users']}) | "
+                f"load {shard['load']:.2f}s compute {shard['compute']:.2f}s write {shard['write']:.2f}s "
+                f"| {shard['seconds']:.2f}s"
+            )
+        users = sum(shard["users"] for shard in shards)
+        self.stdout.write(self.style.SUCCESS(f"Generated recommendations for {users} users in {len(shards)} shards."))
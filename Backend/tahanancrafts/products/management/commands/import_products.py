@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.bulk.services import (
+    CHUNK_SIZE, FORMAT_CSV, FORMAT_JSONL, ProductImporter, detect_format, read_rows,
+)
+from users.models import Artisan
+
+
+class Command(BaseCommand):
+    help = "Bulk import products for an artisan from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="Path to the .csv or .jsonl file.")
+        parser.add_argument("--artisan", type=int, required=True, help="Artisan id that owns the products.")
+        parser.add_argument("--images", help="Optional .zip archive with the referenced images.")
+        parser.add_argument("--format", choices=[FORMAT_CSV, FORMAT_JSONL], dest="file_format")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--dry-run", action="store_true", help="Validate only, write nothing.")
+
+    def handle(self, *args, **options):
+        try:
+            artisan = Artisan.objects.get(id=options["artisan"])
+        except Artisan.DoesNotExist:
+            raise CommandError(f"Artisan {options['artisan']} does not exist.")
+
+        file_format = detect_format(options["file"], options["file_format"])
+        started = time.monotonic()
+
+        with open(options["file"], "rb") as source:
+            images = open(options["images"], "rb") if options["images"] else None
+            try:
+                importer = ProductImporter(
+                    artisan,
+                    image_archive=images,
+                    chunk_size=options["chunk_size"],
+                    dry_run=options["dry_run"],
+                )
+                for report in importer.run(read_rows(source, file_format)):
+                    self.stdout.write(
+                        f"rows {report['first_row']}-{report['last_row']}: "
+                        f"{report['created']} created, {len(report['errors'])} failed"
+                    )
+                    for error in report["errors"]:
+                        self.stderr.write(f"  row {error['row']}: {error['errors']}")
+            finally:
+                if images:
+                    images.close()
+
+        summary = importer.summary
+        verb = "Validated" if options["dry_run"] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {summary['created']} of {summary['rows']} rows "
+            f"({summary['failed']} failed) in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from products.product.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ProductStats table from orders, ratings and likes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--product",
+            type=int,
+            action="append",
+            dest="product_ids",
+            help="Only rebuild this product id (can be repeated).",
+        )
+
+    def handle(self, *args, **options):
+        count = rebuild_stats(product_ids=options["product_ids"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {count} products."))
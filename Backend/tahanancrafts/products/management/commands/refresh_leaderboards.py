@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.leaderboards import TOP_N, refresh_leaderboards
+
+
+class Command(BaseCommand):
+    help = "Recompute the precomputed product leaderboards (global and per artisan)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=TOP_N, help="Products kept per leaderboard.")
+
+    def handle(self, *args, **options):
+        count = refresh_leaderboards(top_n=options["top"])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {count} leaderboards."))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.scheduler import start_scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the recommendation, recommender model, leaderboard and search rollup jobs on their schedules "
+        "until stopped. "
+        "Run exactly one of these next to the web workers (runserver starts them itself)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recommendation-minutes", type=int, default=60)
+        parser.add_argument("--leaderboard-minutes", type=int, default=15)
+        parser.add_argument("--search-rollup-minutes", type=int, default=15)
+        parser.add_argument("--model-minutes", type=int, default=2)
+
+    def handle(self, *args, **options):
+        scheduler = start_scheduler(
+            interval_minutes=options["recommendation_minutes"],
+            leaderboard_minutes=options["leaderboard_minutes"],
+            search_rollup_minutes=options["search_rollup_minutes"],
+            model_minutes=options["model_minutes"],
+        )
+        self.stdout.write(self.style.SUCCESS("Scheduler running; Ctrl+C to stop."))
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            if scheduler:
+                scheduler.shutdown()
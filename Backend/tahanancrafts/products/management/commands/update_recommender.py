@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.recommender import refit, update_saved_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Patch the saved TF-IDF model and similarity index that web workers read with the products "
+        "changed since it was saved (refitting when it can't be patched), or refit it with --full."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Refit on the whole catalog.")
+
+    def handle(self, *args, **options):
+        if options["full"]:
+            outcome = "refit" if refit() is not None else None
+        else:
+            outcome = update_saved_model()
+        if outcome is None:
+            raise CommandError("No products.")
+        self.stdout.write(self.style.SUCCESS(f"Recommender model {outcome}."))
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+SOLD_STATUSES = ["completed", "delivered", "to_review"]
+
+
+def populate_product_stats(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    OrderItem = apps.get_model("products", "OrderItem")
+    Rating = apps.get_model("products", "Rating")
+    ProductLike = apps.get_model("products", "ProductLike")
+    ProductStats = apps.get_model("products", "ProductStats")
+
+    rows = {pid: ProductStats(product_id=pid) for pid in Product.objects.values_list("id", flat=True)}
+
+    for row in OrderItem.objects.values("product_id").annotate(
+        sold=Sum("quantity", filter=Q(order__status__in=SOLD_STATUSES)),
+        orders=Count("order_id", filter=~Q(order__status="cancelled"), distinct=True),
+    ):
+        rows[row["product_id"]].sold_count = row["sold"] or 0
+        rows[row["product_id"]].order_count = row["orders"] or 0
+
+    for row in Rating.objects.values("product_id").annotate(total=Sum("score"), count=Count("id")):
+        rows[row["product_id"]].rating_sum = row["total"] or 0
+        rows[row["product_id"]].rating_count = row["count"]
+
+    for row in ProductLike.objects.values("product_id").annotate(count=Count("id")):
+        rows[row["product_id"]].like_count = row["count"]
+
+    ProductStats.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0023_productlike'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='products.product')),
+                ('sold_count', models.IntegerField(default=0)),
+                ('order_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('like_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_product_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0025_product_created_id_idx'),
+        ('users', '0013_artisanfollow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductLeaderboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(choices=[('7d', 'Last 7 days'), ('30d', 'Last 30 days'), ('all', 'All time')], max_length=10)),
+                ('metric', models.CharField(choices=[('sold', 'Units sold'), ('orders', 'Orders'), ('like', 'Likes'), ('view', 'Views')], max_length=10)),
+                ('entries', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('artisan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='leaderboards', to='users.artisan')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['artisan', 'window', 'metric'], name='leaderboard_lookup_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:27
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0028_search_query_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('full_sweep', models.BooleanField(default=False)),
+                ('activity_at', models.DateTimeField(blank=True, null=True)),
+                ('activity_id', models.BigIntegerField(default=0)),
+                ('index_version', models.CharField(blank=True, max_length=40)),
+                ('users', models.PositiveIntegerField(default=0)),
+                ('seconds', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['timestamp', 'id'], name='activity_timestamp_id_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+# labels the views used to store instead of the ACTION_CHOICES values
+LEGACY_ACTIONS = {"View": "view", "Added to cart": "cart"}
+
+
+def normalize_actions(apps, schema_editor):
+    UserActivity = apps.get_model("products", "UserActivity")
+    for legacy, action in LEGACY_ACTIONS.items():
+        UserActivity.objects.filter(action=legacy).update(action=action)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0029_recommendation_runs"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_actions, migrations.RunPython.noop),
+    ]
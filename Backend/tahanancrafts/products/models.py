@@ -22,17 +22,29 @@ class Product(models.Model):
     regular_price = models.DecimalField(max_digits=10, decimal_places=2)
     sales_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     main_image = models.ImageField(upload_to='media/products/main/')
+    # resized copies of main_image, filled in by products/images.py:
+    # [{"name", "format", "width", "height", "bytes"}, ...]
+    image_variants = models.JSONField(default=list, blank=True)
     categories = models.ManyToManyField(Category, related_name='products')
     materials = models.ManyToManyField(Material, related_name='products')
     is_preorder = models.BooleanField(default=False)
     total_orders = models.IntegerField(null = True, blank = True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # set by the bulk importer (products/bulk/services.py) to find the ids
+    # of the rows one INSERT wrote on databases that don't return them
+    import_batch = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
 
     artisan = models.ForeignKey(
         'users.Artisan',   # or 'yourappname.Artisan' if Artisan is in another app
         on_delete=models.CASCADE,
         related_name='products'
     )
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the catalog (newest first)
+            models.Index(fields=["-created_at", "-id"], name="product_created_id_idx"),
+        ]
     
     @property
     def effective_price(self):
@@ -48,6 +60,7 @@ class Product(models.Model):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='media/products/others/')
+    image_variants = models.JSONField(default=list, blank=True)
 
 
 
@@ -82,11 +95,16 @@ class Cart(models.Model):
 
 
 class UserActivity(models.Model):
+    ACTION_VIEW = "view"
+    ACTION_LIKE = "like"
+    ACTION_CART = "cart"
+    ACTION_PURCHASE = "purchase"
+
     ACTION_CHOICES = [
-        ("view", "Viewed"),
-        ("like", "Liked"),
-        ("cart", "Added to Cart"),
-        ("purchase", "Purchased"),
+        (ACTION_VIEW, "Viewed"),
+        (ACTION_LIKE, "Liked"),
+        (ACTION_CART, "Added to Cart"),
+        (ACTION_PURCHASE, "Purchased"),
     ]
 
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True)
@@ -95,6 +113,12 @@ class UserActivity(models.Model):
     action = models.CharField(max_length=20, choices=ACTION_CHOICES)
     timestamp = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # activity after the recommendation job's high-water mark
+            models.Index(fields=["timestamp", "id"], name="activity_timestamp_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.user.username} {self.action} {self.product.name}"
 
@@ -241,6 +265,25 @@ class UserRecommendations(models.Model):
 
     def __str__(self):
         return f"Recommendations for {self.user_id} (updated {self.updated_at})"
+
+
+class RecommendationRun(models.Model):
+    """
+    One run of the recommendation job (products/scheduler.py). The latest
+    run's activity high-water mark and similarity index version tell the
+    next one which users need new recommendations; a full sweep redoes all.
+    """
+    full_sweep = models.BooleanField(default=False)
+    activity_at = models.DateTimeField(null=True, blank=True)   # newest UserActivity included
+    activity_id = models.BigIntegerField(default=0)
+    index_version = models.CharField(max_length=40, blank=True)  # similarity arrays it used
+    users = models.PositiveIntegerField(default=0)
+    seconds = models.FloatField(default=0)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        kind = "full sweep" if self.full_sweep else "incremental"
+        return f"Recommendation run {self.created_at} ({kind}, {self.users} users)"
     
 class Delivery(models.Model):
     order = models.OneToOneField(
@@ -395,4 +438,123 @@ class ProductLike(models.Model):
         unique_together = ("user", "product")  # prevent duplicate likes
 
     def __str__(self):
-        return f"{self.user.id} liked {self.product.id}"
\ No newline at end of file
+        return f"{self.user.id} liked {self.product.id}"
+
+class ProductStats(models.Model):
+    """
+    Denormalized per-product counters for the catalog.
+    Kept up to date by deltas in products/product/signals.py and
+    rebuilt from scratch with `manage.py rebuild_product_stats`.
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stats"
+    )
+    sold_count = models.IntegerField(default=0)      # units in sold orders
+    order_count = models.IntegerField(default=0)     # non-cancelled orders
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    like_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return 0.0
+        return round(self.rating_sum / self.rating_count, 1)
+
+    def __str__(self):
+        return f"Stats for product {self.product_id}"
+
+
+class ProductLeaderboard(models.Model):
+    """
+    Precomputed top-N product ranking for one artisan (or globally when
+    artisan is null), one rolling window and one metric.
+    Refreshed by products/leaderboards.py; `entries` is [[product_id, score], ...]
+    ordered best first.
+    """
+    WINDOW_7_DAYS = "7d"
+    WINDOW_30_DAYS = "30d"
+    WINDOW_ALL_TIME = "all"
+
+    WINDOW_CHOICES = [
+        (WINDOW_7_DAYS, "Last 7 days"),
+        (WINDOW_30_DAYS, "Last 30 days"),
+        (WINDOW_ALL_TIME, "All time"),
+    ]
+
+    METRIC_SOLD = "sold"        # units in sold orders
+    METRIC_ORDERS = "orders"    # distinct sold orders
+    METRIC_LIKES = "like"
+    METRIC_VIEWS = "view"
+
+    METRIC_CHOICES = [
+        (METRIC_SOLD, "Units sold"),
+        (METRIC_ORDERS, "Orders"),
+        (METRIC_LIKES, "Likes"),
+        (METRIC_VIEWS, "Views"),
+    ]
+
+    artisan = models.ForeignKey(
+        Artisan,
+        on_delete=models.CASCADE,
+        related_name="leaderboards",
+        null=True,
+        blank=True
+    )
+    window = models.CharField(max_length=10, choices=WINDOW_CHOICES)
+    metric = models.CharField(max_length=10, choices=METRIC_CHOICES)
+    entries = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["artisan", "window", "metric"], name="leaderboard_lookup_idx"),
+        ]
+
+    def __str__(self):
+        scope = f"artisan {self.artisan_id}" if self.artisan_id else "global"
+        return f"Top {self.metric} ({self.window}) for {scope}"
+
+
+class SearchQueryLog(models.Model):
+    """
+    One search made through GeneralSearchView. Written in batches off the
+    request path and rolled up per day into SearchQueryDaily by
+    search/querylog.py; old rows are pruned after the rollup.
+    """
+    query = models.CharField(max_length=255)            # normalized text
+    mode = models.CharField(max_length=20)              # keyword / fuzzy / semantic
+    result_count = models.PositiveIntegerField(default=0)
+    cache_hit = models.BooleanField(default=False)
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        related_name="search_queries",
+        null=True,
+        blank=True
+    )
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.query!r} ({self.result_count} results)"
+
+
+class SearchQueryDaily(models.Model):
+    """ Per-day totals for one normalized query, for the admin search analytics. """
+    day = models.DateField()
+    query = models.CharField(max_length=255)
+    searches = models.PositiveIntegerField(default=0)
+    zero_results = models.PositiveIntegerField(default=0)
+    cache_hits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "query"], name="search_daily_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.query!r} on {self.day}: {self.searches}"
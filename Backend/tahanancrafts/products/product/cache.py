@@ -0,0 +1,233 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+# ---------------------------------------------------------
+# VERSIONED RESPONSE CACHE FOR PUBLIC CATALOG ENDPOINTS
+# ---------------------------------------------------------
+# Every cached response is keyed by endpoint, query params and the current
+# version of each scope it depends on. Writes never delete entries; they
+# bump the scope version so old keys simply stop being looked up.
+
+CATALOG = "catalog"        # anything that shows products
+TAXONOMY = "taxonomy"      # category / material lists
+SNAPSHOT = "snapshot"      # rows and memberships held by the facet snapshot
+
+RESPONSE_TIMEOUT = 60 * 15
+KEY_PREFIX = "catalog-cache"
+
+
+def artisan_scope(artisan_id):
+    return f"artisan:{artisan_id}"
+
+
+def product_scope(product_id):
+    """ Parts of one product's page that only its own ratings change. """
+    return f"product:{product_id}"
+
+
+def _version_key(scope):
+    return f"{KEY_PREFIX}:version:{scope}"
+
+
+def get_versions(scopes):
+    keys = [_version_key(s) for s in scopes]
+    versions = cache.get_many(keys)
+
+    missing = [k for k in keys if k not in versions]
+    for key in missing:
+        # start from the clock, not 1, so an evicted version never
+        # comes back to a number that old responses were stored under
+        cache.add(key, int(time.time() * 1000), timeout=None)
+    if missing:
+        versions.update(cache.get_many(missing))
+
+    return [versions.get(k, 0) for k in keys]
+
+
+def bump_version(*scopes):
+    """ Returns the new version of each scope. """
+    versions = []
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            versions.append(cache.incr(key))
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), timeout=None)
+            versions.append(cache.get(key, 0))
+    return versions
+
+
+# ---------------------------------------------------------
+# HIT / MISS COUNTERS
+# ---------------------------------------------------------
+def _counter_key(endpoint, outcome):
+    return f"{KEY_PREFIX}:counter:{endpoint}:{outcome}"
+
+
+def _count(endpoint, outcome):
+    key = _counter_key(endpoint, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+CACHED_ENDPOINTS = []
+OUTCOMES = ("hit", "not_modified", "miss")
+
+
+def get_counters():
+    keys = [_counter_key(e, o) for e in CACHED_ENDPOINTS for o in OUTCOMES]
+    values = cache.get_many(keys)
+    return {
+        endpoint: {o: values.get(_counter_key(endpoint, o), 0) for o in OUTCOMES}
+        for endpoint in CACHED_ENDPOINTS
+    }
+
+
+# ---------------------------------------------------------
+# INDEPENDENTLY CACHED SECTIONS
+# ---------------------------------------------------------
+# For responses assembled from parts (e.g. the product page): each section
+# has its own key and scopes, so a review only rebuilds the review sections.
+
+def register_endpoint(endpoint):
+    if endpoint not in CACHED_ENDPOINTS:
+        CACHED_ENDPOINTS.append(endpoint)
+
+
+def section_key(endpoint, identity, versions):
+    """ versions: the get_versions() values of the scopes the section depends on """
+    raw = repr((endpoint, identity, versions))
+    return f"{KEY_PREFIX}:section:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def get_sections(keys):
+    """ {name: (endpoint, key)} -> {name: data} for the sections in cache """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return {}
+    found = cache.get_many([key for _, key in keys.values()])
+    sections = {}
+    for name, (endpoint, key) in keys.items():
+        if key in found:
+            sections[name] = found[key]
+            _count(endpoint, "hit")
+        else:
+            _count(endpoint, "miss")
+    return sections
+
+
+def set_sections(values, timeout=RESPONSE_TIMEOUT):
+    """ values: {key: data} """
+    if values and settings.RESPONSE_CACHE_ENABLED:
+        cache.set_many(values, timeout)
+
+
+# ---------------------------------------------------------
+# CHANGE FEEDS
+# ---------------------------------------------------------
+# An append-only list of changed items in the cache, for in-process
+# indexes (search, autocomplete) that every worker keeps: a worker replays
+# the entries after the last position it applied instead of rebuilding.
+# When entries are gone (evicted, or too far behind) it must rebuild.
+
+FEED_TIMEOUT = 60 * 60 * 24
+FEED_MAX_GAP = 1000
+
+
+def _feed_key(feed, part):
+    return f"{KEY_PREFIX}:feed:{feed}:{part}"
+
+
+def record_change(feed, item):
+    seq_key = _feed_key(feed, "seq")
+    try:
+        seq = cache.incr(seq_key)
+    except ValueError:
+        cache.add(seq_key, 0, timeout=None)
+        seq = cache.incr(seq_key)
+    cache.set(_feed_key(feed, seq), item, FEED_TIMEOUT)
+    return seq
+
+
+def feed_position(feed):
+    return cache.get(_feed_key(feed, "seq"), 0)
+
+
+def read_changes(feed, since):
+    """ (position, items after `since`), or (position, None) if the reader must rebuild """
+    position = feed_position(feed)
+    if position == since:
+        return position, []
+    if position < since or position - since > FEED_MAX_GAP:
+        return position, None
+
+    keys = [_feed_key(feed, seq) for seq in range(since + 1, position + 1)]
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        return position, None
+    return position, [found[key] for key in keys]
+
+
+# ---------------------------------------------------------
+# VIEW DECORATOR
+# ---------------------------------------------------------
+def _request_key(endpoint, request, versions):
+    params = sorted(request.query_params.lists())
+    raw = repr((endpoint, request.get_host(), request.path, params, versions))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def cached_get(endpoint, scopes=None, timeout=RESPONSE_TIMEOUT):
+    """
+    Decorate an APIView.get to serve it from the versioned cache.
+
+    scopes(**kwargs) returns the scopes the response depends on
+    (defaults to the whole catalog). The ETag is derived from the cache
+    key, so If-None-Match is answered with 304 before any DB work.
+    With RESPONSE_CACHE_ENABLED off, the view runs as if undecorated.
+    """
+    register_endpoint(endpoint)
+
+    def decorator(get):
+        @wraps(get)
+        def wrapper(view, request, *args, **kwargs):
+            if not settings.RESPONSE_CACHE_ENABLED:
+                return get(view, request, *args, **kwargs)
+
+            scope_list = scopes(**kwargs) if scopes else [CATALOG]
+            digest = _request_key(endpoint, request, get_versions(scope_list))
+            etag = f'"{digest}"'
+
+            if_none_match = request.headers.get("If-None-Match")
+            if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == "*"):
+                _count(endpoint, "not_modified")
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+            cache_key = f"{KEY_PREFIX}:response:{digest}"
+            data = cache.get(cache_key)
+            if data is not None:
+                _count(endpoint, "hit")
+                return Response(data, headers={"ETag": etag})
+
+            _count(endpoint, "miss")
+            response = get(view, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                # streamed bodies are never held in memory, so only the
+                # ETag applies to them
+                if not response.streaming:
+                    cache.set(cache_key, response.data, timeout)
+                response["ETag"] = etag
+            return response
+
+        return wrapper
+
+    return decorator
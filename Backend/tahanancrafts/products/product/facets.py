@@ -0,0 +1,510 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.db import close_old_connections, transaction
+
+from products.models import Category, Material, Product
+from users.models import Artisan
+from .cache import SNAPSHOT, bump_version, get_versions
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# COLUMNAR CATALOG SNAPSHOT FOR FACETED BROWSING
+# ---------------------------------------------------------
+# One row per product: NumPy columns for price / stock / artisan / created,
+# and a packed bitset (1 bit per row) for the live rows and for each
+# category and material. A filter is a handful of vectorized comparisons
+# and bitwise ANDs; a facet count is AND + popcount. Sort orders are kept
+# as precomputed row permutations, so a page never needs a sort.
+#
+# Every worker holds its own snapshot. The worker that saves a product
+# patches its copy on commit; the SNAPSHOT cache version tells the others
+# to rebuild (at most once per REBUILD_INTERVAL seconds). Rebuilds run in a
+# background thread while the old snapshot keeps answering, as in
+# search/autocomplete.py. A removed product's row is freed for the next new
+# one; once more than COMPACT_SHARE of the rows are free, a rebuild packs
+# the live ones together again.
+
+REBUILD_INTERVAL = 30
+INITIAL_CAPACITY = 1024
+COMPACT_SHARE = 0.25
+
+SORTS = ("newest", "oldest", "price_asc", "price_desc")
+
+
+def _bit_bytes(capacity):
+    return (capacity + 7) // 8
+
+
+def _bit(row):
+    return row >> 3, 0x80 >> (row & 7)     # np.packbits order: first row = high bit
+
+
+class BitTable:
+    """
+    One packed bitset per key (category / material id), stacked in a
+    matrix so a facet count over every key is a single AND + popcount.
+    """
+
+    def __init__(self, capacity):
+        self.keys = []
+        self.index = {}
+        self.matrix = np.zeros((0, _bit_bytes(capacity)), dtype=np.uint8)
+
+    def grow(self, capacity):
+        bigger = np.zeros((len(self.keys), _bit_bytes(capacity)), dtype=np.uint8)
+        bigger[:, : self.matrix.shape[1]] = self.matrix
+        self.matrix = bigger
+
+    def _row_of_key(self, key):
+        if key not in self.index:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.matrix = np.vstack([self.matrix, np.zeros((1, self.matrix.shape[1]), dtype=np.uint8)])
+        return self.index[key]
+
+    def load(self, rows_by_key, capacity):
+        self.keys = list(rows_by_key)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        members = np.zeros((len(self.keys), capacity), dtype=bool)
+        for i, key in enumerate(self.keys):
+            members[i, rows_by_key[key]] = True
+        self.matrix = np.packbits(members, axis=1)
+
+    def set_row(self, row, wanted):
+        byte, mask = _bit(row)
+        self.matrix[:, byte] &= ~mask & 0xFF
+        for key in wanted:
+            # may add a row to the matrix: resolve it before indexing
+            i = self._row_of_key(key)
+            self.matrix[i, byte] |= mask
+
+    def keys_of(self, row):
+        byte, mask = _bit(row)
+        return [self.keys[i] for i in np.flatnonzero(self.matrix[:, byte] & mask)]
+
+    def any_of(self, keys, nbytes):
+        """ OR of the bitsets for `keys` (unknown keys match nothing) """
+        rows = [self.index[k] for k in keys if k in self.index]
+        if not rows:
+            return np.zeros(nbytes, dtype=np.uint8)
+        return np.bitwise_or.reduce(self.matrix[rows, :nbytes], axis=0)
+
+    def counts(self, mask):
+        """ {key: number of rows set in both the key's bitset and mask} """
+        if not self.keys:
+            return {}
+        totals = np.bitwise_count(self.matrix[:, : len(mask)] & mask).sum(axis=1)
+        return {self.keys[i]: int(totals[i]) for i in np.flatnonzero(totals)}
+
+
+class CatalogSnapshot:
+    def __init__(self, capacity=INITIAL_CAPACITY, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.lock = threading.RLock()
+
+        self.size = 0
+        self.capacity = 0
+        self.row_of = {}
+        self.free = []      # rows of removed products, reused by upsert
+
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.price = np.zeros(0, dtype=np.float64)
+        self.stock = np.zeros(0, dtype=np.int64)
+        self.artisan = np.zeros(0, dtype=np.int32)     # index into artisan_keys
+        self.artisan_keys = []
+        self.artisan_index = {}
+        self.created = np.zeros(0, dtype=np.int64)      # epoch microseconds
+        self.alive = np.zeros(0, dtype=np.uint8)
+        self.categories = BitTable(0)
+        self.materials = BitTable(0)
+
+        self.category_names = {}
+        self.material_names = {}
+        self.artisan_names = {}
+
+        self.orders = {}
+        self._grow(capacity)
+
+    # ---------- storage ----------
+    def _grow(self, capacity):
+        capacity = max(8, (capacity + 7) // 8 * 8)
+        if capacity <= self.capacity:
+            return
+
+        def grown(array):
+            bigger = np.zeros(capacity, dtype=array.dtype)
+            bigger[: self.size] = array[: self.size]
+            return bigger
+
+        self.ids, self.price, self.stock = grown(self.ids), grown(self.price), grown(self.stock)
+        self.artisan, self.created = grown(self.artisan), grown(self.created)
+        alive = np.zeros(_bit_bytes(capacity), dtype=np.uint8)
+        alive[: len(self.alive)] = self.alive
+        self.alive = alive
+        self.categories.grow(capacity)
+        self.materials.grow(capacity)
+        self.capacity = capacity
+
+    def _sort_keys(self, sort, rows):
+        """ (primary, secondary) keys of `rows` that `sort` orders ascending """
+        ids, price, created = self.ids[rows], self.price[rows], self.created[rows]
+        return {
+            "newest": (-created, -ids),
+            "oldest": (created, ids),
+            "price_asc": (price, -ids),
+            "price_desc": (-price, -ids),
+        }[sort]
+
+    def _resort(self):
+        rows = np.arange(self.size)
+        self.orders = {}
+        for sort in SORTS:
+            primary, secondary = self._sort_keys(sort, rows)
+            self.orders[sort] = np.lexsort((secondary, primary))
+
+    def _place(self, row, new):
+        """ Move one row to its place in every order: O(log n) search plus a copy, no full sort. """
+        for sort in SORTS:
+            order = self.orders[sort]
+            if not new:
+                order = np.delete(order, np.flatnonzero(order == row))
+            primary, secondary = self._sort_keys(sort, order)
+            (key,), (tie,) = self._sort_keys(sort, np.array([row]))
+            low, high = np.searchsorted(primary, key, "left"), np.searchsorted(primary, key, "right")
+            at = low + np.searchsorted(secondary[low:high], tie)
+            self.orders[sort] = np.insert(order, at, row)
+
+    # ---------- loading / patching ----------
+    def load(self, rows, categories, materials):
+        """ rows: [(id, price, stock, artisan_id, created_us)], links: {product_id: {ids}} """
+        with self.lock:
+            n = len(rows)
+            self._grow(n)
+            if n:
+                ids, price, stock, artisan, created = zip(*rows)
+                self.ids[:n], self.price[:n], self.stock[:n] = ids, price, stock
+                self.artisan_keys = sorted(set(artisan))
+                self.artisan_index = {a: i for i, a in enumerate(self.artisan_keys)}
+                self.artisan[:n] = [self.artisan_index[a] for a in artisan]
+                self.created[:n] = created
+            self.size = n
+            self.row_of = {pid: row for row, pid in enumerate(self.ids[:n].tolist())}
+            self.free = []
+
+            live = np.zeros(self.capacity, dtype=bool)
+            live[:n] = True
+            self.alive = np.packbits(live)
+
+            for table, links in ((self.categories, categories), (self.materials, materials)):
+                rows_by_key = defaultdict(list)
+                for product_id, keys in links.items():
+                    row = self.row_of.get(product_id)
+                    if row is not None:
+                        for key in keys:
+                            rows_by_key[key].append(row)
+                table.load(rows_by_key, self.capacity)
+
+            self._resort()
+
+    def upsert(self, values, category_ids, material_ids):
+        product_id, price, stock, artisan_id, created = values
+        with self.lock:
+            row = self.row_of.get(product_id)
+            new = row is None
+            if new:
+                if self.free:
+                    row = self.free.pop()
+                else:
+                    row = self.size
+                    if row >= self.capacity:
+                        self._grow(self.capacity * 2)
+                    self.size += 1
+                self.row_of[product_id] = row
+
+            self.ids[row], self.price[row], self.stock[row] = product_id, price, stock
+            if artisan_id not in self.artisan_index:
+                self.artisan_index[artisan_id] = len(self.artisan_keys)
+                self.artisan_keys.append(artisan_id)
+            self.artisan[row], self.created[row] = self.artisan_index[artisan_id], created
+            byte, mask = _bit(row)
+            self.alive[byte] |= mask
+            self.categories.set_row(row, category_ids)
+            self.materials.set_row(row, material_ids)
+            self._place(row, new)
+
+    def remove(self, product_id):
+        """ Drop a product; its row is cleared and kept for the next new product. """
+        with self.lock:
+            row = self.row_of.pop(product_id, None)
+            if row is None:
+                return
+            byte, mask = _bit(row)
+            self.alive[byte] &= ~mask & 0xFF
+            self.categories.set_row(row, ())
+            self.materials.set_row(row, ())
+            for sort in SORTS:
+                order = self.orders[sort]
+                self.orders[sort] = order[order != row]
+            self.free.append(row)
+
+    def fragmented(self):
+        """ Whether enough rows are free that a rebuild should pack the rest. """
+        return len(self.free) > COMPACT_SHARE * self.size
+
+    # ---------- querying ----------
+    def query(self, categories=(), materials=(), artisans=(), min_price=None, max_price=None,
+              in_stock=False, sort="newest", offset=0, limit=24):
+        with self.lock:
+            n = self.size
+            nbytes = _bit_bytes(n)
+            alive = self.alive[:nbytes]
+
+            price = self.price[:n]
+            if min_price is not None or max_price is not None:
+                in_range = np.ones(n, dtype=bool)
+                if min_price is not None:
+                    in_range &= price >= min_price
+                if max_price is not None:
+                    in_range &= price <= max_price
+                base = alive & np.packbits(in_range)
+            else:
+                base = alive
+            stock_bits = np.packbits(self.stock[:n] > 0)
+
+            # absent filters are None and simply skipped
+            filters = {
+                "categories": self.categories.any_of(categories, nbytes) if categories else None,
+                "materials": self.materials.any_of(materials, nbytes) if materials else None,
+                "artisans": self._artisan_bits(artisans, n) if artisans else None,
+                "in_stock": stock_bits if in_stock else None,
+            }
+
+            def combined(skip=None):
+                mask = base
+                for name, bits in filters.items():
+                    if bits is not None and name != skip:
+                        mask = mask & bits
+                return mask
+
+            matched = combined()
+            selected = np.unpackbits(matched, count=n).view(bool)
+            order = self.orders[sort if sort in self.orders else "newest"]
+            ranked = order[selected[order]]
+            page_ids = self.ids[ranked[offset: offset + limit]].tolist()
+
+            # each facet is counted with every filter except its own
+            artisan_rows = np.unpackbits(combined("artisans"), count=n).view(bool)
+            artisan_counts = np.bincount(self.artisan[:n][artisan_rows], minlength=len(self.artisan_keys))
+            matched_prices = price[selected]
+
+            facets = {
+                "categories": self._facet(self.categories.counts(combined("categories")), self.category_names),
+                "materials": self._facet(self.materials.counts(combined("materials")), self.material_names),
+                "artisans": self._facet(
+                    {self.artisan_keys[i]: int(artisan_counts[i]) for i in np.flatnonzero(artisan_counts)},
+                    self.artisan_names,
+                ),
+                "in_stock": int(np.bitwise_count(combined("in_stock") & stock_bits).sum()),
+                "price": {
+                    "min": float(matched_prices.min()) if matched_prices.size else None,
+                    "max": float(matched_prices.max()) if matched_prices.size else None,
+                },
+            }
+
+            return {"count": int(len(ranked)), "ids": page_ids, "facets": facets}
+
+    def _artisan_bits(self, artisan_ids, n):
+        codes = [self.artisan_index[a] for a in artisan_ids if a in self.artisan_index]
+        return np.packbits(np.isin(self.artisan[:n], codes))
+
+    def _facet(self, counts, names):
+        facet = [{"id": key, "name": names.get(key, ""), "count": count} for key, count in counts.items()]
+        facet.sort(key=lambda item: (-item["count"], item["name"]))
+        return facet
+
+    def memberships(self, product_id):
+        """ (category ids, material ids) of one product, read from the bitsets """
+        with self.lock:
+            row = self.row_of.get(product_id)
+            if row is None:
+                return [], []
+            return self.categories.keys_of(row), self.materials.keys_of(row)
+
+
+# ---------------------------------------------------------
+# BUILD / PATCH FROM THE DATABASE
+# ---------------------------------------------------------
+def _price(regular_price, sales_price):
+    # same "effective price" the search results show
+    return float(sales_price or regular_price)
+
+
+def _created(value):
+    return int(value.timestamp() * 1_000_000)
+
+
+def _links(through, column, product_ids=None):
+    qs = through.objects.all()
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=product_ids)
+    links = defaultdict(set)
+    for product_id, other_id in qs.values_list("product_id", column).iterator(chunk_size=5000):
+        links[product_id].add(other_id)
+    return links
+
+
+def _product_rows(queryset):
+    return [
+        (pid, _price(regular, sales), stock, artisan_id, _created(created))
+        for pid, regular, sales, stock, artisan_id, created in queryset.values_list(
+            "id", "regular_price", "sales_price", "stock_quantity", "artisan_id", "created_at"
+        ).order_by("id").iterator(chunk_size=5000)
+    ]
+
+
+def build_snapshot():
+    started = time.monotonic()
+    version, = get_versions([SNAPSHOT])
+
+    rows = _product_rows(Product.objects.all())
+    snapshot = CatalogSnapshot(capacity=max(INITIAL_CAPACITY, len(rows) * 5 // 4), version=version)
+    snapshot.category_names = dict(Category.objects.values_list("id", "name"))
+    snapshot.material_names = dict(Material.objects.values_list("id", "name"))
+    snapshot.artisan_names = dict(Artisan.objects.values_list("id", "name"))
+    snapshot.load(
+        rows,
+        _links(Product.categories.through, "category_id"),
+        _links(Product.materials.through, "material_id"),
+    )
+
+    logger.info("Built catalog snapshot: %s products in %.0f ms", len(rows), (time.monotonic() - started) * 1000)
+    return snapshot
+
+
+_snapshot = None
+_build_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+
+def _rebuild():
+    global _snapshot
+    fresh = build_snapshot()
+    with _build_lock:
+        _snapshot = fresh
+
+
+def _rebuild_in_background():
+    def run():
+        close_old_connections()
+        try:
+            _rebuild()
+        except Exception:
+            logger.exception("Could not rebuild the catalog snapshot")
+        finally:
+            _rebuilding.clear()
+            close_old_connections()
+
+    with _build_lock:
+        if _rebuilding.is_set():
+            return
+        _rebuilding.set()
+    threading.Thread(target=run, name="catalog-snapshot-rebuild", daemon=True).start()
+
+
+def get_snapshot():
+    """
+    The current snapshot. Only the first one is built inline; when another
+    process changed the catalog, or too many rows are free, the old one is
+    served while a new one is built.
+    """
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is None:
+        with _build_lock:
+            if _snapshot is None:
+                _snapshot = build_snapshot()
+            return _snapshot
+
+    current, = get_versions([SNAPSHOT])
+    stale = current != snapshot.version and time.monotonic() - snapshot.built_at >= REBUILD_INTERVAL
+    if stale or snapshot.fragmented():
+        _rebuild_in_background()
+    return snapshot
+
+
+def warm_snapshot():
+    """ Build the snapshot at worker start; never fatal. """
+    try:
+        get_snapshot()
+    except Exception:
+        logger.exception("Could not build the catalog snapshot at startup")
+
+
+def _add_names(names, model, ids):
+    unknown = [i for i in ids if i not in names]
+    if unknown:
+        names.update(model.objects.filter(id__in=unknown).values_list("id", "name"))
+
+
+def _adopt(new_version, snapshot):
+    # keep our patched copy current unless someone else also changed things
+    if snapshot.version is not None and new_version == snapshot.version + 1:
+        snapshot.version = new_version
+
+
+def _patchable(new_version, snapshot):
+    """
+    Whether our bump is the only change since the snapshot was built; if
+    not (another worker's save, mark_stale()), patching would leave a stale
+    table current, so a rebuild starts instead and the old table is served
+    until it is done.
+    """
+    if snapshot.version is not None and new_version == snapshot.version + 1:
+        return True
+    _rebuild_in_background()
+    return False
+
+
+def patch_product(product_id):
+    """ Re-read one product into this worker's snapshot after the commit. """
+    def apply():
+        snapshot = _snapshot
+        new_version, = bump_version(SNAPSHOT)
+        if snapshot is None or not _patchable(new_version, snapshot):
+            return
+
+        rows = _product_rows(Product.objects.filter(id=product_id))
+        if not rows:
+            snapshot.remove(product_id)
+        else:
+            category_ids = _links(Product.categories.through, "category_id", [product_id])[product_id]
+            material_ids = _links(Product.materials.through, "material_id", [product_id])[product_id]
+            _add_names(snapshot.category_names, Category, category_ids)
+            _add_names(snapshot.material_names, Material, material_ids)
+            _add_names(snapshot.artisan_names, Artisan, [rows[0][3]])
+            snapshot.upsert(rows[0], category_ids, material_ids)
+        _adopt(new_version, snapshot)
+
+    transaction.on_commit(apply)
+
+
+def remove_product(product_id):
+    def apply():
+        snapshot = _snapshot
+        new_version, = bump_version(SNAPSHOT)
+        if snapshot is not None and _patchable(new_version, snapshot):
+            snapshot.remove(product_id)
+            _adopt(new_version, snapshot)
+
+    transaction.on_commit(apply)
+
+
+def mark_stale():
+    """ Names or memberships changed in bulk: every worker rebuilds. """
+    transaction.on_commit(lambda: bump_version(SNAPSHOT))
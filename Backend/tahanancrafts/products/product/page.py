@@ -0,0 +1,187 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.db.models import Count
+
+from products.models import Product, Rating
+from products.recommender import similar_product_ids
+from products.reviews.serializers import ProductRatingSerializer
+from .cache import (
+    CATALOG, artisan_scope, get_sections, get_versions, product_scope, register_endpoint, section_key, set_sections,
+)
+from .serializers import ProductReadSerializer, ProductSerializer, product_read_queryset
+from .stats import get_stats
+
+# ---------------------------------------------------------
+# COMPOSITE PRODUCT PAGE
+# ---------------------------------------------------------
+# One response with everything the product page shows. The product is
+# loaded once (with artisan, stats, images, categories, materials) and every
+# section is built from it; sections that need their own query run on a
+# small thread pool. Each section is cached on its own key and scopes.
+
+ENDPOINT = "product-page"
+REVIEWS_PAGE_SIZE = 10
+SIMILAR_LIMIT = 8
+
+# section -> the scopes it depends on: the whole catalog, the product's
+# artisan, or the product's own ratings. A review rebuilds the detail (its
+# average rating) and the rating sections but leaves the artisan card.
+SECTION_SCOPES = {
+    "detail": ("catalog", "artisan"),     # embeds the artisan name / photo
+    "artisan": ("artisan",),
+    "rating_summary": ("product",),
+    "reviews": ("product",),
+    "similar": ("catalog",),
+}
+
+for _name in SECTION_SCOPES:
+    register_endpoint(f"{ENDPOINT}:{_name}")
+
+_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="product-page")
+
+
+def similar_products(product, limit=SIMILAR_LIMIT):
+    """
+    The product's nearest neighbours by text (products/recommender.py);
+    without those, products sharing a category, or the newest ones when
+    fewer than 3 do.
+    """
+    candidates = Product.objects.exclude(id=product.id).prefetch_related("images", "categories", "materials")
+
+    nearest = similar_product_ids(product.id, limit)
+    if nearest:
+        found = candidates.in_bulk(nearest)
+        return [found[pid] for pid in nearest if pid in found]
+
+    category_ids = [c.id for c in product.categories.all()]
+
+    same_category = list(candidates.filter(categories__in=category_ids).distinct()[:limit])
+    if len(same_category) >= 3:
+        return same_category
+    return list(candidates.order_by("-created_at")[:limit])
+
+
+# ---------- sections built from the loaded product ----------
+def build_detail(product):
+    return ProductReadSerializer(product).data
+
+
+def build_artisan(product):
+    artisan = product.artisan
+    return {
+        "id": artisan.id,
+        "name": artisan.name,
+        "short_description": artisan.short_description,
+        "location": artisan.location,
+        "main_photo": artisan.main_photo.url if artisan.main_photo else None,
+    }
+
+
+# ---------- sections with their own query ----------
+def build_rating_summary(product):
+    stats = get_stats(product)
+    counts = dict(
+        Rating.objects.filter(product_id=product.id)
+        .values_list("score")
+        .annotate(n=Count("id"))
+    )
+    return {
+        "average": stats.average_rating,
+        "count": stats.rating_count,
+        "distribution": {str(score): counts.get(score, 0) for score in range(1, 6)},
+    }
+
+
+def build_reviews(product):
+    ratings = list(
+        Rating.objects.filter(product_id=product.id)
+        .select_related("user")
+        .order_by("-created_at")[: REVIEWS_PAGE_SIZE + 1]
+    )
+    for rating in ratings:
+        rating.product = product  # shared, instead of joining it again
+
+    return {
+        "count": get_stats(product).rating_count,
+        "has_more": len(ratings) > REVIEWS_PAGE_SIZE,
+        "results": ProductRatingSerializer(ratings[:REVIEWS_PAGE_SIZE], many=True).data,
+    }
+
+
+def build_similar(product):
+    return ProductSerializer(similar_products(product), many=True).data
+
+
+BUILDERS = {
+    "detail": build_detail,
+    "artisan": build_artisan,
+    "rating_summary": build_rating_summary,
+    "reviews": build_reviews,
+    "similar": build_similar,
+}
+QUERYING_SECTIONS = ("rating_summary", "reviews", "similar")
+
+
+def _run_in_thread(builder, product):
+    # worker threads get their own DB connection; drop it like a request would
+    close_old_connections()
+    try:
+        return builder(product)
+    finally:
+        close_old_connections()
+
+
+def _artisan_id(product_id, catalog_version):
+    """ Owner of the product (cached), or None if it does not exist. """
+    key = section_key(f"{ENDPOINT}:owner", product_id, [catalog_version])
+    artisan_id = cache.get(key)
+    if artisan_id is None:
+        artisan_id = Product.objects.filter(id=product_id).values_list("artisan_id", flat=True).first()
+        if artisan_id is not None:
+            cache.set(key, artisan_id)
+    return artisan_id
+
+
+def build_product_page(product_id):
+    """ {section: data} for the product page, or None if the product is gone. """
+    catalog_version, = get_versions([CATALOG])
+    artisan_id = _artisan_id(product_id, catalog_version)
+    if artisan_id is None:
+        return None
+
+    scopes = {"catalog": CATALOG, "artisan": artisan_scope(artisan_id), "product": product_scope(product_id)}
+    versions = dict(zip(scopes, get_versions(list(scopes.values()))))
+    keys = {
+        name: (
+            f"{ENDPOINT}:{name}",
+            section_key(f"{ENDPOINT}:{name}", product_id, [versions[scope] for scope in depends_on]),
+        )
+        for name, depends_on in SECTION_SCOPES.items()
+    }
+
+    page = get_sections(keys)
+    missing = [name for name in SECTION_SCOPES if name not in page]
+    if not missing:
+        return page
+
+    product = product_read_queryset(Product.objects.filter(id=product_id)).first()
+    if product is None:
+        return None
+
+    # other threads can't see rows of an open transaction, so stay inline then
+    querying = [name for name in missing if name in QUERYING_SECTIONS]
+    if len(querying) > 1 and not connection.in_atomic_block:
+        futures = {name: _executor.submit(_run_in_thread, BUILDERS[name], product) for name in querying}
+    else:
+        futures = {}
+
+    for name in missing:
+        if name not in futures:
+            page[name] = BUILDERS[name](product)
+    for name, future in futures.items():
+        page[name] = future.result()
+
+    set_sections({keys[name][1]: page[name] for name in missing})
+    return {name: page[name] for name in SECTION_SCOPES}
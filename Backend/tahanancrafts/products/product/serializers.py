@@ -2,7 +2,9 @@ from requests import request
 from rest_framework import serializers  # For creating API serializers
 from products.models import Product, Category, Material, ProductImage, Rating
 from users.models import Artisan
-from django.db.models import Avg
+from django.db.models import Prefetch
+from .stats import get_stats
+from products.images import thumbnail_url, variant_urls
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,9 +17,14 @@ class MaterialSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants']
+
+    def get_variants(self, obj):
+        return variant_urls(obj.image_variants)
 
 class ProductSerializer(serializers.ModelSerializer):
     artisan = serializers.PrimaryKeyRelatedField(read_only=True)  # ← FIX
@@ -29,12 +36,13 @@ class ProductSerializer(serializers.ModelSerializer):
         queryset=Material.objects.all(), many=True
     )
     images = ProductImageSerializer(many=True, required=False)
+    image_variants = serializers.JSONField(read_only=True)
     brandName = serializers.CharField(required=False, allow_null=True, allow_blank=True)
     long_description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['import_batch']  # bulk importer bookkeeping
 
 
     def create(self, validated_data):
@@ -106,7 +114,9 @@ class ProductReadSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     artisan = ArtisanSerializer(read_only=True)
     avg_rating = serializers.SerializerMethodField()
-    order_count = serializers.IntegerField(read_only=True)
+    order_count = serializers.SerializerMethodField()
+    thumbnail = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
 
     class Meta:
@@ -115,14 +125,45 @@ class ProductReadSerializer(serializers.ModelSerializer):
             "id", "name", "description", "long_description",   # ✅ ADD THIS
             "brandName",
             "stock_quantity", "regular_price", "sales_price",
-            "main_image", "created_at", "categories",
+            "main_image", "thumbnail", "image_variants", "created_at", "categories",
             "materials", "images", "artisan","avg_rating","total_orders", "order_count"
         ]
 
 
+    # Annotated values (rating_avg / order_count) win when the queryset has
+    # them; otherwise the ProductStats row loaded by product_read_queryset().
     def get_avg_rating(self, obj):
-        avg = Rating.objects.filter(product=obj).aggregate(Avg("score"))["score__avg"]
-        return round(avg, 1) if avg else 0.0
+        if hasattr(obj, "rating_avg"):
+            return round(obj.rating_avg, 1) if obj.rating_avg else 0.0
+        return get_stats(obj).average_rating
+
+    def get_order_count(self, obj):
+        if "order_count" in obj.__dict__:
+            return obj.order_count or 0
+        return get_stats(obj).order_count
+
+    # listing-size WebP of main_image (original upload until it is built)
+    def get_thumbnail(self, obj):
+        return thumbnail_url(obj.main_image, obj.image_variants)
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants)
+
+
+def product_read_queryset(queryset=None):
+    """
+    Queryset for ProductReadSerializer: joins artisan and stats and
+    prefetches images, categories and materials so serializing any number
+    of products costs a constant number of queries.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+
+    return queryset.select_related("artisan", "stats").prefetch_related(
+        Prefetch("images", queryset=ProductImage.objects.only("id", "product_id", "image", "image_variants")),
+        "categories",
+        "materials",
+    )
 
 
 class UpdateProductSerializer(serializers.ModelSerializer):
@@ -201,9 +242,10 @@ class ProductListSerializer(serializers.ModelSerializer):
         fields = ("id","name","thumbnail","regular_price","sales_price","stock_quantity","brandName","sold_count")
 
     def get_thumbnail(self, obj):
-        # prefer a thumbnail field or create a small URL for the main image
-        if obj.images.exists():
-            return obj.images.first().thumbnail_url
+        # prefer the first gallery image, then the main image, at listing size
+        gallery = list(obj.images.all())
+        if gallery:
+            return thumbnail_url(gallery[0].image, gallery[0].image_variants)
         if obj.main_image:
-            return obj.main_image.url  # or a resized url
+            return thumbnail_url(obj.main_image, obj.image_variants)
         return "/static/images/default-thumb.png"
@@ -1,11 +1,340 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import m2m_changed, post_init, post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from .models import OrderItem, Product
-from django.db.models import Sum, Q
-
-@receiver([post_save, post_delete], sender=OrderItem)
-def update_product_sold_count(sender, instance, **kwargs):
-    product = instance.product
-    valid = ['completed','delivered','to_receive','to_review']
-    total = product.order_items.filter(order__status__in=valid).aggregate(total=Sum('quantity'))['total'] or 0
-    Product.objects.filter(pk=product.pk).update(sold_count=total)
\ No newline at end of file
+from users.models import Artisan
+from products.models import (
+    Category, Material, Order, OrderItem, Product, ProductImage, ProductLike, ProductStats, Rating,
+)
+from .cache import CATALOG, TAXONOMY, artisan_scope, bump_version, product_scope
+from . import facets
+from products.images import queue_variants
+from search import autocomplete, index as search_index
+from .stats import apply_delta, apply_deltas, is_counted, is_sold, order_status_deltas
+
+
+# ---------------------------------------------------------
+# REMEMBER LOADED VALUES SO SAVES CAN BE TURNED INTO DELTAS
+# ---------------------------------------------------------
+# __dict__ is used so deferred fields never trigger a query.
+
+@receiver(post_init, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    instance._stats_status = instance.__dict__.get("status")
+
+
+@receiver(post_init, sender=OrderItem)
+def remember_order_item_quantity(sender, instance, **kwargs):
+    instance._stats_quantity = instance.__dict__.get("quantity")
+
+
+@receiver(post_init, sender=Rating)
+def remember_rating_score(sender, instance, **kwargs):
+    instance._stats_score = instance.__dict__.get("score")
+
+
+# ---------------------------------------------------------
+# PRODUCT
+# ---------------------------------------------------------
+@receiver(post_save, sender=Product)
+def create_product_stats(sender, instance, created, **kwargs):
+    if created:
+        ProductStats.objects.get_or_create(product=instance)
+
+
+# ---------------------------------------------------------
+# ORDERS
+# ---------------------------------------------------------
+@receiver(post_save, sender=Order)
+def update_stats_on_order_status(sender, instance, created, **kwargs):
+    old_status = instance._stats_status
+    instance._stats_status = instance.status
+
+    # a brand-new order has no items yet; they are counted as they are added
+    if created or old_status is None or old_status == instance.status:
+        return
+
+    deltas = order_status_deltas(instance.pk, old_status, instance.status)
+    if deltas:
+        apply_deltas(deltas)
+        if is_sold(old_status) != is_sold(instance.status):
+            invalidate_product_caches(deltas.keys())
+
+
+@receiver(post_save, sender=OrderItem)
+def update_stats_on_order_item_save(sender, instance, created, **kwargs):
+    old_quantity = 0 if created else (instance._stats_quantity or 0)
+    instance._stats_quantity = instance.quantity
+
+    status = Order.objects.filter(pk=instance.order_id).values_list("status", flat=True).first()
+    if status is None:
+        return
+
+    deltas = {}
+    if is_sold(status):
+        deltas["sold_count"] = instance.quantity - old_quantity
+        if deltas["sold_count"]:
+            invalidate_product_caches([instance.product_id])
+
+    if created and is_counted(status):
+        already_counted = (
+            OrderItem.objects.filter(order_id=instance.order_id, product_id=instance.product_id)
+            .exclude(pk=instance.pk)
+            .exists()
+        )
+        if not already_counted:
+            deltas["order_count"] = 1
+
+    apply_delta(instance.product_id, **deltas)
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_stats_on_order_item_delete(sender, instance, **kwargs):
+    status = Order.objects.filter(pk=instance.order_id).values_list("status", flat=True).first()
+    if status is None:
+        return
+
+    deltas = {}
+    if is_sold(status):
+        deltas["sold_count"] = -instance.quantity
+        invalidate_product_caches([instance.product_id])
+
+    if is_counted(status):
+        still_counted = OrderItem.objects.filter(
+            order_id=instance.order_id, product_id=instance.product_id
+        ).exists()
+        if not still_counted:
+            deltas["order_count"] = -1
+
+    apply_delta(instance.product_id, **deltas)
+
+
+# ---------------------------------------------------------
+# RATINGS
+# ---------------------------------------------------------
+@receiver(post_save, sender=Rating)
+def update_stats_on_rating_save(sender, instance, created, **kwargs):
+    old_score = 0 if created else (instance._stats_score or 0)
+    instance._stats_score = instance.score
+
+    apply_delta(
+        instance.product_id,
+        rating_sum=int(instance.score) - int(old_score),
+        rating_count=1 if created else 0,
+    )
+
+
+@receiver(post_delete, sender=Rating)
+def update_stats_on_rating_delete(sender, instance, **kwargs):
+    apply_delta(instance.product_id, rating_sum=-int(instance.score), rating_count=-1)
+
+
+# ---------------------------------------------------------
+# LIKES
+# ---------------------------------------------------------
+@receiver(post_save, sender=ProductLike)
+def update_stats_on_like(sender, instance, created, **kwargs):
+    if created:
+        apply_delta(instance.product_id, like_count=1)
+
+
+@receiver(post_delete, sender=ProductLike)
+def update_stats_on_unlike(sender, instance, **kwargs):
+    apply_delta(instance.product_id, like_count=-1)
+
+
+# ---------------------------------------------------------
+# RESPONSE CACHE INVALIDATION
+# ---------------------------------------------------------
+# Responses show sold units, so orders invalidate them only when those
+# change: an order moving into or out of SOLD_STATUSES, or items of a sold
+# order. Checkouts and payment steps leave the cache alone; order counts
+# catch up within RESPONSE_TIMEOUT.
+
+def invalidate_product_caches(product_ids):
+    artisan_ids = set(
+        Product.objects.filter(id__in=list(product_ids)).values_list("artisan_id", flat=True)
+    )
+    bump_version(CATALOG, *[artisan_scope(a) for a in artisan_ids])
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_on_product_change(sender, instance, **kwargs):
+    bump_version(CATALOG, artisan_scope(instance.artisan_id))
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+@receiver(m2m_changed, sender=Product.materials.through)
+def invalidate_on_product_tags_change(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        if isinstance(instance, Product):
+            bump_version(CATALOG, artisan_scope(instance.artisan_id))
+        else:
+            bump_version(CATALOG, TAXONOMY)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_on_product_child_change(sender, instance, **kwargs):
+    invalidate_product_caches([instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Rating)
+def invalidate_on_rating_change(sender, instance, **kwargs):
+    # lists show average ratings; the artisan's shop and card do not
+    bump_version(CATALOG, product_scope(instance.product_id))
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Material)
+def invalidate_on_taxonomy_change(sender, instance, **kwargs):
+    # product payloads embed category / material names too
+    bump_version(TAXONOMY, CATALOG)
+
+
+@receiver(post_save, sender=Artisan)
+def invalidate_on_artisan_change(sender, instance, **kwargs):
+    bump_version(artisan_scope(instance.pk))
+
+
+@receiver(post_delete, sender=Artisan)
+def invalidate_on_artisan_delete(sender, instance, **kwargs):
+    # its products are deleted with it, and the catalog shows artisan names
+    bump_version(CATALOG, artisan_scope(instance.pk))
+
+
+# ---------------------------------------------------------
+# FACET SNAPSHOT (products/product/facets.py)
+# ---------------------------------------------------------
+@receiver(post_save, sender=Product)
+def patch_snapshot_on_product_save(sender, instance, **kwargs):
+    facets.patch_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def patch_snapshot_on_product_delete(sender, instance, **kwargs):
+    facets.remove_product(instance.pk)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+@receiver(m2m_changed, sender=Product.materials.through)
+def patch_snapshot_on_tags_change(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        if isinstance(instance, Product):
+            facets.patch_product(instance.pk)
+        else:
+            facets.mark_stale()
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Material)
+@receiver([post_save, post_delete], sender=Artisan)
+def rebuild_snapshot_on_names_change(sender, instance, **kwargs):
+    facets.mark_stale()
+
+
+# ---------------------------------------------------------
+# SEARCH INDEX (search/index.py)
+# ---------------------------------------------------------
+# Product documents embed their categories, materials and artisan location,
+# so renaming one of those re-indexes every product that shows it.
+
+@receiver(post_init, sender=Artisan)
+def remember_artisan_location(sender, instance, **kwargs):
+    instance._search_location = instance.__dict__.get("location")
+
+
+@receiver([post_save, post_delete], sender=Product)
+def reindex_product(sender, instance, **kwargs):
+    search_index.reindex_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+@receiver(m2m_changed, sender=Product.materials.through)
+def reindex_on_tags_change(sender, instance, action, pk_set, **kwargs):
+    if action not in ("pre_clear", "post_add", "post_remove", "post_clear"):
+        return
+    if isinstance(instance, Product):
+        if action != "pre_clear":
+            search_index.reindex_products([instance.pk])
+    elif action == "pre_clear":
+        # the links are gone after the clear, so collect the products now
+        search_index.reindex_products(instance.products.values_list("id", flat=True))
+    elif pk_set:
+        search_index.reindex_products(pk_set)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Material)
+def reindex_on_taxonomy_rename(sender, instance, created, **kwargs):
+    if not created:
+        search_index.reindex_products(instance.products.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Material)
+def reindex_on_taxonomy_delete(sender, instance, **kwargs):
+    search_index.reindex_products(instance.products.values_list("id", flat=True))
+
+
+@receiver(post_save, sender=Artisan)
+def reindex_artisan(sender, instance, created, **kwargs):
+    docs = [(search_index.ARTISAN, instance.pk)]
+    if not created and instance.location != instance._search_location:
+        docs += [(search_index.PRODUCT, pk) for pk in instance.products.values_list("id", flat=True)]
+    instance._search_location = instance.location
+    search_index.reindex(*docs)
+
+
+@receiver(post_delete, sender=Artisan)
+def drop_artisan(sender, instance, **kwargs):
+    search_index.reindex((search_index.ARTISAN, instance.pk))
+
+
+# ---------------------------------------------------------
+# AUTOCOMPLETE (search/autocomplete.py)
+# ---------------------------------------------------------
+@receiver([post_save, post_delete], sender=Product)
+def refresh_product_completion(sender, instance, created=False, **kwargs):
+    autocomplete.refresh(autocomplete.PRODUCT, [instance.pk])
+    if created:
+        # the artisan's weight counts its products
+        autocomplete.refresh(autocomplete.ARTISAN, [instance.artisan_id])
+
+
+@receiver([post_save, post_delete], sender=Artisan)
+def refresh_artisan_completion(sender, instance, **kwargs):
+    autocomplete.refresh(autocomplete.ARTISAN, [instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Material)
+def refresh_taxonomy_completion(sender, instance, **kwargs):
+    kind = autocomplete.CATEGORY if sender is Category else autocomplete.MATERIAL
+    autocomplete.refresh(kind, [instance.pk])
+
+
+# ---------------------------------------------------------
+# IMAGE VARIANTS (products/images.py)
+# ---------------------------------------------------------
+def _image_name(instance, field):
+    # None when the field was deferred, so no query is made here
+    value = instance.__dict__.get(field)
+    return getattr(value, "name", value)
+
+
+@receiver(post_init, sender=Product)
+def remember_main_image(sender, instance, **kwargs):
+    instance._variants_source = _image_name(instance, "main_image")
+
+
+@receiver(post_init, sender=ProductImage)
+def remember_gallery_image(sender, instance, **kwargs):
+    instance._variants_source = _image_name(instance, "image")
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def queue_image_variants(sender, instance, created, **kwargs):
+    field = "main_image" if sender is Product else "image"
+    current = _image_name(instance, field)
+    if current and (created or current != instance._variants_source):
+        queue_variants(current)
+    instance._variants_source = current
@@ -0,0 +1,129 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from products.models import Order, OrderItem, Product, ProductLike, ProductStats, Rating
+
+# Orders in these statuses count towards "sold" units
+SOLD_STATUSES = [
+    Order.STATUS_COMPLETED,
+    Order.STATUS_DELIVERED,
+    Order.STATUS_TO_REVIEW,
+]
+
+def is_sold(status):
+    return status in SOLD_STATUSES
+
+
+def is_counted(status):
+    # every order except cancelled ones counts as an order
+    return status != Order.STATUS_CANCELLED
+
+
+def get_stats(product):
+    """
+    Return the ProductStats row for a product (use select_related("stats")).
+    Products without a row yet get an unsaved, all-zero instance.
+    """
+    try:
+        return product.stats
+    except ProductStats.DoesNotExist:
+        return ProductStats(product_id=product.pk)
+
+
+def apply_delta(product_id, **deltas):
+    """
+    Add deltas to the counters of one product with a single UPDATE.
+    Products without a stats row are skipped (the row is gone while the
+    product itself is being deleted); rebuild_stats() fills any gaps.
+    """
+    updates = {field: F(field) + value for field, value in deltas.items() if value}
+    if updates:
+        ProductStats.objects.filter(product_id=product_id).update(**updates)
+
+
+def apply_deltas(deltas_by_product):
+    """ deltas_by_product: {product_id: {field: delta}} """
+    for product_id, deltas in deltas_by_product.items():
+        apply_delta(product_id, **deltas)
+
+
+def order_status_deltas(order_id, old_status, new_status):
+    """
+    Deltas caused by an order moving from old_status to new_status.
+    Returns {} when the transition does not touch any counter.
+    """
+    sold_change = is_sold(new_status) - is_sold(old_status)
+    counted_change = is_counted(new_status) - is_counted(old_status)
+
+    if not sold_change and not counted_change:
+        return {}
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    items = OrderItem.objects.filter(order_id=order_id).values_list("product_id", "quantity")
+
+    for product_id, quantity in items:
+        deltas[product_id]["sold_count"] += sold_change * quantity
+        # an order counts once per product, however many rows it has
+        deltas[product_id]["order_count"] = counted_change
+
+    return deltas
+
+
+def rebuild_stats(product_ids=None):
+    """
+    Recompute stats from orders, ratings and likes.
+    With product_ids=None the whole table is rebuilt.
+    Returns the number of rows written.
+    """
+    items = OrderItem.objects.all()
+    ratings = Rating.objects.all()
+    likes = ProductLike.objects.all()
+    products = Product.objects.all()
+    existing = ProductStats.objects.all()
+
+    if product_ids is not None:
+        items = items.filter(product_id__in=product_ids)
+        ratings = ratings.filter(product_id__in=product_ids)
+        likes = likes.filter(product_id__in=product_ids)
+        products = products.filter(id__in=product_ids)
+        existing = existing.filter(product_id__in=product_ids)
+
+    rows = {pid: ProductStats(product_id=pid) for pid in products.values_list("id", flat=True)}
+
+    sold = (
+        items.values("product_id")
+        .annotate(
+            sold=Sum("quantity", filter=Q(order__status__in=SOLD_STATUSES)),
+            orders=Count(
+                "order_id",
+                filter=~Q(order__status=Order.STATUS_CANCELLED),
+                distinct=True
+            ),
+        )
+    )
+    for row in sold:
+        stats = rows.get(row["product_id"])
+        if stats:
+            stats.sold_count = row["sold"] or 0
+            stats.order_count = row["orders"] or 0
+
+    rating_totals = ratings.values("product_id").annotate(total=Sum("score"), count=Count("id"))
+    for row in rating_totals:
+        stats = rows.get(row["product_id"])
+        if stats:
+            stats.rating_sum = row["total"] or 0
+            stats.rating_count = row["count"]
+
+    like_totals = likes.values("product_id").annotate(count=Count("id"))
+    for row in like_totals:
+        stats = rows.get(row["product_id"])
+        if stats:
+            stats.like_count = row["count"]
+
+    with transaction.atomic():
+        existing.delete()
+        ProductStats.objects.bulk_create(rows.values(), batch_size=1000)
+
+    return len(rows)
@@ -7,15 +7,18 @@ from .views import (
     ShopProductsView,
     UpdateProductView,
     ProductListView,   
+    ProductBrowseView,
     CategoryListView,  
     MaterialListView,  
     ProductDetailView,
+    ProductPageView,
     RecommendedProductsView,
     ProductDetailRecommendedView,
     LogProductView,
     LatestProductsView,
     FeaturedProductsView,
     CheckoutView,
+    CatalogCacheStatsView,
     top_selling_products
 )
 
@@ -25,10 +28,13 @@ urlpatterns = [
     path('delete_product/', DeleteProductView.as_view(), name='delete-product'),
     path('update_product/', UpdateProductView.as_view(), name='update-product'),
     path('products/', ProductListView.as_view(), name='product-list'),
+    path('browse/', ProductBrowseView.as_view(), name='product-browse'),
     path('categories/', CategoryListView.as_view(), name='category-list'),
     path('materials/', MaterialListView.as_view(), name='material-list'),
     path('products/<int:id>/', ProductDetailView.as_view(), name='product-detail'),  # New URL pattern for product detail
+    path('products/<int:id>/page/', ProductPageView.as_view(), name='product-page'),
     path('recommendations/<int:product_id>/', ProductDetailRecommendedView.as_view(), name='recommendations'),
+    path('products/<int:product_id>/similar/', RecommendedProductsView.as_view(), name='product-similar'),
     path('log-view/', LogProductView.as_view(), name='log-view'),
     path('personalized/<int:user_id>/', ProductPersonalizedView.as_view(), name='personalized'),
     path('shop/<int:artisan_id>/', ShopProductsView.as_view()),
@@ -36,5 +42,6 @@ urlpatterns = [
     path('featured-products/', FeaturedProductsView.as_view(), name='featured-products'),
     path('top-selling/<int:artisan_id>/', top_selling_products, name='artisan_top_selling'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
+    path('cache-stats/', CatalogCacheStatsView.as_view(), name='catalog-cache-stats'),
 
 ]
\ No newline at end of file
@@ -7,10 +7,20 @@ from rest_framework.generics import ListAPIView
 from django.db.models import Q
 from django.db.models import Sum, Prefetch
 from django.db.models.functions import Coalesce
-import machineLearning.recommendations as reco
 from users.models import Artisan, CustomUser
-from products.models import Product, Category, Material,ProductImage, UserActivity, UserRecommendations,Order,OrderItem, Rating 
-from .serializers import ProductSerializer, UpdateProductSerializer, ProductReadSerializer
+from products.models import Product, Category, Material,ProductImage, UserActivity, UserRecommendations,Order,OrderItem, Rating, ProductLeaderboard
+from products.leaderboards import first_ranked, in_rank_order, parse_window
+from products.recommender import SIMILARITY_TOP_K, similar_product_ids
+from products.recent_views import record_view, recent_views, rerank
+from .serializers import ProductSerializer, UpdateProductSerializer, ProductReadSerializer, product_read_queryset
+from .stats import get_stats
+from .pagination import KeysetPagination
+from .cache import TAXONOMY, artisan_scope, cached_get, get_counters
+from .page import build_product_page, similar_products
+from .facets import SORTS, get_snapshot
+from products.images import thumbnail_url, variant_urls
+from products.streaming import StreamingJSONResponse, chunked
+from products.admin.permission import IsAdmin
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from django.db.models import Count
 from rest_framework.decorators import api_view, permission_classes
@@ -21,76 +31,212 @@ from chat.notification import send_notification
 from django.db.models import Sum, Avg, Count, Q
 
 
+# Output field -> Product columns it needs. "?fields=" narrows both the
+# SELECT and the JSON to the requested keys; relations listed in
+# LIST_PREFETCHES are only prefetched when asked for.
+LIST_FIELDS = {
+    "id": ["id"],
+    "name": ["name"],
+    "brandName": ["brandName"],
+    "description": ["description"],
+    "long_description": ["long_description"],
+    "stock_quantity": ["stock_quantity"],
+    "regular_price": ["regular_price"],
+    "sales_price": ["sales_price"],
+    "main_image": ["main_image"],
+    "thumbnail": ["main_image", "image_variants"],
+    "image_variants": ["image_variants"],
+    "categories": [],
+    "materials": [],
+    "images": [],
+    "is_preorder": ["is_preorder"],
+    "total_orders": ["total_orders"],
+    "created_at": ["created_at"],
+    "artisan": ["artisan"],
+    "sold_count": ["stats__sold_count"],
+    "average_rating": ["stats__rating_sum", "stats__rating_count"],
+    "rating_count": ["stats__rating_count"],
+}
+
+LIST_PREFETCHES = {
+    "images": Prefetch("images", queryset=ProductImage.objects.only("id", "product_id", "image")),
+    "categories": Prefetch("categories", queryset=Category.objects.only("id", "name")),
+    "materials": Prefetch("materials", queryset=Material.objects.only("id", "name")),
+}
+
+LIST_RENDERERS = {
+    "id": lambda p: p.id,
+    "name": lambda p: p.name,
+    "brandName": lambda p: p.brandName,
+    "description": lambda p: p.description,
+    "long_description": lambda p: p.long_description,
+    "stock_quantity": lambda p: p.stock_quantity,
+    "regular_price": lambda p: str(p.regular_price),
+    "sales_price": lambda p: str(p.sales_price),
+    "main_image": lambda p: p.main_image.url if p.main_image else None,
+    "thumbnail": lambda p: thumbnail_url(p.main_image, p.image_variants),
+    "image_variants": lambda p: variant_urls(p.image_variants),
+    "categories": lambda p: [{"id": c.id, "name": c.name} for c in p.categories.all()],
+    "materials": lambda p: [{"id": m.id, "name": m.name} for m in p.materials.all()],
+    "images": lambda p: [img.image.url for img in p.images.all()],
+    "is_preorder": lambda p: p.is_preorder,
+    "total_orders": lambda p: p.total_orders,
+    "created_at": lambda p: p.created_at,
+    "artisan": lambda p: p.artisan_id,
+    "sold_count": lambda p: get_stats(p).sold_count,
+    "average_rating": lambda p: get_stats(p).average_rating,
+    "rating_count": lambda p: get_stats(p).rating_count,
+}
+
+
 class ProductListView(APIView):
+    """
+    GET /products/                      -> full catalog (legacy list)
+    GET /products/?limit=24             -> first page, newest first
+    GET /products/?cursor=<token>       -> next page from "next_cursor"
+    GET /products/?fields=id,name,...   -> only these keys (and columns)
+    GET /products/?stream=true          -> full catalog, streamed
+
+    The full list is cached like any other response; with ?stream=true it
+    is streamed in chunks rather than built in memory (and not cached), for
+    clients that export the whole catalog.
+    """
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
+
+    def get_fields(self, request):
+        requested = request.query_params.get("fields")
+        if not requested:
+            return list(LIST_FIELDS)
+        return [f for f in dict.fromkeys(requested.split(",")) if f in LIST_FIELDS]
+
+    def get_queryset(self, fields):
+        # id and created_at are always loaded: they are the pagination keys
+        columns = ["id", "created_at"]
+        for field in fields:
+            columns.extend(LIST_FIELDS[field])
+
+        products = Product.objects.only(*dict.fromkeys(columns))
+
+        # sold / rating counters come from the ProductStats table
+        if any(c.startswith("stats__") for c in columns):
+            products = products.select_related("stats")
+
+        prefetches = [LIST_PREFETCHES[f] for f in fields if f in LIST_PREFETCHES]
+        if prefetches:
+            products = products.prefetch_related(*prefetches)
 
+        return products
+
+    def serialize(self, products, fields):
+        renderers = [(f, LIST_RENDERERS[f]) for f in fields]
+        return ({name: render(p) for name, render in renderers} for p in products)
+
+    @cached_get("product-list")
     def get(self, request):
+        fields = self.get_fields(request)
+        if not fields:
+            return Response({"error": "No valid fields requested"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Pre-calc sold count ONCE per product using annotation
-        valid_statuses = [
-            Order.STATUS_COMPLETED,
-            Order.STATUS_DELIVERED,
-            Order.STATUS_TO_REVIEW
-        ]
+        products = self.get_queryset(fields)
 
-        products = (
-            Product.objects
-            .annotate(
-                sold_count=Sum(
-                    "order_items__quantity",
-                    filter=Q(order_items__order__status__in=valid_statuses)
-                ),
-                average_rating=Avg("ratings__score"),     
-                rating_count=Count("ratings")              
-            )
-            .prefetch_related(
-                Prefetch("images", queryset=ProductImage.objects.only("id", "image")),
-                Prefetch("categories", queryset=Category.objects.only("id", "name")),
-                Prefetch("materials", queryset=Material.objects.only("id", "name")),
-            )
-            .select_related("artisan")
-            .only(
-                "id",
-                "name",
-                "brandName",
-                "description",
-                "long_description",
-                "stock_quantity",
-                "regular_price",
-                "sales_price",
-                "main_image",
-                "artisan",
-                "created_at"
-            )
-        )
+        paginator = self.pagination_class()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(products, request, view=self)
+            return paginator.get_paginated_response(list(self.serialize(page, fields)))
 
+        if request.query_params.get("stream", "").lower() in ("1", "true", "yes"):
+            return StreamingJSONResponse(self.serialize(chunked(products), fields))
+        return Response(list(self.serialize(chunked(products), fields)))
 
-        data = []
-        for p in products:
-            data.append({
+
+def _id_list(params, name):
+    """ ?category=1,2&category=3 -> [1, 2, 3] (non-numbers ignored) """
+    ids = []
+    for value in params.getlist(name):
+        ids.extend(int(v) for v in value.split(",") if v.strip().isdigit())
+    return ids
+
+
+def _number(params, name):
+    try:
+        return float(params[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class ProductBrowseView(APIView):
+    """
+    GET /browse/?category=1,2&material=3&artisan=4&min_price=100&max_price=500
+                 &in_stock=true&sort=newest|oldest|price_asc|price_desc&page=1&page_size=24
+
+    Filtering, sorting and facet counts run on the in-memory snapshot
+    (products/product/facets.py); only the page of products is read from
+    the database, in one query.
+    """
+    permission_classes = [AllowAny]
+    max_page_size = 100
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            page = max(1, int(params.get("page", 1)))
+            page_size = max(1, min(int(params.get("page_size", 24)), self.max_page_size))
+        except ValueError:
+            return Response({"error": "page and page_size must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        sort = params.get("sort", "newest")
+        if sort not in SORTS:
+            return Response({"error": f"sort must be one of {', '.join(SORTS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        snapshot = get_snapshot()
+        result = snapshot.query(
+            categories=_id_list(params, "category"),
+            materials=_id_list(params, "material"),
+            artisans=_id_list(params, "artisan"),
+            min_price=_number(params, "min_price"),
+            max_price=_number(params, "max_price"),
+            in_stock=params.get("in_stock", "").lower() in ("1", "true", "yes"),
+            sort=sort,
+            offset=(page - 1) * page_size,
+            limit=page_size,
+        )
+
+        products = Product.objects.filter(id__in=result["ids"]).only(
+            "id", "name", "brandName", "regular_price", "sales_price", "main_image", "image_variants",
+            "stock_quantity", "is_preorder", "artisan_id", "created_at",
+        )
+        by_id = {p.id: p for p in products}
+
+        results = []
+        for pid in result["ids"]:
+            p = by_id.get(pid)
+            if p is None:  # deleted since the snapshot was taken
+                continue
+            category_ids, material_ids = snapshot.memberships(pid)
+            results.append({
                 "id": p.id,
                 "name": p.name,
                 "brandName": p.brandName,
-                "description": p.description,
-                "long_description": p.long_description,
-                "stock_quantity": p.stock_quantity,
                 "regular_price": str(p.regular_price),
                 "sales_price": str(p.sales_price),
                 "main_image": p.main_image.url if p.main_image else None,
-                "categories": [{"id": c.id, "name": c.name} for c in p.categories.all()],
-                "materials": [{"id": m.id, "name": m.name} for m in p.materials.all()],
-                "images": [img.image.url for img in p.images.all()],
+                "thumbnail": thumbnail_url(p.main_image, p.image_variants),
+                "stock_quantity": p.stock_quantity,
                 "is_preorder": p.is_preorder,
-                "total_orders": p.total_orders,
+                "artisan": p.artisan_id,
                 "created_at": p.created_at,
-                "artisan": p.artisan.id if p.artisan else None,
-                "sold_count": p.sold_count or 0,
-
-                "average_rating": round(p.average_rating, 1) if p.average_rating else 0,
-                "rating_count": p.rating_count,
+                "categories": [{"id": c, "name": snapshot.category_names.get(c, "")} for c in category_ids],
+                "materials": [{"id": m, "name": snapshot.material_names.get(m, "")} for m in material_ids],
             })
 
-        return Response(data)
+        return Response({
+            "count": result["count"],
+            "page": page,
+            "page_size": page_size,
+            "results": results,
+            "facets": result["facets"],
+        })
 
 
 # Category List
@@ -105,6 +251,10 @@ class CategoryListView(ListAPIView):
 
     serializer_class = _CategorySerializer
 
+    @cached_get("category-list", scopes=lambda **kwargs: [TAXONOMY])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 # Material List
 class MaterialListView(ListAPIView):
@@ -118,6 +268,10 @@ class MaterialListView(ListAPIView):
 
     serializer_class = _MaterialSerializer
 
+    @cached_get("material-list", scopes=lambda **kwargs: [TAXONOMY])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 # CREATE product
 class AddProductView(APIView):
@@ -169,7 +323,7 @@ class AddProductView(APIView):
             ProductImage.objects.create(product=product, image=img)
 
         # ⭐ Return complete readable output
-        read_output = ProductReadSerializer(product)
+        read_output = ProductReadSerializer(product_read_queryset().get(pk=product.pk))
 
         return Response(
             {
@@ -237,7 +391,7 @@ class ProductDetailView(APIView):
 
     def get(self, request, id):
         try:
-            product = Product.objects.get(id=id)
+            product = product_read_queryset().get(id=id)
 
             serializer = ProductReadSerializer(product)
             return Response(serializer.data)
@@ -247,13 +401,20 @@ class ProductDetailView(APIView):
 
         
 class RecommendedProductsView(APIView):
+    """ Products most similar by text, from the recommender's shared similarity index. """
+    permission_classes = [AllowAny]
+
     def get(self, request, product_id):
         try:
-            recommended_products = reco.get_recommendations(product_id)
-            serializer = ProductSerializer(recommended_products, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            limit = min(max(int(request.query_params.get("limit", 8)), 1), SIMILARITY_TOP_K)
+        except ValueError:
+            limit = 8
+
+        product_ids = similar_product_ids(product_id, limit)
+        found = product_read_queryset(Product.objects.filter(id__in=product_ids)).in_bulk()
+        recommended_products = [found[pid] for pid in product_ids if pid in found]
+        serializer = ProductReadSerializer(recommended_products, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
 # products/views.py
 class LogProductView(APIView):
@@ -277,8 +438,10 @@ class LogProductView(APIView):
         UserActivity.objects.create(
             user=user,
             product=product,
-            action="View"
+            action=UserActivity.ACTION_VIEW
         )
+        if user is not None:
+            record_view(user.id, product.id)
         return Response({"message": "View logged successfully."}, status=201)
 
 class ProductPersonalizedView(APIView):
@@ -290,14 +453,17 @@ class ProductPersonalizedView(APIView):
             product_ids = rec.product_ids or []
             if not product_ids:
                 raise UserRecommendations.DoesNotExist
+            # boost what is like the user's views since the list was stored
+            product_ids = rerank(product_ids, recent_views(user_id))
 
-            qs = Product.objects.filter(id__in=product_ids).prefetch_related("images", "categories", "materials")
+            qs = product_read_queryset(Product.objects.filter(id__in=product_ids))
             # preserve order
-            products_sorted = sorted(qs, key=lambda p: product_ids.index(p.id))
+            position = {pid: i for i, pid in enumerate(product_ids)}
+            products_sorted = sorted(qs, key=lambda p: position[p.id])
             serializer = ProductReadSerializer(products_sorted, many=True)
             return Response(serializer.data)
         except UserRecommendations.DoesNotExist:
-            fallback = Product.objects.order_by("-created_at")[:10]
+            fallback = product_read_queryset(Product.objects.order_by("-created_at"))[:10]
             serializer = ProductReadSerializer(fallback, many=True)
             return Response(serializer.data)
 
@@ -307,21 +473,22 @@ class FeaturedProductsView(APIView):
 
     def get(self, request):
         user_id = request.query_params.get("user_id")
+        newest = product_read_queryset(Product.objects.order_by("-created_at"))
         if not user_id:
-            fallback = Product.objects.order_by("-created_at")[:1]
+            fallback = newest[:1]
             return Response(ProductReadSerializer(fallback, many=True).data)
 
         try:
             rec = UserRecommendations.objects.get(user_id=user_id)
             if not rec.product_ids:
-                fallback = Product.objects.order_by("-created_at")[:1]
+                fallback = newest[:1]
                 return Response(ProductReadSerializer(fallback, many=True).data)
 
             top_id = rec.product_ids[0]
-            product = Product.objects.filter(id=top_id)
+            product = product_read_queryset(Product.objects.filter(id=top_id))
             return Response(ProductReadSerializer(product, many=True).data)
         except UserRecommendations.DoesNotExist:
-            fallback = Product.objects.order_by("-created_at")[:1]
+            fallback = newest[:1]
             return Response(ProductReadSerializer(fallback, many=True).data)
 
 # --- PRODUCT DETAIL: RECOMMEND (fast category-based fallback) ---
@@ -335,37 +502,38 @@ class ProductDetailRecommendedView(APIView):
         except Product.DoesNotExist:
             return Response({"error": "Product not found"}, status=404)
 
-        same_category = Product.objects.filter(categories__in=product.categories.all()).exclude(id=product_id).distinct().prefetch_related("images")[:8]
-        if same_category and same_category.count() >= 3:
-            serializer = ProductSerializer(same_category, many=True)
-            return Response(serializer.data)
+        # same category, falling back to the newest products
+        return Response(ProductSerializer(similar_products(product), many=True).data)
+
 
-        # fallback: newest products (random subset)
-        fallback = Product.objects.exclude(id=product_id).order_by("-created_at")[:8]
-        return Response(ProductSerializer(fallback, many=True).data)
+# --- PRODUCT PAGE: detail, ratings, reviews, similar, artisan in one call ---
+class ProductPageView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, id):
+        page = build_product_page(id)
+        if page is None:
+            return Response({"error": "Product not found"}, status=404)
+        return Response(page)
 
     
 class ShopProductsView(APIView):
     permission_classes = [AllowAny]
 
+    @cached_get("shop-products", scopes=lambda artisan_id: [artisan_scope(artisan_id), TAXONOMY])
     def get(self, request, artisan_id):
 
-        # Annotate each product with total orders EXCEPT cancelled
+        # Order counts (EXCEPT cancelled) come from the ProductStats table
         products = (
             Product.objects.filter(artisan_id=artisan_id)
+            .select_related("stats")
             .prefetch_related("categories", "materials", "images")
-            .annotate(
-                order_count =Count(
-                    "order_items__order",
-                    filter=~Q(order_items__order__status="cancelled"),
-                    distinct=True
-                )
-            )
         )
 
         # Serialize each product manually (to include total_orders)
         serialized_products = []
         for p in products:
+            stats = get_stats(p)
             serialized_products.append({
                 "id": p.id,
                 "name": p.name,
@@ -375,11 +543,13 @@ class ShopProductsView(APIView):
                 "regular_price": p.regular_price,
                 "sales_price": p.sales_price,
                 "main_image": p.main_image.url if p.main_image else None,
+                "thumbnail": thumbnail_url(p.main_image, p.image_variants),
                 "categories": [c.name for c in p.categories.all()],
                 "materials": [m.name for m in p.materials.all()],
                 "images": [{"id": img.id, "image": img.image.url} for img in p.images.all()],
                 "created_at": p.created_at,
                 "total_orders": p.total_orders,   # ⭐ NEW FIELD
+                "order_count": stats.order_count,
             })
 
         # Artisan info
@@ -401,18 +571,30 @@ class ShopProductsView(APIView):
 class LatestProductsView(APIView):
     permission_classes = [AllowAny]
 
+    @cached_get("latest-products")
     def get(self, request):
-        latest_products = Product.objects.only("id", "name", "main_image").order_by("-created_at")[:3]
+        latest_products = Product.objects.only("id", "name", "main_image", "image_variants").order_by("-created_at")[:3]
         data = [
             {
                 "id": p.id,
                 "name": p.name,
                 "main_image": request.build_absolute_uri(p.main_image.url) if p.main_image else None,
+                "thumbnail": (
+                    request.build_absolute_uri(thumbnail_url(p.main_image, p.image_variants, width=960))
+                    if p.main_image else None
+                ),
             }
             for p in latest_products
         ]
         return Response(data, status=status.HTTP_200_OK)
     
+class CatalogCacheStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        return Response(get_counters())
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def top_selling_products(request, artisan_id=None):
@@ -421,52 +603,32 @@ def top_selling_products(request, artisan_id=None):
     1. Purchases
     2. Likes (if no purchases)
     3. Views (if no likes)
-    """
-    actions = UserActivity.objects.all()
-
-    if artisan_id:
-        actions = actions.filter(product__artisan_id=artisan_id)
 
-    # Try to get top by purchase
-    purchases = (
-        actions.filter(action='purchase')
-        .values('product')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:4]
+    Reads the precomputed leaderboards (see products/leaderboards.py);
+    ?window=7d|30d|all picks the rolling window (default all time).
+    """
+    entries = first_ranked(
+        [
+            ProductLeaderboard.METRIC_ORDERS,
+            ProductLeaderboard.METRIC_LIKES,
+            ProductLeaderboard.METRIC_VIEWS,
+        ],
+        window=parse_window(request.query_params.get("window")),
+        artisan_id=artisan_id,
+        limit=4,
     )
 
-    product_ids = [p['product'] for p in purchases]
-
-    # If no purchases, fallback to likes
-    if not product_ids:
-        likes = (
-            actions.filter(action='like')
-            .values('product')
-            .annotate(count=Count('id'))
-            .order_by('-count')[:4]
-        )
-        product_ids = [l['product'] for l in likes]
-
-    # If no likes either, fallback to views
-    if not product_ids:
-        views = (
-            actions.filter(action='view')
-            .values('product')
-            .annotate(count=Count('id'))
-            .order_by('-count')[:4]
-        )
-        product_ids = [v['product'] for v in views]
-
     # If still none, just show first few products from that artisan
-    if not product_ids:
+    if not entries:
         if artisan_id:
             products = Product.objects.filter(artisan_id=artisan_id)[:4]
         else:
             products = Product.objects.all()[:4]
     else:
-        products = list(Product.objects.filter(id__in=product_ids))
         # Preserve order (so the top-ranked products stay on top)
-        products.sort(key=lambda p: product_ids.index(p.id))
+        products = in_rank_order(
+            Product.objects.prefetch_related("categories", "materials", "images"), entries
+        )
 
     serializer = ProductSerializer(products, many=True)
     return Response(serializer.data)
@@ -0,0 +1,104 @@
+import threading
+
+from django.core.cache import cache
+
+from products.artifacts import array_version
+from products.collaborative import BLENDED_ARRAYS
+from products.recommender import load_similarity_index, neighbour_scores
+
+# ---------------------------------------------------------
+# RECENT VIEWS, FOR RE-RANKING STORED RECOMMENDATIONS
+# ---------------------------------------------------------
+# Stored recommendations can be an hour old, so each user's last
+# RECENT_VIEWS product views are kept in the shared cache (newest first,
+# forgotten after RECENT_VIEWS_TTL without a view) and the stored list is
+# re-ranked at request time: a product keeps a score for its stored
+# position and gains SESSION_BOOST * its similarity to each recent view,
+# older views counting RECENCY_DECAY times less. Similarity comes from the
+# blended index the recommendation job saved (products/collaborative.py),
+# memory-mapped: one cache read and a few rows of it, never a query.
+#
+# With Redis (REDIS_URL) the list is a Redis list updated in one MULTI,
+# so concurrent views are all kept and every worker sees them. Other
+# caches get a read-modify-write under a process lock, which is only right
+# for the per-process cache of a single worker.
+
+RECENT_VIEWS = 10
+RECENT_VIEWS_TTL = 60 * 30
+RECENCY_DECAY = 0.7
+SESSION_BOOST = 1.0
+
+_local_lock = threading.Lock()
+
+
+def _key(user_id):
+    return f"recent-views:{user_id}"
+
+
+def _redis():
+    """ (client, key function) for a Redis cache backend, else None. """
+    get_client = getattr(getattr(cache, "_cache", None), "get_client", None)
+    if get_client is None:
+        return None
+    return get_client(write=True), cache.make_and_validate_key
+
+
+def record_view(user_id, product_id):
+    redis = _redis()
+    if redis is not None:
+        client, make_key = redis
+        key = make_key(_key(user_id))
+        pipeline = client.pipeline(transaction=True)
+        pipeline.lrem(key, 0, product_id)
+        pipeline.lpush(key, product_id)
+        pipeline.ltrim(key, 0, RECENT_VIEWS - 1)
+        pipeline.expire(key, RECENT_VIEWS_TTL)
+        pipeline.execute()
+        return
+
+    key = _key(user_id)
+    with _local_lock:
+        views = [product_id] + [pid for pid in cache.get(key, []) if pid != product_id]
+        cache.set(key, views[:RECENT_VIEWS], RECENT_VIEWS_TTL)
+
+
+def recent_views(user_id):
+    """ Product ids the user viewed lately, newest first. """
+    redis = _redis()
+    if redis is not None:
+        client, make_key = redis
+        return [int(pid) for pid in client.lrange(make_key(_key(user_id)), 0, RECENT_VIEWS - 1)]
+    return cache.get(_key(user_id), [])
+
+
+# ---------------------------------------------------------
+# THE BLENDED INDEX
+# ---------------------------------------------------------
+_index = None
+_index_lock = threading.Lock()
+
+
+def blended_index():
+    """ The blended index the job saved last (reloaded when it saves another), or None. """
+    global _index
+    version = array_version(BLENDED_ARRAYS)
+    with _index_lock:
+        if version and (_index is None or _index.version != version):
+            _index = load_similarity_index(version, name=BLENDED_ARRAYS) or _index
+        return _index
+
+
+def rerank(product_ids, viewed, boost=SESSION_BOOST):
+    """ `product_ids` reordered towards the neighbours of `viewed` (newest first). """
+    if not viewed or not product_ids:
+        return product_ids
+    index = blended_index()
+    if index is None:
+        return product_ids
+    similarity = neighbour_scores(index, viewed, [RECENCY_DECAY ** i for i in range(len(viewed))])
+    if not similarity:
+        return product_ids
+
+    count = len(product_ids)
+    scores = {pid: 1 - i / count + boost * similarity.get(pid, 0.0) for i, pid in enumerate(product_ids)}
+    return sorted(product_ids, key=scores.__getitem__, reverse=True)
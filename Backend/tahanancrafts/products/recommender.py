@@ -1,107 +1,923 @@
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import scipy.sparse as sp
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Case, DateTimeField, F, FloatField, Func, Q, Sum, Value, When
+from django.db.models.functions import Exp
+from django.utils import timezone
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from products.models import Product, UserActivity
-from collections import Counter
-from random import shuffle
+from products.artifacts import (
+    array_version, artifact_mtime, load_arrays, load_artifact, save_arrays, save_artifact,
+)
+from products.models import Product, UserActivity, UserRecommendations
+from products.product.cache import feed_position, read_changes
+from search.index import FEED, PRODUCT
+from users.models import CustomUser
+
+logger = logging.getLogger(__name__)
 
 
 # ---------------------------------------------------------
-# BUILD GLOBAL TF-IDF + COSINE MATRIX
+# SHARED TF-IDF MODEL
 # ---------------------------------------------------------
-def compute_similarity_matrix():
-    products = list(Product.objects.all().prefetch_related("materials", "categories"))
+# The fitted vectorizer and the product x term matrix are kept (and saved
+# under ARTIFACT_DIR) instead of being dropped after the similarities are
+# computed: search/semantic.py projects free-text queries into the same
+# space, so one fit serves both.
 
-    if not products:
-        return [], [], None
+TFIDF_ARTIFACT = "recommender_tfidf.pickle"
+TFIDF_FORMAT = 3
+
+
+class TfidfModel:
+    def __init__(self, product_ids, vectorizer, matrix):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.vectorizer = vectorizer
+        self.matrix = matrix.tocsr()     # rows are L2-normalized by the vectorizer
+        self.similarity = None           # SimilarityIndex over the same rows
+        self.index_version = None        # its saved arrays; it isn't pickled with the model
+        self.position = 0                # change feed position the model reflects
+        self.unseen_terms = set()        # words met since the fit that it doesn't know
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["similarity"] = None
+        return state
+
+    def drift(self):
+        """ Words met since the fit that are missing from its vocabulary, as a share of it. """
+        return len(self.unseen_terms) / max(1, len(self.vectorizer.vocabulary_))
+
+
+def product_text(p):
+    materials = " ".join([m.name for m in p.materials.all()])
+    categories = " ".join([c.name for c in p.categories.all()])
+    return f"{p.name} {p.description} {materials} {categories}"
 
-    # Build combined text for each product
-    corpus = []
-    for p in products:
-        materials = " ".join([m.name for m in p.materials.all()])
-        categories = " ".join([c.name for c in p.categories.all()])
-        corpus.append(f"{p.name} {p.description} {materials} {categories}")
 
+def fit_tfidf_model(products):
     vectorizer = TfidfVectorizer(stop_words="english")
-    tfidf_matrix = vectorizer.fit_transform(corpus)
+    matrix = vectorizer.fit_transform([product_text(p) for p in products])
+    return TfidfModel([p.id for p in products], vectorizer, matrix)
+
+
+def save_tfidf_model(model, path=None):
+    return save_artifact(TFIDF_ARTIFACT, model, TFIDF_FORMAT, path)
+
+
+def load_tfidf_model(path=None):
+    return load_artifact(TFIDF_ARTIFACT, TFIDF_FORMAT, path)
+
+
+def save_model(model):
+    """ Save the similarity index arrays, then the model naming their version. """
+    model.index_version = save_similarity_index(model.similarity)
+    return save_tfidf_model(model)
+
+
+def load_model(mmap_mode="r"):
+    """ The saved model with its similarity index memory-mapped, or None. """
+    model = load_tfidf_model()
+    if model is None or model.index_version is None:
+        return None
+    model.similarity = load_similarity_index(model.index_version, mmap_mode)
+    return model if model.similarity is not None else None
+
+
+# ---------------------------------------------------------
+# TOP-K SIMILARITY INDEX
+# ---------------------------------------------------------
+# Only the K most similar products of each product are kept, as two N x K
+# arrays, instead of the dense N x N cosine matrix (800 MB at 10k
+# products). The build multiplies blocks of rows against the sparse TF-IDF
+# matrix so at most BLOCK_BYTES of similarities exist at once, and picks
+# each row's top K with argpartition: memory is O(N*K), lookups O(K).
+
+SIMILARITY_TOP_K = 50
+BLOCK_BYTES = 32 * 1024 * 1024
+
+
+class RowMap:
+    """
+    product id -> row. Backed by the ids sorted and their rows (arrays that
+    can be memory maps shared by every worker) plus the rows added and
+    removed since they were sorted, kept in a dict and a set.
+    """
+
+    def __init__(self, product_ids, sorted_ids=None, sorted_rows=None):
+        if sorted_ids is None:
+            # a product id of -1 marks the row of a deleted product
+            alive = np.flatnonzero(np.asarray(product_ids) >= 0)
+            order = np.argsort(product_ids[alive], kind="stable")
+            sorted_ids, sorted_rows = product_ids[alive][order], alive[order]
+        self.sorted_ids = sorted_ids
+        self.sorted_rows = sorted_rows
+        self.added = {}
+        self.removed = set()
+
+    def __len__(self):
+        return len(self.sorted_ids) - len(self.removed) + len(self.added)
+
+    def __contains__(self, product_id):
+        return self.get(product_id) is not None
+
+    def __getitem__(self, product_id):
+        row = self.get(product_id)
+        if row is None:
+            raise KeyError(product_id)
+        return row
+
+    def get(self, product_id, default=None):
+        row = self.added.get(product_id)
+        if row is not None:
+            return row
+        if product_id in self.removed:
+            return default
+        at = int(self.sorted_ids.searchsorted(product_id))
+        if at < len(self.sorted_ids) and self.sorted_ids[at] == product_id:
+            return int(self.sorted_rows[at])
+        return default
+
+    def pop(self, product_id):
+        row = self.added.pop(product_id, None)
+        if row is None:
+            row = self[product_id]
+            self.removed.add(product_id)
+        return row
+
+    def update(self, pairs):
+        self.added.update(pairs)
+
+    def values(self):
+        """ Rows of every product, as an int64 array. """
+        rows = np.asarray(self.sorted_rows, dtype=np.int64)
+        if self.removed:
+            rows = rows[~np.isin(self.sorted_ids, list(self.removed))]
+        if self.added:
+            rows = np.concatenate([rows, np.fromiter(self.added.values(), dtype=np.int64, count=len(self.added))])
+        return rows
+
+
+class SimilarityIndex:
+    """
+    Row i lists the rows of product i's neighbours, best first, and their
+    cosine similarity; -1 pads rows with fewer than K similar products.
+    Rows follow `product_ids`.
+    """
+
+    def __init__(self, product_ids, neighbours, scores, rows=None, version=None, arrays=None):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.neighbours = neighbours      # int32, N x K
+        self.scores = scores              # float32, N x K
+        self.rows = rows if rows is not None else RowMap(self.product_ids)
+        self.version = version            # saved arrays it is, or was saved as
+        self.arrays = arrays              # ... and their artifact name
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def row_neighbours(self, row, top_n):
+        """ (neighbour rows, similarities) of one row, best first. """
+        columns = self.neighbours[row, :top_n]
+        found = columns >= 0
+        return columns[found], self.scores[row, :top_n][found]
+
+    def similar(self, product_id, top_n=8):
+        """ [(product_id, similarity), ...] best first; [] for unknown products. """
+        row = self.rows.get(product_id)
+        if row is None:
+            return []
+        columns, scores = self.row_neighbours(row, top_n)
+        return list(zip(self.product_ids[columns].tolist(), scores.tolist()))
+
+    def to_sparse(self):
+        """ The index as a sparse N x N matrix: row i holds i's neighbours and their similarity. """
+        n, k = self.neighbours.shape
+        rows = np.repeat(np.arange(n), k)
+        columns = self.neighbours.ravel()
+        found = columns >= 0
+        return sp.csr_matrix((self.scores.ravel()[found], (rows[found], columns[found])), shape=(n, n))
+
+
+def top_neighbours(matrix, rows, k, block_bytes=BLOCK_BYTES, sparse_blocks=False):
+    """
+    Yield (block of `rows`, neighbour rows, similarities) with each row's
+    top-k cosine neighbours in `matrix` (L2-normalized, sparse), best first;
+    only similarities above 0 count, the rest is padded with -1 / 0.
+    sparse_blocks suits matrices where most pairs of rows share nothing.
+    """
+    matrix = matrix.tocsr().astype(np.float32)
+    n = matrix.shape[0]
+    rows = np.asarray(rows, dtype=np.int64)
+    width = min(k, n - 1)
+
+    # by default each block is densified (block x terms) and multiplied by
+    # the sparse matrix, much faster than sparse x sparse when most pairs
+    # share a word; only the block x N result is dense either way
+    if sparse_blocks:
+        transposed = matrix.T.tocsr()
+        block = max(1, block_bytes // (n * 4))
+    else:
+        block = max(1, block_bytes // (max(n, matrix.shape[1]) * 4))
+
+    for start in range(0, len(rows), block):
+        chunk = rows[start:start + block]
+        neighbours = np.full((len(chunk), k), -1, dtype=np.int32)
+        scores = np.zeros((len(chunk), k), dtype=np.float32)
+        if width <= 0:
+            yield chunk, neighbours, scores
+            continue
+
+        if sparse_blocks:
+            similarities = (matrix[chunk] @ transposed).toarray()
+        else:
+            similarities = np.ascontiguousarray((matrix @ matrix[chunk].toarray().T).T)
+        similarities[np.arange(len(chunk)), chunk] = -np.inf   # not itself
+
+        top = np.argpartition(-similarities, width - 1, axis=1)[:, :width]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        similar = top_scores > 0
+        neighbours[:, :width] = np.where(similar, top, -1)
+        scores[:, :width] = np.where(similar, top_scores, 0)
+        yield chunk, neighbours, scores
+
+
+def build_similarity_index(matrix, product_ids, k=SIMILARITY_TOP_K, block_bytes=BLOCK_BYTES):
+    """ Top-k cosine neighbours of every row of an L2-normalized sparse matrix. """
+    n = matrix.shape[0]
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    for rows, top, top_scores in top_neighbours(matrix, np.arange(n), k, block_bytes):
+        neighbours[rows] = top
+        scores[rows] = top_scores
+    return SimilarityIndex(product_ids, neighbours, scores)
+
+
+def top_k_index(matrix, like, k=SIMILARITY_TOP_K):
+    """
+    Index of the k highest positive entries of each row of a sparse N x N
+    score matrix, over the same products (and row map) as index `like`.
+    """
+    matrix = matrix.tocsr()
+    matrix.eliminate_zeros()
+    n = matrix.shape[0]
+    row_of = np.repeat(np.arange(n), np.diff(matrix.indptr))
+    positive = matrix.data > 0
+    row_of, columns, values = row_of[positive], matrix.indices[positive], matrix.data[positive]
+
+    # by row, best first; an entry's rank is its offset from its row's first
+    order = np.lexsort((-values, row_of))
+    row_of, columns, values = row_of[order], columns[order], values[order]
+    rank = np.arange(len(row_of)) - np.searchsorted(row_of, row_of)
+    kept = rank < k
+
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    neighbours[row_of[kept], rank[kept]] = columns[kept]
+    scores[row_of[kept], rank[kept]] = values[kept]
+    return SimilarityIndex(like.product_ids, neighbours, scores, like.rows)
+
+
+# ---------------------------------------------------------
+# SHARED ON-DISK COPY
+# ---------------------------------------------------------
+# Every build saves the index as a new version of .npy arrays (see
+# products/artifacts.py): the rows' product ids, the id -> row map as
+# sorted ids and their rows, and the N x K neighbours and scores. Readers
+# memory-map them, so all web workers and job processes on a machine share
+# one copy of the pages, and a lookup is a binary search plus one row read.
+
+SIMILARITY_ARRAYS = "recommender_similarity"
+
+
+def save_similarity_index(index, name=SIMILARITY_ARRAYS):
+    """ Save the index as a new version of memory-mappable arrays; returns (and records) the version. """
+    product_ids = np.full(len(index), -1, dtype=np.int64)
+    rows = index.rows.values()
+    product_ids[rows] = index.product_ids[rows]
+    order = np.argsort(product_ids[rows], kind="stable")
+    index.arrays = name
+    index.version = save_arrays(name, {
+        "product_ids": product_ids,
+        "sorted_ids": product_ids[rows][order],
+        "sorted_rows": rows[order],
+        "neighbours": index.neighbours,
+        "scores": index.scores,
+    })
+    return index.version
+
+
+def load_similarity_index(version=None, mmap_mode="r", name=SIMILARITY_ARRAYS):
+    """
+    A saved version of the index (default: the current one) over memory
+    maps, or None. mmap_mode="c" makes them copy-on-write: pages written
+    to become private to this process and nothing goes back to disk.
+    """
+    version = version or array_version(name)
+    arrays = load_arrays(name, version, mmap_mode) if version else None
+    if arrays is None:
+        return None
+    rows = RowMap(arrays["product_ids"], arrays["sorted_ids"], arrays["sorted_rows"])
+    return SimilarityIndex(arrays["product_ids"], arrays["neighbours"], arrays["scores"], rows, version, name)
+
+
+# ---------------------------------------------------------
+# BUILD GLOBAL TF-IDF + SIMILARITY INDEX
+# ---------------------------------------------------------
+def build_model():
+    """ (products, TfidfModel with its similarity index), fitted on the whole catalog. """
+    # read before loading: changes made meanwhile are replayed afterwards
+    position = feed_position(FEED)
+    products = list(Product.objects.all().prefetch_related("materials", "categories"))
+    if not products:
+        return [], None
+
+    model = fit_tfidf_model(products)
+    # rows of the index line up with `products`
+    model.similarity = build_similarity_index(model.matrix, model.product_ids)
+    model.position = position
+    return products, model
+
+
+# ---------------------------------------------------------
+# INCREMENTAL UPDATES
+# ---------------------------------------------------------
+# A changed product is projected with the fitted vocabulary and IDF
+# weights, so nothing else in the matrix moves. Only rows whose top K can
+# change are recomputed: the product itself, the rows listing it, and the
+# rows where its new similarity beats their current K-th neighbour. Words
+# the vocabulary lacks are ignored until the next full fit, which is
+# made once they reach REFIT_DRIFT of it.
+
+REFIT_DRIFT = 0.1
+
+
+def update_model(model, product_ids):
+    """ Re-read `product_ids` from the database into the model; the ones that are gone are dropped. """
+    index = model.similarity
+    products = list(Product.objects.filter(id__in=product_ids).prefetch_related("materials", "categories"))
+    found = {p.id for p in products}
+    removed = np.array(
+        [index.rows.pop(pid) for pid in product_ids if pid not in found and pid in index.rows], dtype=np.int64,
+    )
+
+    added = [p.id for p in products if p.id not in index.rows]
+    if added:
+        first, width = model.matrix.shape
+        model.product_ids = index.product_ids = np.concatenate([model.product_ids, added])
+        model.matrix = sp.vstack([model.matrix, sp.csr_matrix((len(added), width))], format="csr")
+        index.neighbours = np.vstack([index.neighbours, np.full((len(added), index.neighbours.shape[1]), -1, np.int32)])
+        index.scores = np.vstack([index.scores, np.zeros((len(added), index.scores.shape[1]), np.float32)])
+        index.rows.update((pid, row) for row, pid in enumerate(added, start=first))
+
+    texts = [product_text(p) for p in products]
+    vocabulary = model.vectorizer.vocabulary_
+    analyze = model.vectorizer.build_analyzer()
+    for text in texts:
+        model.unseen_terms.update(term for term in analyze(text) if term not in vocabulary)
+
+    # swap the changed rows of the matrix; removed products become empty rows
+    n = len(model.product_ids)
+    changed = np.array([index.rows[p.id] for p in products], dtype=np.int64)
+    keep = np.ones(n)
+    keep[changed] = 0
+    keep[removed] = 0
+    matrix = sp.diags(keep) @ model.matrix
+    if len(changed):
+        placement = sp.csr_matrix((np.ones(len(changed)), (changed, np.arange(len(changed)))), shape=(n, len(changed)))
+        matrix = matrix + placement @ model.vectorizer.transform(texts)
+    model.matrix = matrix.tocsr()
+    model.matrix.eliminate_zeros()
+
+    index.neighbours[removed] = -1
+    index.scores[removed] = 0
+
+    # rows whose top K may change
+    touched = np.concatenate([changed, removed])
+    affected = set(changed.tolist())
+    affected.update(np.flatnonzero(np.isin(index.neighbours, touched).any(axis=1)).tolist())
+    if len(changed):
+        similarities = (model.matrix @ model.matrix[changed].T).tocoo()
+        beats = similarities.data > index.scores[similarities.row, -1]
+        affected.update(similarities.row[beats].tolist())
+    affected.difference_update(removed.tolist())
+
+    k = index.neighbours.shape[1]
+    for rows, top, top_scores in top_neighbours(model.matrix, sorted(affected), k):
+        index.neighbours[rows] = top
+        index.scores[rows] = top_scores
+    return len(affected)
+
+
+# ---------------------------------------------------------
+# KEEPING THE SAVED MODEL CURRENT
+# ---------------------------------------------------------
+# Runs in the scheduler process (products/scheduler.py) or the
+# update_recommender command, never in a web worker: the last saved model
+# is patched with the products the search change feed names (search/index.py,
+# products signals) and saved again. It is refitted on the whole catalog
+# instead when the feed has lost entries it needs or when unseen words
+# reach REFIT_DRIFT of the vocabulary.
+
+_update_lock = threading.Lock()
+
+
+def refit():
+    """ Fit the model on the whole catalog and save it for every worker. """
+    with _update_lock:
+        products, model = build_model()
+        if model is not None:
+            save_model(model)
+            logger.info(
+                "Refitted the recommender: %s products, %s terms", len(model), len(model.vectorizer.vocabulary_),
+            )
+        return model
+
+
+def update_saved_model():
+    """
+    Bring the saved model up to date with the change feed. Returns "refit",
+    "updated" or "unchanged" (or None when there are no products).
+    """
+    with _update_lock:
+        model = load_model(mmap_mode="c")     # copy-on-write: patched in memory, then saved
+        position, changes = (None, None) if model is None else read_changes(FEED, model.position)
+        if changes is not None:
+            product_ids = {pk for entry in changes for kind, pk in entry if kind == PRODUCT}
+            if product_ids:
+                update_model(model, product_ids)
+            if model.drift() <= REFIT_DRIFT:
+                if position == model.position:
+                    return "unchanged"
+                model.position = position
+                save_model(model)
+                return "updated"
+    return "refit" if refit() is not None else None
+
+
+# ---------------------------------------------------------
+# THIS WORKER'S MODEL
+# ---------------------------------------------------------
+# Loaded lazily from what the jobs above save and reloaded when they save
+# again. Similar products only need the similarity index: its arrays are
+# memory-mapped on their own, so workers share the pages and never unpickle
+# the vectorizer. The TF-IDF model is loaded only by the first semantic
+# search; its pickle is replaced atomically, so a changed mtime is a
+# complete version. Requests only look things up: no database reads and no
+# fitting, and until something has been saved they get empty results.
 
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
+_model = None
+_model_mtime = None
+_index = None
+_lock = threading.RLock()
 
-    product_ids = [p.id for p in products]
 
-    return products, product_ids, cosine_sim
+def _current_model():
+    """ The last saved TF-IDF model, reloaded when its artifact changes; None until one exists. """
+    global _model, _model_mtime
+    mtime = artifact_mtime(TFIDF_ARTIFACT)
+    if mtime is not None and mtime != _model_mtime:
+        model = load_tfidf_model()
+        if model is not None:
+            _model, _model_mtime = model, mtime
+    return _model
+
+
+def _current_index():
+    """ The last saved similarity index, reloaded when a new version is saved; None until one exists. """
+    global _index
+    version = array_version(SIMILARITY_ARRAYS)
+    if version and (_index is None or _index.version != version):
+        _index = load_similarity_index(version) or _index
+    return _index
+
+
+def tfidf_model():
+    """ This worker's TF-IDF model, for search/semantic.py; None until one is saved. """
+    with _lock:
+        return _current_model()
+
+
+def similar_product_ids(product_id, top_n=8):
+    """ Ids of the products most similar to `product_id`, best first ([] when unknown). """
+    with _lock:
+        index = _current_index()
+        if index is None:
+            return []
+        return [pid for pid, _ in index.similar(product_id, top_n)]
+
+
+def neighbour_scores(index, product_ids, weights):
+    """
+    {product id: sum of weight * similarity to each of `product_ids`} over
+    their neighbours in `index`.
+    """
+    totals = {}
+    for product_id, weight in zip(product_ids, weights):
+        for pid, score in index.similar(product_id, SIMILARITY_TOP_K):
+            totals[pid] = totals.get(pid, 0.0) + weight * score
+    return totals
+
+
+def warm_model():
+    """ Map the saved similarity index at worker start; never fatal. """
+    try:
+        with _lock:
+            _current_index()
+    except Exception:
+        logger.exception("Could not load the recommender model at startup")
 
 
 # ---------------------------------------------------------
-# GET SIMILAR PRODUCTS USING PRECOMPUTED MATRIX
+# GET SIMILAR PRODUCTS FROM THE INDEX
 # ---------------------------------------------------------
 def get_recommendations_for_product(product_id, products, product_ids, cosine_sim, top_n=8):
 
-    # ❗ FIXED: Correct conditions — no boolean numpy array checks
     if cosine_sim is None:
         return []
 
-    if product_id not in product_ids:
+    row = cosine_sim.rows.get(product_id)
+    if row is None:
         return []
 
-    idx = product_ids.index(product_id)
-    sim_scores = list(enumerate(cosine_sim[idx]))
+    rows, _ = cosine_sim.row_neighbours(row, top_n)
 
-    # Sort by similarity (descending)
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
+    # Return products only
+    return [products[i] for i in rows]
 
-    # Skip itself
-    sim_scores = sim_scores[1 : top_n + 1]
 
-    # Return products only
-    return [products[i] for i, _ in sim_scores]
+# ---------------------------------------------------------
+# INTERACTION SCORES
+# ---------------------------------------------------------
+# A user's activity on a product is summarized in the database as one
+# number: the sum over their events of the action's weight, halved every
+# INTERACTION_HALF_LIFE_DAYS of age, so last week's cart counts for more
+# than a view from last year. One GROUP BY (user, product) returns a small
+# weighted vector per user instead of every event.
+
+ACTION_WEIGHTS = {
+    UserActivity.ACTION_VIEW: 1.0,
+    UserActivity.ACTION_LIKE: 2.0,
+    UserActivity.ACTION_CART: 2.0,
+    UserActivity.ACTION_PURCHASE: 4.0,
+}
+INTERACTION_HALF_LIFE_DAYS = 30
+
+
+class SecondsBetween(Func):
+    """ Seconds from the first datetime expression to the second. """
+    arity = 2
+    output_field = FloatField()
+    template = "TIMESTAMPDIFF(SECOND, %(expressions)s)"     # MySQL
+
+    def _compiled(self, compiler):
+        (start, start_params), (end, end_params) = (compiler.compile(e) for e in self.get_source_expressions())
+        return start, end, start_params, end_params
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        start, end, start_params, end_params = self._compiled(compiler)
+        return f"((julianday({end}) - julianday({start})) * 86400.0)", (*end_params, *start_params)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        start, end, start_params, end_params = self._compiled(compiler)
+        return f"EXTRACT(EPOCH FROM ({end} - {start}))", (*end_params, *start_params)
+
+
+def interaction_scores(activity, now=None, half_life_days=INTERACTION_HALF_LIFE_DAYS):
+    """
+    (user_id, product_id, score) rows of a UserActivity queryset: weighted,
+    decayed events summed per pair, as of `now` (default: the current time).
+    """
+    now = now or timezone.now()
+    weight = Case(
+        *(When(action=action, then=Value(w)) for action, w in ACTION_WEIGHTS.items()),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    age = SecondsBetween(F("timestamp"), Value(now, output_field=DateTimeField()))
+    decay = Exp(age * Value(-math.log(2) / (half_life_days * 86400)))
+    return (
+        activity.filter(action__in=ACTION_WEIGHTS, product__isnull=False)
+        .values_list("user_id", "product_id")
+        .annotate(score=Sum(weight * decay, output_field=FloatField()))
+        .order_by()
+    )
 
 
 # ---------------------------------------------------------
-# USER-PERSONALIZED RECOMMENDATIONS
+# BATCH PERSONALIZATION FOR EVERY USER
 # ---------------------------------------------------------
-def get_personalized_recommendation_ids(user_id, products, product_ids, cosine_sim, top_n=20):
+# All interactions come from one grouped query as a users x products
+# matrix of interaction scores; multiplied by the sparse top-K similarity it scores
+# the candidates of a block of users at once. Products the user already
+# interacted with are masked out. Users with at least N candidates get
+# their top N from one argpartition over the block; the others get all
+# their candidates and random unseen products after them.
+
+PERSONALIZED_TOP_N = 50
+WRITE_BATCH = 1000
+
+
+def load_interactions(index, user_ids):
+    """
+    users x products sparse matrix of interaction scores; rows follow
+    `user_ids` (ascending), columns the index.
+    """
+    user_rows = {uid: row for row, uid in enumerate(user_ids)}
+    if not user_ids:
+        return sp.csr_matrix((0, len(index)), dtype=np.float32)
+    pairs = interaction_scores(
+        UserActivity.objects.filter(user_id__gte=user_ids[0], user_id__lte=user_ids[-1]),
+    )
 
-    # Get interacted product IDs
-    interacted = list(
-        UserActivity.objects.filter(
-            user_id=user_id,
-            action__in=['View', 'Added to cart']
-        ).values_list("product_id", flat=True)
+    users, columns, scores = [], [], []
+    for user_id, product_id, score in pairs.iterator(chunk_size=10_000):
+        row = user_rows.get(user_id)
+        column = index.rows.get(product_id)
+        if row is not None and column is not None and score > 0:
+            users.append(row)
+            columns.append(column)
+            scores.append(score)
+    return sp.csr_matrix(
+        (np.asarray(scores, dtype=np.float32), (users, columns)), shape=(len(user_ids), len(index)),
     )
 
-    # If user has no interactions, fallback to random
-    if not interacted:
-        shuffled = products.copy()
-        shuffle(shuffled)
-        return [p.id for p in shuffled[:top_n]]
 
-    # Weight interactions
-    counts = Counter(interacted)
-    weighted_recs = []
+def _fill_at_random(rng, ranked, pool, excluded, top_n):
+    """ `ranked` topped up to top_n with random products of `pool` not in `excluded`. """
+    wanted = top_n - len(ranked)
+    if wanted <= 0 or not len(pool):
+        return ranked
+    # drawing `excluded` more than needed leaves enough once they are dropped
+    draw = pool[rng.choice(len(pool), min(len(pool), wanted + len(excluded)), replace=False)]
+    draw = draw[~np.isin(draw, excluded)][:wanted]
+    return np.concatenate([ranked, draw])
 
-    for pid, weight in counts.items():
-        recs = get_recommendations_for_product(
-            pid, products, product_ids, cosine_sim, top_n=top_n
-        )
 
-        for r in recs:
-            weighted_recs.append((r.id, weight))
+def personalize(index, interactions, top_n=PERSONALIZED_TOP_N, rng=None, block_bytes=BLOCK_BYTES):
+    """
+    Yield (first row, [[product_id, ...], ...]) for blocks of rows of
+    `interactions`, best first: products scored by interaction score times
+    similarity, unseen ones only, then random unseen ones.
+    """
+    rng = rng or np.random.default_rng()
+    n = len(index)
+    top_n = min(top_n, n)
+    similarity = index.to_sparse().astype(np.float32)
+    pool = index.rows.values()
+    dropped = np.ones(n, dtype=bool)
+    dropped[pool] = False     # rows of deleted products stay in the index
+    block = max(1, block_bytes // (max(n, 1) * 4))
+
+    for start in range(0, interactions.shape[0], block):
+        seen = interactions[start:start + block]
+        scored = seen @ similarity
+        scored = (scored - scored.multiply(seen > 0)).tocsr()    # nothing already seen
+        scored.eliminate_zeros()
+        candidates = np.diff(scored.indptr)
+
+        recommendations = [None] * seen.shape[0]
+
+        # enough candidates: rank them all at once
+        full = np.flatnonzero(candidates >= top_n) if top_n else np.array([], dtype=np.int64)
+        if len(full):
+            scores = scored[full].toarray()
+            top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+            for row, ranked in zip(full, np.take_along_axis(top, order, axis=1)):
+                recommendations[row] = index.product_ids[ranked].tolist()
 
-    # Sort by weight
-    weighted_recs.sort(key=lambda x: x[1], reverse=True)
+        # too few (or none): all of them, then random unseen products
+        for row in np.flatnonzero(candidates < top_n):
+            begin, stop = scored.indptr[row], scored.indptr[row + 1]
+            columns = scored.indices[begin:stop]
+            ranked = columns[np.argsort(-scored.data[begin:stop], kind="stable")]
+            excluded = np.concatenate([ranked, seen.indices[seen.indptr[row]:seen.indptr[row + 1]]])
+            ranked = _fill_at_random(rng, ranked, pool, excluded, top_n)
+            recommendations[row] = index.product_ids[ranked].tolist()
 
-    # Deduplicate while preserving order
-    seen = set()
-    final = []
-    for pid, _ in weighted_recs:
-        if pid not in seen:
-            final.append(pid)
-            seen.add(pid)
+        yield start, recommendations
+
+
+def save_recommendations(user_ids, product_ids, batch_size=WRITE_BATCH):
+    """ Insert or overwrite UserRecommendations rows in bulk. """
+    options = {"update_conflicts": True, "update_fields": ["product_ids", "updated_at"]}
+    if connection.features.supports_update_conflicts_with_target:
+        # PostgreSQL and SQLite need the conflict target; MySQL rejects one
+        options["unique_fields"] = ["user"]
+    UserRecommendations.objects.bulk_create(
+        [UserRecommendations(user_id=uid, product_ids=ids) for uid, ids in zip(user_ids, product_ids)],
+        batch_size=batch_size,
+        **options,
+    )
+
+
+def _generate_for_users(index, user_ids, top_n, batch_size):
+    """ Personalize and save `user_ids`; returns (load, compute, write) seconds. """
+    started = time.monotonic()
+    interactions = load_interactions(index, user_ids)
+    loaded = time.monotonic()
+
+    writing = 0.0
+    pending_users, pending = [], []
+    for start, recommendations in personalize(index, interactions, top_n):
+        pending_users += user_ids[start:start + len(recommendations)]
+        pending += recommendations
+        if len(pending) >= batch_size:
+            began = time.monotonic()
+            save_recommendations(pending_users, pending, batch_size)
+            writing += time.monotonic() - began
+            pending_users, pending = [], []
+    if pending:
+        began = time.monotonic()
+        save_recommendations(pending_users, pending, batch_size)
+        writing += time.monotonic() - began
+
+    return loaded - started, time.monotonic() - loaded - writing, writing
+
+
+def generate_recommendations(
+    index, top_n=PERSONALIZED_TOP_N, batch_size=WRITE_BATCH, workers=1, shard_size=None, user_ids=None,
+):
+    """
+    Personalize and save recommendations for `user_ids` (default: every
+    user). With workers > 1 users are split into ID ranges of `shard_size`
+    that a process pool handles in parallel, reading the index from saved
+    arrays (the version it was saved as, or a new one). Returns one timing
+    report per shard.
+    """
+    if user_ids is None:
+        user_ids = CustomUser.objects.values_list("id", flat=True)
+    user_ids = sorted(user_ids)
+    if workers <= 1 or len(user_ids) <= (shard_size or SHARD_SIZE):
+        started = time.monotonic()
+        load, compute, write = _generate_for_users(index, user_ids, top_n, batch_size)
+        return [_shard_report(0, user_ids, load, compute, write, time.monotonic() - started)]
+    if index.version is None:
+        save_similarity_index(index)
+    return _generate_in_shards(index.arrays, index.version, user_ids, top_n, batch_size, workers, shard_size or SHARD_SIZE)
+
+
+# ---------------------------------------------------------
+# SHARDED GENERATION IN WORKER PROCESSES
+# ---------------------------------------------------------
+# The parent saves the similarity index as .npy files once; every worker
+# memory-maps that version read-only instead of receiving a pickled copy,
+# so the pages are shared. Workers get their ID range's user ids, query
+# those users' interactions and write their results themselves; only
+# timings come back.
+
+SHARD_SIZE = 20_000
+
+
+def _shard_report(shard, user_ids, load, compute, write, seconds):
+    return {
+        "shard": shard,
+        "first_user": user_ids[0] if user_ids else None,
+        "last_user": user_ids[-1] if user_ids else None,
+        "users": len(user_ids),
+        "load": load,
+        "compute": compute,
+        "write": write,
+        "seconds": seconds,
+    }
+
+
+def _start_shard_worker():
+    # with the "spawn" start method the worker starts without Django
+    import django
+    django.setup()
+
+
+def _generate_shard(arrays, version, shard, user_ids, top_n, batch_size):
+    started = time.monotonic()
+    try:
+        index = load_similarity_index(version, name=arrays)
+        load, compute, write = _generate_for_users(index, user_ids, top_n, batch_size)
+        return _shard_report(shard, user_ids, load, compute, write, time.monotonic() - started)
+    finally:
+        connections.close_all()
+
+
+def _generate_in_shards(arrays, version, user_ids, top_n, batch_size, workers, shard_size):
+    shards = [user_ids[start:start + shard_size] for start in range(0, len(user_ids), shard_size)]
+
+    # forked workers must not share this process's database connections
+    connections.close_all()
+
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_shard_worker) as pool:
+        futures = {
+            pool.submit(_generate_shard, arrays, version, shard, shard_user_ids, top_n, batch_size): shard
+            for shard, shard_user_ids in enumerate(shards)
+        }
+        for future in as_completed(futures):
+            try:
+                report = future.result()
+            except Exception:
+                logger.exception("Recommendation shard %s failed", futures[future])
+                continue
+            logger.info(
+                "Recommendation shard %s (users %s-%s): %s users in %.1fs "
+                "(load %.1fs, compute %.1fs, write %.1fs)",
+                report["shard"], report["first_user"], report["last_user"], report["users"],
+                report["seconds"], report["load"], report["compute"], report["write"],
+            )
+            reports.append(report)
+    return sorted(reports, key=lambda report: report["shard"])
+
+
+# ---------------------------------------------------------
+# USERS WHOSE RECOMMENDATIONS ARE OUT OF DATE
+# ---------------------------------------------------------
+# A user's scores only depend on their interactions and on the neighbour
+# lists of the products they interacted with, so between two runs only
+# these users can get different recommendations: those with activity
+# after the last run's (timestamp, id) high-water mark, those who
+# interacted with a product whose neighbour list changed, those shown a
+# product that has since been deleted, and users without any yet. Activity
+# saved late with an older timestamp waits for the next full sweep.
+
+ID_BATCH = 1000
+
+
+def _batches(ids, size=ID_BATCH):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def activity_mark():
+    """ (timestamp, id) of the newest UserActivity, or (None, 0). """
+    newest = UserActivity.objects.order_by("-timestamp", "-id").values_list("timestamp", "id").first()
+    return newest or (None, 0)
+
+
+def neighbour_ids(index):
+    """ {product_id: frozenset of neighbour product ids} for the products of an index. """
+    rows = index.rows.values()
+    lists = np.where(index.neighbours[rows] >= 0, index.product_ids[index.neighbours[rows]], -1)
+    return dict(zip(index.product_ids[rows].tolist(), map(frozenset, lists.tolist())))
+
+
+def changed_products(old, new):
+    """
+    (ids whose neighbours differ or that are new, ids that are gone)
+    between two indexes. Order is ignored: a refit shifts IDF weights a
+    little and reorders near-ties without changing anyone's candidates.
+    """
+    before, after = neighbour_ids(old), neighbour_ids(new)
+    changed = {pid for pid, neighbours in after.items() if before.get(pid) != neighbours}
+    return changed, set(before) - set(after)
+
+
+def dirty_users(activity_at, activity_id, old, new):
+    """ Ids of the users whose recommendations may differ under `new` (see above). """
+    users = set()
+
+    if activity_at is not None:
+        recent = UserActivity.objects.filter(
+            Q(timestamp__gt=activity_at) | Q(timestamp=activity_at, id__gt=activity_id),
+            user__isnull=False,
+        )
+    else:
+        recent = UserActivity.objects.filter(user__isnull=False)
+    users.update(recent.values_list("user_id", flat=True).distinct())
+
+    changed, deleted = changed_products(old, new)
+    for batch in _batches(changed):
+        users.update(
+            UserActivity.objects.filter(product_id__in=batch, action__in=ACTION_WEIGHTS, user__isnull=False)
+            .values_list("user_id", flat=True).distinct()
+        )
 
-    # If not enough recommendations → fill with random
-    if len(final) < top_n:
-        remaining = [p.id for p in products if p.id not in seen]
-        shuffle(remaining)
-        final.extend(remaining)
+    if deleted:
+        shown = UserRecommendations.objects.all()
+        if connection.features.supports_json_field_contains:
+            for batch in _batches(deleted, 100):
+                condition = Q()
+                for pid in batch:
+                    condition |= Q(product_ids__contains=[pid])
+                users.update(shown.filter(condition).values_list("user_id", flat=True))
+        else:
+            # SQLite can't search inside JSON: scan the lists here
+            for user_id, product_ids in shown.values_list("user_id", "product_ids").iterator(chunk_size=10_000):
+                if deleted.intersection(product_ids or ()):
+                    users.add(user_id)
 
-    return final[:top_n]
+    users.update(CustomUser.objects.filter(userrecommendations__isnull=True).values_list("id", flat=True))
+    return users
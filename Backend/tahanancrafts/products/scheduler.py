@@ -1,37 +1,97 @@
 # backend/tahanancrafts/products/scheduler.py
 import logging
+import time
+from datetime import timedelta
+
 from apscheduler.schedulers.background import BackgroundScheduler
+from django.conf import settings
+from django.utils import timezone
 from django_apscheduler.jobstores import DjangoJobStore, register_events
 
-from users.models import CustomUser
-from .models import UserRecommendations
-from .recommender import compute_similarity_matrix, get_personalized_recommendation_ids
+from .models import RecommendationRun
+from .collaborative import BLENDED_ARRAYS, blended_index
+from .recommender import (
+    activity_mark, dirty_users, generate_recommendations, load_model, load_similarity_index, save_similarity_index,
+    update_saved_model,
+)
+from .leaderboards import refresh_leaderboards
+from search.querylog import roll_up as roll_up_search_queries
 
 logger = logging.getLogger(__name__)
 
-def generate_all_recommendations():
+FULL_SWEEP_INTERVAL = timedelta(hours=24)
+
+
+def generate_all_recommendations(workers=None, shard_size=None, full_sweep=False):
+    """
+    Blend the saved similarity index (patched from the change feed first;
+    refitted only when update_saved_model can't keep it current) with
+    co-occurrence similarity from user interactions, then regenerate
+    recommendations for the users whose results may have changed since
+    the last run; every user on a full sweep (forced, daily, or when the
+    last run's index is gone).
+    """
     logger.info("🔁 Scheduler: generating similarity matrix and user recommendations...")
-    products, product_ids, cosine_sim = compute_similarity_matrix()
-    if not products:
+    started = time.monotonic()
+    # taken first: activity saved during the run is after the mark
+    activity_at, activity_id = activity_mark()
+
+    update_saved_model()
+    model = load_model()
+    if model is None or not len(model.similarity.rows):
         logger.info("No products found; skipping recommendation generation.")
-        return
+        return []
+    index, _ = blended_index(model.similarity)
+    version = save_similarity_index(index, BLENDED_ARRAYS)
 
-    users = CustomUser.objects.all().only("id")
-    logger.info(f"Generating recommendations for {users.count()} users")
+    previous = RecommendationRun.objects.order_by("-created_at", "-id").first()
+    previous_index = (
+        load_similarity_index(previous.index_version, name=BLENDED_ARRAYS)
+        if previous and previous.index_version else None
+    )
+    last_sweep = (
+        RecommendationRun.objects.filter(full_sweep=True).order_by("-created_at").values_list("created_at", flat=True).first()
+    )
+    full_sweep = (
+        full_sweep or previous_index is None or last_sweep is None or timezone.now() - last_sweep >= FULL_SWEEP_INTERVAL
+    )
 
-    for user in users.iterator():
-        try:
-            rec_ids = get_personalized_recommendation_ids(user.id, products, product_ids, cosine_sim, top_n=50)
-            UserRecommendations.objects.update_or_create(user_id=user.id, defaults={"product_ids": rec_ids})
-        except Exception:
-            logger.exception("Error generating recs for user %s", user.id)
+    user_ids = None
+    if not full_sweep:
+        user_ids = dirty_users(previous.activity_at, previous.activity_id, previous_index, index)
+        logger.info("%s users have new activity or changed recommendations", len(user_ids))
 
-    logger.info("✅ Completed generating recommendations for all users.")
+    shards = generate_recommendations(
+        index,
+        top_n=50,
+        workers=workers or settings.RECOMMENDATION_WORKERS,
+        shard_size=shard_size or settings.RECOMMENDATION_SHARD_SIZE,
+        user_ids=user_ids,
+    )
+    seconds = time.monotonic() - started
+    users = sum(shard["users"] for shard in shards)
+
+    RecommendationRun.objects.create(
+        full_sweep=full_sweep,
+        activity_at=activity_at,
+        activity_id=activity_id,
+        index_version=version,
+        users=users,
+        seconds=seconds,
+    )
+    logger.info(
+        "✅ Completed generating recommendations for %s users in %.1fs (%.0f users/s, %s shards, %s).",
+        users, seconds, users / max(seconds, 1e-9), len(shards), "full sweep" if full_sweep else "incremental",
+    )
+    return shards
 
 
-def start_scheduler(interval_minutes=60):
+def start_scheduler(interval_minutes=60, leaderboard_minutes=15, search_rollup_minutes=15, model_minutes=2):
     """
     Start APScheduler background scheduler. Default: run every `interval_minutes`.
+    Leaderboards are refreshed every `leaderboard_minutes`, search analytics
+    every `search_rollup_minutes`, and the saved TF-IDF model web workers
+    read is patched from the change feed every `model_minutes`.
     """
     if getattr(start_scheduler, "_started", False):
         return
@@ -47,7 +107,37 @@ def start_scheduler(interval_minutes=60):
         replace_existing=True,
     )
 
+    # cheap: also run once at start, so a fresh deploy has them right away
+    scheduler.add_job(
+        refresh_leaderboards,
+        trigger="interval",
+        minutes=leaderboard_minutes,
+        id="refresh_product_leaderboards",
+        replace_existing=True,
+        next_run_time=timezone.now(),
+    )
+
+    scheduler.add_job(
+        update_saved_model,
+        trigger="interval",
+        minutes=model_minutes,
+        id="update_recommender_model",
+        replace_existing=True,
+        max_instances=1,
+        next_run_time=timezone.now(),
+    )
+
+    scheduler.add_job(
+        roll_up_search_queries,
+        trigger="interval",
+        minutes=search_rollup_minutes,
+        id="roll_up_search_queries",
+        replace_existing=True,
+        next_run_time=timezone.now(),
+    )
+
     register_events(scheduler)
     scheduler.start()
     start_scheduler._started = True
     logger.info("⏰ APScheduler started: generate_all_recommendations every %s minutes", interval_minutes)
+    return scheduler
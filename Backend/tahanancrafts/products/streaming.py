@@ -0,0 +1,84 @@
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+# ---------------------------------------------------------
+# STREAMED JSON ARRAYS FOR LARGE LIST RESPONSES
+# ---------------------------------------------------------
+# A normal Response keeps every row dict *and* the rendered body in memory
+# before the first byte goes out. Here rows are encoded a batch at a time
+# and written as they are produced, so memory stays flat with the row count.
+# The body is the same JSON array a Response would have rendered.
+
+STREAM_CHUNK_SIZE = 1000
+
+# DRF's encoder (datetimes, Decimals, ...) without indent runs on the C
+# encoder; compact separators match what JSONRenderer sends.
+_encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def iter_json_array(rows, batch_size=STREAM_CHUNK_SIZE):
+    """ Yield a JSON array of `rows` as bytes, one batch of rows per piece. """
+    rows = iter(rows)
+    first = True
+    yield b"["
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        # encode the batch as one array and drop its brackets
+        body = _encoder.encode(batch)[1:-1]
+        yield (body if first else "," + body).encode("utf-8")
+        first = False
+    yield b"]"
+
+
+def chunked(queryset, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Iterate a queryset without caching it. prefetch_related lookups on the
+    queryset are applied per chunk (Django runs them for each fetched chunk).
+    """
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    Stream `rows` (any iterable of JSON-able dicts) as a JSON array.
+
+    Errors raised while iterating happen after the status line was sent,
+    so the client sees a truncated body instead of a 500.
+    """
+
+    def __init__(self, rows, batch_size=STREAM_CHUNK_SIZE, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(iter_json_array(rows, batch_size), **kwargs)
+
+
+class StreamingListMixin:
+    """
+    Opt-in streaming for ListAPIView subclasses: "?stream=true" returns
+    every filtered row as a streamed array instead of one page.
+    """
+    stream_query_param = "stream"
+    stream_chunk_size = STREAM_CHUNK_SIZE
+
+    def wants_stream(self, request):
+        value = request.query_params.get(self.stream_query_param, "")
+        return value.lower() in ("1", "true", "yes")
+
+    def stream_rows(self, queryset):
+        # serializer runs once per chunk; prefetches are per chunk as well
+        rows = iter(chunked(queryset, self.stream_chunk_size))
+        while True:
+            chunk = list(islice(rows, self.stream_chunk_size))
+            if not chunk:
+                return
+            yield from self.get_serializer(chunk, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        if not self.wants_stream(request):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingJSONResponse(self.stream_rows(queryset), batch_size=self.stream_chunk_size)
@@ -1,3 +1,1478 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import scipy.sparse as sp
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from products import collaborative, evaluation, images, recent_views, recommender
+from products.admin.serializers import ProductSerializer as AdminProductSerializer
+from products.bulk.services import FORMAT_CSV, ProductImporter, export_products, read_rows
+from products.collaborative import BLENDED_ARRAYS
+from products.leaderboards import get_entries
+from products.models import (
+    Cart, Category, Material, Order, OrderItem, Product, ProductImage, ProductLeaderboard, ProductLike, ProductStats,
+    Rating, RecommendationRun, UserActivity, UserRecommendations,
+)
+from products.product import facets
+from products.product.cache import CATALOG, SNAPSHOT, artisan_scope, bump_version, get_counters, get_versions
+from products.product.serializers import ProductSerializer
+from products.scheduler import generate_all_recommendations
+from search import autocomplete, semantic
+from users.models import Artisan, CustomUser, ShippingAddress
+
+
+def make_products(count, artisan):
+    category, _ = Category.objects.get_or_create(name="Baskets")
+    material, _ = Material.objects.get_or_create(name="Abaca")
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            name=f"Basket {i}",
+            description="Handwoven basket",
+            stock_quantity=5,
+            regular_price=100,
+            main_image="media/products/main/basket.png",
+            artisan=artisan,
+        )
+        product.categories.add(category)
+        product.materials.add(material)
+        ProductImage.objects.create(product=product, image="media/products/others/basket.png")
+        products.append(product)
+    return products
+
+
+class ProductStatsTests(TestCase):
+    """ProductStats counters follow likes, ratings and orders by deltas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="s@example.com", password="pass", name="S", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        cls.address = ShippingAddress.objects.create(
+            user=cls.user, full_name="S", phone="1", address="x", barangay="b", city="c", province="p",
+        )
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Abaca bag", description="Woven bag", stock_quantity=5, regular_price=300,
+            main_image="media/products/main/bag.png", artisan=self.artisan,
+        )
+
+    def stats(self):
+        stats = ProductStats.objects.get(product=self.product)
+        return {
+            "sold": stats.sold_count,
+            "orders": stats.order_count,
+            "rating_sum": stats.rating_sum,
+            "ratings": stats.rating_count,
+            "likes": stats.like_count,
+        }
+
+    def order(self, quantity=2, status=Order.STATUS_AWAITING_PAYMENT):
+        order = Order.objects.create(user=self.user, artisan=self.artisan, shipping_address=self.address, status=status)
+        item = OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price=300)
+        return order, item
+
+    def test_new_products_start_at_zero(self):
+        self.assertEqual(self.stats(), {"sold": 0, "orders": 0, "rating_sum": 0, "ratings": 0, "likes": 0})
+
+    def test_likes_and_unlikes(self):
+        like = ProductLike.objects.create(user=self.user, product=self.product)
+        self.assertEqual(self.stats()["likes"], 1)
+        like.delete()
+        self.assertEqual(self.stats()["likes"], 0)
+
+    def test_ratings_are_summed_and_rescored(self):
+        rating = Rating.objects.create(user=self.user, product=self.product, score=4)
+        Rating.objects.create(user=CustomUser.objects.create_user(
+            email="t@example.com", password="pass", name="T", role="seller",
+        ), product=self.product, score=2)
+        self.assertEqual((self.stats()["rating_sum"], self.stats()["ratings"]), (6, 2))
+
+        rating.score = 5
+        rating.save()
+        self.assertEqual((self.stats()["rating_sum"], self.stats()["ratings"]), (7, 2))
+
+        rating.delete()
+        self.assertEqual((self.stats()["rating_sum"], self.stats()["ratings"]), (2, 1))
+
+    def test_units_count_as_sold_only_in_sold_statuses(self):
+        order, item = self.order(quantity=2)
+        self.assertEqual((self.stats()["sold"], self.stats()["orders"]), (0, 1))
+
+        order.status = Order.STATUS_COMPLETED
+        order.save()
+        self.assertEqual((self.stats()["sold"], self.stats()["orders"]), (2, 1))
+
+        item.quantity = 3
+        item.save()
+        self.assertEqual(self.stats()["sold"], 3)
+
+        order.status = Order.STATUS_CANCELLED
+        order.save()
+        self.assertEqual((self.stats()["sold"], self.stats()["orders"]), (0, 0))
+
+    def test_an_order_counts_once_per_product(self):
+        order, item = self.order(status=Order.STATUS_DELIVERED)
+        second = OrderItem.objects.create(order=order, product=self.product, quantity=1, price=300)
+        self.assertEqual((self.stats()["sold"], self.stats()["orders"]), (3, 1))
+
+        item.delete()
+        self.assertEqual((self.stats()["sold"], self.stats()["orders"]), (1, 1))
+        second.delete()
+        self.assertEqual((self.stats()["sold"], self.stats()["orders"]), (0, 0))
+
+    def test_rebuild_reconciles_a_drifted_row(self):
+        self.order(quantity=2, status=Order.STATUS_COMPLETED)
+        Rating.objects.create(user=self.user, product=self.product, score=4)
+        ProductLike.objects.create(user=self.user, product=self.product)
+        expected = self.stats()
+
+        ProductStats.objects.filter(product=self.product).update(sold_count=99, like_count=-3, rating_count=0)
+        call_command("rebuild_product_stats", product_ids=[self.product.id], stdout=io.StringIO())
+        self.assertEqual(self.stats(), expected)
+        self.assertEqual(expected, {"sold": 2, "orders": 1, "rating_sum": 4, "ratings": 1, "likes": 1})
+
+    def test_rebuild_fills_missing_rows(self):
+        ProductStats.objects.filter(product=self.product).delete()
+        ProductLike.objects.create(user=self.user, product=self.product)     # no row: skipped
+        call_command("rebuild_product_stats", stdout=io.StringIO())
+        self.assertEqual(self.stats()["likes"], 1)
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages of the product list, newest first, with sparse fields."""
+
+    url = "/api/products/product/products/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="k@example.com", password="pass", name="K", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        self.products = make_products(5, self.artisan)
+        # two products share a timestamp: the id breaks the tie
+        Product.objects.filter(id=self.products[2].id).update(created_at=self.products[3].created_at)
+    def walk(self, limit):
+        ids, params = [], {"limit": limit, "fields": "id"}
+        while True:
+            data = self.client.get(self.url, params).json()
+            ids += [p["id"] for p in data["results"]]
+            if not data["next_cursor"]:
+                return ids
+            params["cursor"] = data["next_cursor"]
+
+    def test_pages_cover_the_catalog_once_newest_first(self):
+        expected = list(Product.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(self.walk(2), expected)
+        self.assertEqual(self.walk(100), expected)
+
+    def test_products_added_while_paging_do_not_shift_pages(self):
+        first = self.client.get(self.url, {"limit": 2, "fields": "id"}).json()
+        make_products(3, self.artisan)
+
+        second = self.client.get(self.url, {"limit": 2, "fields": "id", "cursor": first["next_cursor"]}).json()
+
+        seen = [p["id"] for p in first["results"] + second["results"]]
+        older = Product.objects.order_by("-created_at", "-id").filter(id__in=[p.id for p in self.products])
+        self.assertEqual(seen, list(older.values_list("id", flat=True)[:4]))
+
+    def test_fields_limit_keys_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url, {"limit": 1, "fields": "id,name,bogus"}).json()
+        self.assertEqual(list(data["results"][0]), ["id", "name"])
+        self.assertNotIn("description", queries[-1]["sql"])
+
+    def test_invalid_cursor_is_a_404_and_no_valid_fields_a_400(self):
+        self.assertEqual(self.client.get(self.url, {"cursor": "not-a-cursor"}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"fields": "bogus"}).status_code, 400)
+
+
+class ProductReadQueryCountTests(TestCase):
+    """ProductReadSerializer views must not issue one query per product."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email="buyer@example.com", password="pass", name="Buyer", role="seller"
+        )
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def get_query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_personalized_queries_do_not_grow_with_list_length(self):
+        products = make_products(2, self.artisan)
+        rec = UserRecommendations.objects.create(user=self.user, product_ids=[p.id for p in products])
+        Rating.objects.create(user=self.user, product=products[0], score=4)
+        url = f"/api/products/product/personalized/{self.user.id}/"
+        small = self.get_query_count(url)
+
+        products += make_products(8, self.artisan)
+        rec.product_ids = [p.id for p in products]
+        rec.save()
+        self.assertEqual(self.get_query_count(url), small)
+
+    def test_personalized_keeps_recommendation_order_and_rating(self):
+        products = make_products(3, self.artisan)
+        Rating.objects.create(user=self.user, product=products[1], score=4)
+        Rating.objects.create(user=self.user, product=products[1], score=5)
+        ids = [products[1].id, products[2].id, products[0].id]
+        UserRecommendations.objects.create(user=self.user, product_ids=ids)
+
+        data = self.client.get(f"/api/products/product/personalized/{self.user.id}/").json()
+
+        self.assertEqual([p["id"] for p in data], ids)
+        self.assertEqual(data[0]["avg_rating"], 4.5)
+        self.assertEqual(data[1]["avg_rating"], 0.0)
+
+    def test_detail_and_featured_use_constant_queries(self):
+        product = make_products(1, self.artisan)[0]
+
+        with self.assertNumQueries(4):
+            self.client.get(f"/api/products/product/products/{product.id}/")
+        with self.assertNumQueries(4):
+            self.client.get("/api/products/product/featured-products/")
+
+
+class ImageVariantTests(TestCase):
+    """Resized WebP / JPEG copies of uploads, and which one a listing shows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="v@example.com", password="pass", name="V", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, size, mode="RGBA"):
+        buffer = io.BytesIO()
+        Image.new(mode, size, (200, 120, 40, 128) if mode == "RGBA" else "white").save(buffer, "PNG")
+        return default_storage.save("media/products/main/lamp.png", ContentFile(buffer.getvalue()))
+
+    def test_every_width_is_written_in_both_formats(self):
+        source = self.upload((1200, 600))
+        product = Product.objects.create(
+            name="Capiz lamp", description="Shell lamp", stock_quantity=1, regular_price=450,
+            main_image=source, artisan=self.artisan,
+        )
+        version = get_versions([CATALOG])[0]
+
+        variants = images.process_source(source)
+
+        self.assertEqual(
+            sorted((v["width"], v["format"]) for v in variants),
+            sorted((w, f) for w in images.WIDTHS for f in images.FORMATS),
+        )
+        for variant in variants:
+            self.assertEqual(variant["height"], variant["width"] // 2)
+            with default_storage.open(variant["name"], "rb") as stored:
+                self.assertEqual(Image.open(stored).size, (variant["width"], variant["height"]))
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, variants)
+        self.assertNotEqual(get_versions([CATALOG])[0], version)
+
+    def test_small_images_are_not_upscaled(self):
+        variants = images.build_variants(self.upload((300, 300), mode="RGB"))
+        self.assertEqual(sorted({v["width"] for v in variants}), [240, 300])
+
+    def test_listing_picks_the_smallest_wide_enough_webp(self):
+        variants = [
+            {"name": f"v-{w}.{f}", "format": f, "width": w, "height": w, "bytes": 1}
+            for w in (240, 480, 960) for f in ("webp", "jpeg")
+        ]
+        self.assertEqual(images.pick_variant(variants)["name"], "v-480.webp")
+        self.assertEqual(images.pick_variant(variants, 500)["name"], "v-960.webp")
+        self.assertEqual(images.pick_variant(variants, 2000)["name"], "v-960.webp")
+        self.assertEqual(images.pick_variant(variants, 300, fmt="jpeg")["name"], "v-480.jpeg")
+        self.assertIsNone(images.pick_variant([]))
+        self.assertEqual(images.thumbnail_url(None, variants), default_storage.url("v-480.webp"))
+        self.assertIsNone(images.thumbnail_url(None, []))
+
+
+def skip_variant_jobs(test):
+    """ Saved products queue no background resizing; most test images are never written. """
+    for target in ("products.product.signals.queue_variants", "products.bulk.services.queue_variants"):
+        patcher = mock.patch(target)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+def image_archive(*names):
+    """ A zip of small PNGs under `names`, as the bulk importer receives it. """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in names:
+            image = io.BytesIO()
+            Image.new("RGB", (8, 8), "white").save(image, "PNG")
+            archive.writestr(name, image.getvalue())
+    buffer.seek(0)
+    return buffer
+
+
+def import_csv(importer, text):
+    for _ in importer.run(read_rows(io.BytesIO(text.encode()), FORMAT_CSV)):
+        pass
+    return importer.summary
+
+
+class ProductImporterTests(TestCase):
+    """Bulk imports, which write with bulk_create and so send no model signals."""
+
+    header = "name,description,stock_quantity,regular_price,categories,materials,main_image,images\n"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="i@example.com", password="pass", name="I", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        skip_variant_jobs(self)
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media = media
+
+    def importer(self, *images, **options):
+        return ProductImporter(self.artisan, image_archive(*images), **options)
+
+    def test_imported_products_reach_the_autocomplete_of_a_warm_worker(self):
+        autocomplete._completions = autocomplete.build_completions()
+        self.addCleanup(setattr, autocomplete, "_completions", None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            summary = import_csv(self.importer("lamp.png"), self.header + (
+                "Capiz lamp,Shell lamp,3,450,Lighting,Capiz,lamp.png,\n"
+            ))
+
+        self.assertEqual(summary["created"], 1)
+        completions = autocomplete.complete("capi")
+        self.assertIn("Capiz lamp", [text for _, _, text in completions])
+        self.assertIn("Capiz", [text for _, _, text in completions])
+        self.assertIn("Lighting", [text for _, _, text in autocomplete.complete("ligh")])
+
+    def test_rows_get_their_links_images_and_stats(self):
+        summary = import_csv(self.importer("a.png", "b.png"), self.header + (
+            "Abaca bag,Woven bag,2,300,Bags|Gifts,Abaca,a.png,b.png\n"
+            "Rattan chair,Woven chair,1,900,Furniture,Rattan,b.png,\n"
+        ))
+
+        self.assertEqual((summary["created"], summary["failed"]), (2, 0))
+        bag = Product.objects.get(name="Abaca bag")
+        chair = Product.objects.get(name="Rattan chair")
+        self.assertEqual(sorted(c.name for c in bag.categories.all()), ["Bags", "Gifts"])
+        self.assertEqual([m.name for m in chair.materials.all()], ["Rattan"])
+        self.assertTrue(default_storage.exists(bag.main_image.name))
+        self.assertEqual(bag.images.count(), 1)
+        self.assertEqual(ProductStats.objects.filter(product__in=[bag, chair]).count(), 2)
+
+    def test_invalid_rows_are_reported_and_the_rest_imported(self):
+        summary = import_csv(self.importer("a.png"), self.header + (
+            "Abaca bag,Woven bag,2,300,,,a.png,\n"
+            ",Woven mat,-1,abc,,,missing.png,\n"
+        ))
+
+        self.assertEqual((summary["created"], summary["failed"]), (1, 1))
+        (error,) = summary["errors"]
+        self.assertEqual(error["row"], 2)
+        self.assertEqual(
+            sorted(error["errors"]), ["main_image", "name", "regular_price", "stock_quantity"],
+        )
+
+    def test_dry_runs_only_validate(self):
+        summary = import_csv(self.importer("a.png", dry_run=True), self.header + "Abaca bag,Woven bag,2,300,,,a.png,\n")
+        self.assertEqual(summary["created"], 1)
+        self.assertFalse(Product.objects.exists())
+
+    def test_exports_import_again(self):
+        import_csv(self.importer("a.png"), self.header + "Abaca bag,Woven bag,2,300,Bags|Gifts,Abaca,a.png,\n")
+        exported = "".join(export_products(self.artisan.id))
+        Product.objects.all().delete()
+
+        summary = import_csv(ProductImporter(self.artisan), exported)
+        self.assertEqual(summary["created"], 1)
+        bag = Product.objects.get()
+        self.assertEqual((bag.name, bag.stock_quantity), ("Abaca bag", 2))
+        self.assertEqual(sorted(c.name for c in bag.categories.all()), ["Bags", "Gifts"])
+
+    def test_rows_may_only_point_at_archive_members_or_this_artisans_images(self):
+        import_csv(self.importer("a.png"), self.header + "Abaca bag,Woven bag,2,300,,,a.png,\n")
+        own = Product.objects.get().main_image.name
+        other = default_storage.save("media/products/main/artisan_0/b.png", ContentFile(b"png"))
+        shared = default_storage.save("media/products/main/c.png", ContentFile(b"png"))
+
+        own_dir = os.path.dirname(own)
+        rows = [own, other, shared, f"{own_dir}/../artisan_0/b.png", f"{own_dir}/../c.png", "/etc/passwd"]
+        summary = import_csv(ProductImporter(self.artisan), self.header + "".join(
+            f"Mat {i},Woven mat,1,100,,,{name},\n" for i, name in enumerate(rows)
+        ))
+        self.assertEqual(summary["created"], 1)
+        self.assertEqual([error["row"] for error in summary["errors"]], [2, 3, 4, 5, 6])
+
+        with mock.patch("products.bulk.services.default_storage.exists", side_effect=SuspiciousFileOperation):
+            summary = import_csv(ProductImporter(self.artisan), self.header + f"Mat,Woven mat,1,100,,,{own},\n")
+        self.assertEqual(summary["errors"][0]["errors"], {"main_image": f"Image '{own}' not found."})
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, names in os.walk(self.media) for name in names
+        )
+
+    def test_rows_are_matched_by_batch_without_returned_ids(self):
+        make_products(1, self.artisan)
+        with mock.patch.object(
+            type(connection.features), "can_return_rows_from_bulk_insert", new_callable=mock.PropertyMock,
+            return_value=False,
+        ):
+            summary = import_csv(self.importer("a.png"), self.header + (
+                "Abaca bag,Woven bag,2,300,Bags,,a.png,\n"
+                "Abaca mat,Woven mat,2,200,Mats,,a.png,\n"
+            ))
+
+        self.assertEqual(summary["created"], 2)
+        self.assertEqual(
+            {p.name: [c.name for c in p.categories.all()] for p in Product.objects.filter(import_batch__isnull=False)},
+            {"Abaca bag": ["Bags"], "Abaca mat": ["Mats"]},
+        )
+        imported = Product.objects.filter(import_batch__isnull=False).first()
+        self.assertNotIn("import_batch", ProductSerializer(imported).data)
+        self.assertNotIn("import_batch", AdminProductSerializer(imported).data)
+
+    def test_a_failed_chunk_leaves_no_images_behind(self):
+        with mock.patch("products.bulk.services.ProductStats.objects.bulk_create", side_effect=RuntimeError("boom")):
+            summary = import_csv(self.importer("a.png", "b.png"), self.header + (
+                "Abaca bag,Woven bag,2,300,Bags,Abaca,a.png,b.png\n"
+            ))
+
+        self.assertEqual((summary["created"], summary["failed"]), (0, 1))
+        self.assertFalse(Product.objects.filter(name="Abaca bag").exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_images_shared_with_an_imported_chunk_are_kept(self):
+        importer = self.importer("a.png")
+        importer.chunk_size = 1
+        with mock.patch(
+            "products.bulk.services.ProductStats.objects.bulk_create",
+            side_effect=[[], RuntimeError("boom")],
+        ):
+            summary = import_csv(importer, self.header + (
+                "Abaca bag,Woven bag,2,300,,,a.png,\n"
+                "Abaca mat,Woven mat,2,200,,,a.png,\n"
+            ))
+
+        self.assertEqual(summary["created"], 1)
+        main_image = Product.objects.get(name="Abaca bag").main_image.name
+        self.assertTrue(default_storage.exists(main_image))
+
+
+class CatalogSnapshotTests(SimpleTestCase):
+    """Facet bitsets and sort orders patched one product at a time."""
+
+    def snapshot(self, rows=(), categories=None, materials=None):
+        snapshot = facets.CatalogSnapshot(capacity=8)
+        snapshot.load(list(rows), categories or {}, materials or {})
+        return snapshot
+
+    def test_upsert_with_a_category_the_table_has_not_seen(self):
+        snapshot = self.snapshot([(1, 100.0, 5, 1, 10)], categories={1: {7}})
+        snapshot.upsert((2, 50.0, 5, 1, 20), [8], [])
+
+        self.assertEqual(snapshot.query(categories=[8])["ids"], [2])
+        self.assertEqual(snapshot.query(categories=[7])["ids"], [1])
+        self.assertEqual(snapshot.memberships(2), ([8], []))
+
+    def test_upsert_into_an_empty_snapshot(self):
+        snapshot = self.snapshot()
+        snapshot.upsert((1, 100.0, 0, 3, 10), [4], [5])
+
+        result = snapshot.query(materials=[5])
+        self.assertEqual(result["ids"], [1])
+        self.assertEqual(result["facets"]["categories"], [{"id": 4, "name": "", "count": 1}])
+
+    def test_upsert_moves_changed_tags(self):
+        snapshot = self.snapshot([(1, 100.0, 5, 1, 10)], categories={1: {7}})
+        snapshot.upsert((1, 100.0, 5, 1, 10), [9], [])
+
+        self.assertEqual(snapshot.query(categories=[7])["ids"], [])
+        self.assertEqual(snapshot.query(categories=[9])["ids"], [1])
+
+    def test_remove_hides_the_product_from_results_and_counts(self):
+        snapshot = self.snapshot([(1, 100.0, 5, 1, 10), (2, 80.0, 5, 1, 20)], categories={1: {7}, 2: {7}})
+        snapshot.remove(2)
+
+        result = snapshot.query(categories=[7])
+        self.assertEqual(result["ids"], [1])
+        self.assertEqual(result["facets"]["categories"][0]["count"], 1)
+
+    def test_upserts_keep_every_sort_order(self):
+        snapshot = self.snapshot([(pid, float(pid % 3), 1, 1, pid) for pid in range(1, 6)])
+        snapshot.upsert((6, 1.0, 1, 1, 0), [], [])        # oldest, and a price tie
+        snapshot.upsert((3, 9.0, 1, 1, 99), [], [])       # now the newest and dearest
+        snapshot.upsert((7, 0.0, 1, 1, 50), [], [])
+
+        patched = {sort: snapshot.query(sort=sort)["ids"] for sort in facets.SORTS}
+        snapshot._resort()
+        for sort in facets.SORTS:
+            self.assertEqual(patched[sort], snapshot.query(sort=sort)["ids"], sort)
+        self.assertEqual(patched["newest"][0], 3)
+        self.assertEqual(patched["price_desc"][0], 3)
+        self.assertEqual(patched["oldest"][0], 6)
+
+    def test_removed_rows_are_freed_for_new_products(self):
+        snapshot = self.snapshot([(pid, 10.0 * pid, 1, 1, pid) for pid in range(1, 5)], categories={2: {7}})
+        snapshot.remove(2)
+        self.assertEqual(snapshot.query(sort="oldest")["ids"], [1, 3, 4])
+        self.assertEqual(snapshot.memberships(2), ([], []))
+        self.assertFalse(snapshot.fragmented())
+
+        snapshot.upsert((5, 5.0, 1, 1, 0), [7], [])
+        self.assertEqual(snapshot.size, 4)
+        self.assertEqual(snapshot.query(sort="oldest")["ids"], [5, 1, 3, 4])
+        self.assertEqual(snapshot.query(sort="price_asc")["ids"], [5, 1, 3, 4])
+        self.assertEqual(snapshot.query(categories=[7])["ids"], [5])
+
+        snapshot.remove(1)
+        snapshot.remove(3)
+        self.assertTrue(snapshot.fragmented())
+
+
+class CatalogSnapshotPatchTests(TestCase):
+    """A worker's snapshot after product saves committed by it or by others."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="s@example.com", password="pass", name="S", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        facets._snapshot = None
+        self.addCleanup(setattr, facets, "_snapshot", None)
+        rebuild = mock.patch("products.product.facets._rebuild_in_background")
+        self.rebuild = rebuild.start()
+        self.addCleanup(rebuild.stop)
+
+    def test_tagging_with_a_new_category_is_patched_in(self):
+        product = make_products(1, self.artisan)[0]
+        snapshot = facets.get_snapshot()
+        category = Category.objects.create(name="Lamps")
+        snapshot = facets.get_snapshot()      # the new category marked it stale
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.categories.add(category)
+
+        self.assertIs(facets.get_snapshot(), snapshot)
+        self.assertEqual(snapshot.query(categories=[category.id])["ids"], [product.id])
+
+    def test_patch_after_another_change_rebuilds_in_the_background(self):
+        product = make_products(1, self.artisan)[0]
+        snapshot = facets.get_snapshot()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            facets.mark_stale()
+            product.stock_quantity = 0
+            product.save()
+
+        # the old snapshot answers until the new one is built
+        self.rebuild.assert_called_once_with()
+        self.assertIs(facets.get_snapshot(), snapshot)
+        facets._rebuild()
+        rebuilt = facets.get_snapshot()
+        self.assertIsNot(rebuilt, snapshot)
+        self.assertEqual(rebuilt.version, get_versions([SNAPSHOT])[0])
+        self.assertEqual(rebuilt.query(in_stock=True)["ids"], [])
+
+    def test_a_stale_snapshot_is_served_while_it_is_rebuilt(self):
+        snapshot = facets.get_snapshot()
+        bump_version(SNAPSHOT)      # another worker's change
+        self.assertIs(facets.get_snapshot(), snapshot)      # too recent to rebuild yet
+        self.rebuild.assert_not_called()
+
+        with mock.patch("products.product.facets.REBUILD_INTERVAL", 0):
+            self.assertIs(facets.get_snapshot(), snapshot)
+        self.rebuild.assert_called_once_with()
+
+    def test_a_rebuild_packs_the_rows_deleted_products_freed(self):
+        products = make_products(4, self.artisan)
+        snapshot = facets.get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in products[:2]:
+                product.delete()
+
+        self.assertIs(facets.get_snapshot(), snapshot)
+        self.rebuild.assert_called_once_with()
+        facets._rebuild()
+        rebuilt = facets.get_snapshot()
+        self.assertEqual((rebuilt.size, rebuilt.free), (2, []))
+        self.assertEqual(sorted(rebuilt.query()["ids"]), [p.id for p in products[2:]])
+
+
+class LeaderboardTests(TestCase):
+    """Precomputed leaderboards, built on the first read when the job has not run yet."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="l@example.com", password="pass", name="L", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        cls.address = ShippingAddress.objects.create(
+            user=cls.user, full_name="L", phone="1", address="x", barangay="b", city="c", province="p",
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def sell(self, product, quantity, status=Order.STATUS_COMPLETED):
+        order = Order.objects.create(user=self.user, artisan=self.artisan, shipping_address=self.address, status=status)
+        OrderItem.objects.create(order=order, product=product, quantity=quantity, price=100)
+
+    def test_first_read_builds_the_empty_table(self):
+        first, second, third = make_products(3, self.artisan)
+        self.sell(first, 1)
+        self.sell(second, 3)
+        self.sell(third, 9, status=Order.STATUS_CANCELLED)
+
+        entries = get_entries([ProductLeaderboard.METRIC_SOLD])[ProductLeaderboard.METRIC_SOLD]
+
+        self.assertEqual(entries, [[second.id, 3], [first.id, 1]])
+        self.assertTrue(ProductLeaderboard.objects.filter(artisan=self.artisan).exists())
+
+    def test_built_once_even_without_sales(self):
+        make_products(1, self.artisan)
+        self.assertEqual(get_entries([ProductLeaderboard.METRIC_SOLD], artisan_id=self.artisan.id),
+                         {ProductLeaderboard.METRIC_SOLD: []})
+        boards = ProductLeaderboard.objects.count()
+        self.assertGreater(boards, 0)
+
+        get_entries([ProductLeaderboard.METRIC_SOLD], artisan_id=self.artisan.id)
+        self.assertEqual(ProductLeaderboard.objects.count(), boards)
+
+    def test_artisan_top_selling_ranks_by_orders(self):
+        first, second = make_products(2, self.artisan)
+        self.sell(second, 1)
+        self.sell(second, 1)
+        self.sell(first, 5)
+
+        data = self.client.get(f"/api/products/product/top-selling/{self.artisan.id}/").json()
+
+        self.assertEqual([p["id"] for p in data], [second.id, first.id])
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ProductListTests(TestCase):
+    """The full product list: cached by default, streamed on request."""
+
+    url = "/api/products/product/products/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="p@example.com", password="pass", name="P", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_full_list_is_served_from_the_cache(self):
+        products = make_products(3, self.artisan)
+        first = self.client.get(self.url, {"fields": "id,name"})
+        self.assertFalse(first.streaming)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, {"fields": "id,name"})
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual({p["id"] for p in second.json()}, {p.id for p in products})
+
+    def test_stream_is_opt_in_and_returns_the_same_list(self):
+        make_products(3, self.artisan)
+        listed = self.client.get(self.url).json()
+
+        streamed = self.client.get(self.url, {"stream": "true"})
+
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(json.loads(b"".join(streamed.streaming_content)), listed)
+
+    def test_if_none_match_answers_304_until_the_catalog_changes(self):
+        product = make_products(1, self.artisan)[0]
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = "Renamed"
+            product.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CatalogCacheTests(TestCase):
+    """What moves the catalog versions, and when responses are cached at all."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="c@example.com", password="pass", name="C", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        cls.address = ShippingAddress.objects.create(
+            user=cls.user, full_name="C", phone="1", address="x", barangay="b", city="c", province="p",
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_products(1, self.artisan)[0]
+
+    def catalog_version(self):
+        return get_versions([CATALOG])[0]
+
+    def order(self, status=Order.STATUS_AWAITING_PAYMENT):
+        order = Order.objects.create(user=self.user, artisan=self.artisan, shipping_address=self.address, status=status)
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, price=100)
+        return order
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_without_a_shared_cache_responses_are_not_cached(self):
+        response = self.client.get("/api/products/product/products/")
+        self.assertNotIn("ETag", response)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/products/product/products/")
+        self.assertGreater(len(queries), 0)
+
+    def test_orders_outside_sold_statuses_leave_the_catalog_cached(self):
+        version = self.catalog_version()
+        order = self.order()
+        order.status = Order.STATUS_PROCESSING
+        order.save()
+        order.status = Order.STATUS_CANCELLED
+        order.save()
+        self.assertEqual(self.catalog_version(), version)
+
+    def test_order_moving_into_or_out_of_sold_statuses_bumps_the_catalog(self):
+        order = self.order()
+        version = self.catalog_version()
+        order.status = Order.STATUS_DELIVERED
+        order.save()
+        self.assertGreater(self.catalog_version(), version)
+
+        version = self.catalog_version()
+        order.status = Order.STATUS_COMPLETED       # sold either way
+        order.save()
+        self.assertEqual(self.catalog_version(), version)
+
+        order.status = Order.STATUS_REFUND
+        order.save()
+        self.assertGreater(self.catalog_version(), version)
+
+    def test_items_of_a_sold_order_bump_the_catalog(self):
+        version = self.catalog_version()
+        self.order(status=Order.STATUS_COMPLETED)
+        self.assertGreater(self.catalog_version(), version)
+
+    def test_deleting_an_artisan_bumps_its_scope_and_the_catalog(self):
+        other = Artisan.objects.create(
+            user=CustomUser.objects.create_user(email="o@example.com", password="pass", name="O", role="seller"),
+            name="Other",
+        )
+        scope = artisan_scope(other.id)
+        before = get_versions([CATALOG, scope])
+        other.delete()
+        after = get_versions([CATALOG, scope])
+        self.assertTrue(all(new > old for new, old in zip(after, before)))
+
+    def test_cache_stats_are_for_admins_only(self):
+        url = "/api/products/product/cache-stats/"
+        self.assertIn(self.client.get(url).status_code, (401, 403))
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.user.role = "admin"
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ProductPageSectionTests(TestCase):
+    """Each section of the product page is rebuilt only by changes it shows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="r@example.com", password="pass", name="R", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_products(1, self.artisan)[0]
+        self.url = f"/api/products/product/products/{self.product.id}/page/"
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def rebuilt(self):
+        """ Sections the next page request builds instead of reading from the cache. """
+        before = get_counters()
+        page = self.client.get(self.url).json()
+        after = get_counters()
+        missed = {
+            endpoint.split(":")[1] for endpoint, counts in after.items()
+            if endpoint.startswith("product-page:") and counts["miss"] > before[endpoint]["miss"]
+        }
+        return missed - {"owner"}, page
+
+    def test_unchanged_page_is_served_from_the_cache(self):
+        self.assertEqual(self.rebuilt()[0], set())
+
+    def test_a_review_leaves_the_artisan_card_cached(self):
+        Rating.objects.create(user=self.user, product=self.product, score=5)
+
+        rebuilt, page = self.rebuilt()
+
+        self.assertEqual(rebuilt, {"detail", "rating_summary", "reviews", "similar"})
+        self.assertEqual(page["rating_summary"]["count"], 1)
+        self.assertEqual(page["reviews"]["count"], 1)
+
+    def test_a_review_of_another_product_rebuilds_only_catalog_sections(self):
+        other = make_products(1, self.artisan)[0]
+        self.rebuilt()
+        Rating.objects.create(user=self.user, product=other, score=5)
+
+        self.assertEqual(self.rebuilt()[0], {"detail", "similar"})
+
+    def test_editing_the_artisan_leaves_the_reviews_cached(self):
+        self.artisan.name = "Taal Weaving Co."
+        self.artisan.save()
+
+        rebuilt, page = self.rebuilt()
+
+        self.assertEqual(rebuilt, {"detail", "artisan"})
+        self.assertEqual(page["artisan"]["name"], "Taal Weaving Co.")
+
+
+class SimilarityIndexTests(SimpleTestCase):
+    """The top-K neighbour index, built in blocks of bounded size."""
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        dense = rng.random((30, 12)) * (rng.random((30, 12)) < 0.3)
+        self.matrix = sp.csr_matrix(dense / np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12))
+        self.product_ids = np.arange(100, 130)
+
+    def brute_force(self, k):
+        similarities = (self.matrix @ self.matrix.T).toarray()
+        np.fill_diagonal(similarities, -np.inf)
+        return [
+            [int(c) for c in np.argsort(-row, kind="stable")[:k] if row[c] > 0]
+            for row in similarities
+        ]
+
+    def test_blocks_of_any_size_find_the_exact_top_k(self):
+        expected = self.brute_force(5)
+        for block_bytes in (1, 30 * 4 * 7, recommender.BLOCK_BYTES):
+            index = recommender.build_similarity_index(self.matrix, self.product_ids, 5, block_bytes)
+            for row, neighbours in enumerate(expected):
+                found = index.neighbours[row]
+                self.assertEqual(sorted(found[found >= 0].tolist()), sorted(neighbours))
+                self.assertTrue(np.all(np.diff(index.scores[row]) <= 1e-6))
+
+    def test_similar_returns_product_ids_best_first(self):
+        index = recommender.build_similarity_index(self.matrix, self.product_ids, 5)
+        similar = index.similar(100, top_n=3)
+        self.assertEqual([pid for pid, _ in similar], [100 + c for c in self.brute_force(3)[0]])
+        self.assertEqual(index.similar(999), [])
+
+    def test_saved_arrays_load_back_as_shared_memory_maps(self):
+        index = recommender.build_similarity_index(self.matrix, self.product_ids, 5)
+        with tempfile.TemporaryDirectory() as artifacts, override_settings(ARTIFACT_DIR=artifacts):
+            version = recommender.save_similarity_index(index)
+            loaded = recommender.load_similarity_index()
+
+            self.assertEqual(loaded.version, version)
+            self.assertIsInstance(loaded.neighbours.base, np.memmap)
+            self.assertFalse(loaded.scores.flags.writeable)
+            for product_id in self.product_ids.tolist():
+                self.assertEqual(loaded.similar(product_id), index.similar(product_id))
+            self.assertEqual(loaded.similar(999), [])
+
+            # copy-on-write maps can be patched without touching the files
+            private = recommender.load_similarity_index(version, mmap_mode="c")
+            private.scores[0] = 0
+            self.assertTrue(np.array_equal(recommender.load_similarity_index(version).scores, index.scores))
+
+    def test_row_map_tracks_added_and_removed_products(self):
+        rows = recommender.RowMap(np.array([30, 10, -1, 20]))
+        self.assertEqual((rows[10], rows[20], rows[30]), (1, 3, 0))
+        self.assertNotIn(-1, rows)
+        rows.pop(20)
+        rows.update({40: 2})
+        self.assertNotIn(20, rows)
+        self.assertEqual(rows[40], 2)
+        self.assertEqual(sorted(rows.values().tolist()), [0, 1, 2])
+        self.assertEqual(len(rows), 3)
+
+    def test_top_k_of_a_score_matrix_keeps_positive_entries(self):
+        like = recommender.build_similarity_index(self.matrix, self.product_ids, 3)
+        scores = sp.csr_matrix(([0.5, 0.9, -1.0, 0.2], ([0, 0, 0, 1], [1, 2, 3, 0])), shape=(30, 30))
+        index = recommender.top_k_index(scores, like, 2)
+        self.assertEqual([pid for pid, _ in index.similar(100)], [102, 101])
+        (pid, score), = index.similar(101)
+        self.assertEqual(pid, 100)
+        self.assertAlmostEqual(score, 0.2, places=6)
+        self.assertEqual(index.similar(102), [])
+
+
+class RecommenderModelTests(TestCase):
+    """The saved TF-IDF model: patched by the job, only read by requests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="m@example.com", password="pass", name="M", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        skip_variant_jobs(self)
+        artifacts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, artifacts, ignore_errors=True)
+        settings_override = override_settings(ARTIFACT_DIR=artifacts)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        recommender._model = recommender._model_mtime = recommender._index = None
+        self.addCleanup(setattr, recommender, "_model", None)
+        self.addCleanup(setattr, recommender, "_index", None)
+
+    def product(self, name, description):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                name=name, description=description, stock_quantity=1, regular_price=100,
+                main_image="media/products/main/basket.png", artisan=self.artisan,
+            )
+
+    def test_requests_do_not_query_or_fit_without_a_saved_model(self):
+        basket = self.product("Abaca basket", "woven abaca basket")
+        with self.assertNumQueries(0):
+            self.assertEqual(recommender.similar_product_ids(basket.id), [])
+        self.assertIsNone(recommender._model)
+
+    def test_similar_products_are_read_from_the_index_alone(self):
+        basket = self.product("Abaca basket", "woven abaca basket")
+        twin = self.product("Woven basket", "abaca basket")
+        recommender.update_saved_model()
+
+        with mock.patch("products.recommender.load_tfidf_model") as load_tfidf_model:
+            self.assertEqual(recommender.similar_product_ids(basket.id), [twin.id])
+        load_tfidf_model.assert_not_called()
+        self.assertIsInstance(recommender._index.neighbours.base, np.memmap)
+
+    def test_job_patches_the_saved_model_with_changed_products(self):
+        basket = self.product("Abaca basket", "woven abaca basket")
+        self.product("Capiz lamp", "shell lamp")
+        self.assertEqual(recommender.update_saved_model(), "refit")
+        self.assertEqual(recommender.update_saved_model(), "unchanged")
+
+        # no new words, so no refit on a vocabulary this small
+        twin = self.product("Woven basket", "abaca basket")
+        self.assertEqual(recommender.update_saved_model(), "updated")
+
+        with self.assertNumQueries(0):
+            similar = recommender.similar_product_ids(basket.id)
+        self.assertEqual(similar[0], twin.id)
+        self.assertEqual(semantic.search("abaca")[0], 2)
+
+    def test_job_refits_when_the_feed_cannot_be_replayed(self):
+        self.product("Abaca basket", "woven abaca basket")
+        recommender.update_saved_model()
+
+        tote = self.product("Abaca tote", "woven abaca bag")
+        with mock.patch("products.product.cache.FEED_MAX_GAP", 0):     # too far behind to replay
+            self.assertEqual(recommender.update_saved_model(), "refit")
+        self.assertEqual(semantic.search("tote")[1][0][0], tote.id)
+
+    def test_scheduled_runs_reuse_the_saved_model(self):
+        basket = self.product("Abaca basket", "woven abaca basket")
+        generate_all_recommendations(workers=1)
+
+        twin = self.product("Woven basket", "abaca basket")
+        with mock.patch("products.recommender.build_model") as build_model:
+            generate_all_recommendations(workers=1)
+        build_model.assert_not_called()
+        self.assertEqual(recommender.similar_product_ids(basket.id), [twin.id])
+
+
+class PersonalizationTests(SimpleTestCase):
+    """Recommendations for a block of users from the top-K similarity index."""
+
+    def setUp(self):
+        # 10-11-12 are alike, 13-14 a pair, 15 like nothing
+        neighbours = np.array([[1, 2], [0, 2], [0, 1], [4, -1], [3, -1], [-1, -1]], dtype=np.int32)
+        scores = np.array([[0.9, 0.5], [0.9, 0.4], [0.5, 0.4], [0.8, 0], [0.8, 0], [0, 0]], dtype=np.float32)
+        self.index = recommender.SimilarityIndex([10, 11, 12, 13, 14, 15], neighbours, scores)
+
+    def recommend(self, interactions, top_n, **options):
+        seen = sp.csr_matrix(np.array(interactions, dtype=np.float32))
+        blocks = recommender.personalize(self.index, seen, top_n, np.random.default_rng(0), **options)
+        return [ids for _, recommendations in blocks for ids in recommendations]
+
+    def test_seen_products_are_never_recommended(self):
+        self.assertEqual(self.recommend([[2, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0]], top_n=1), [[12], [14]])
+
+    def test_candidates_are_cut_to_the_top_n_best_first(self):
+        viewed_10 = [1, 0, 0, 0, 0, 0]
+        self.assertEqual(self.recommend([viewed_10], top_n=1), [[11]])
+        self.assertEqual(self.recommend([viewed_10], top_n=2), [[11, 12]])
+        self.assertEqual(self.recommend([viewed_10] * 3, top_n=2, block_bytes=1), [[11, 12]] * 3)
+
+    def test_too_few_candidates_are_topped_up_with_random_unseen_products(self):
+        filled, cold = self.recommend([[0, 0, 0, 1, 0, 0], [0] * 6], top_n=4)
+
+        self.assertEqual(filled[0], 14)
+        self.assertEqual(len(set(filled)), 4)
+        self.assertNotIn(13, filled)
+        self.assertEqual(len(set(cold)), 4)
+        self.assertLessEqual(set(filled + cold), {10, 11, 12, 13, 14, 15})
+
+
+class SaveRecommendationsTests(TestCase):
+    """Recommendations written with one upsert per batch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create_user(email=f"r{i}@example.com", password="pass", name=f"R{i}", role="seller")
+            for i in range(3)
+        ]
+
+    def test_existing_rows_are_overwritten_and_missing_ones_created(self):
+        UserRecommendations.objects.create(user=self.users[0], product_ids=[1, 2])
+
+        with self.assertNumQueries(2):
+            recommender.save_recommendations([u.id for u in self.users], [[3, 4], [5], []], batch_size=2)
+
+        saved = dict(UserRecommendations.objects.values_list("user_id", "product_ids"))
+        self.assertEqual(saved, {self.users[0].id: [3, 4], self.users[1].id: [5], self.users[2].id: []})
+
+
+class InlineExecutor:
+    """ Stands in for the process pool: runs each shard when it is submitted. """
+
+    def __init__(self, max_workers=None, initializer=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+def chain_index(product_ids):
+    """ Each product's neighbours are the next two, similarity 0.9 and 0.5. """
+    n = len(product_ids)
+    neighbours = np.array([[(i + 1) % n, (i + 2) % n] for i in range(n)], dtype=np.int32)
+    scores = np.tile(np.array([0.9, 0.5], dtype=np.float32), (n, 1))
+    return recommender.SimilarityIndex(product_ids, neighbours, scores)
+
+
+class ShardedRecommendationTests(TestCase):
+    """Recommendations generated by ID range in worker processes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="g@example.com", password="pass", name="G", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        cls.products = make_products(6, cls.artisan)
+        cls.users = [
+            CustomUser.objects.create_user(email=f"u{i}@example.com", password="pass", name=f"U{i}", role="seller")
+            for i in range(5)
+        ]
+        for user, product in zip(cls.users + [cls.user], cls.products):
+            UserActivity.objects.create(user=user, product=product, action=UserActivity.ACTION_VIEW)
+
+    def setUp(self):
+        artifacts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, artifacts, ignore_errors=True)
+        settings_override = override_settings(ARTIFACT_DIR=artifacts)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.index = chain_index([p.id for p in self.products])
+        self.user_ids = list(CustomUser.objects.order_by("id").values_list("id", flat=True))
+
+    def saved(self):
+        return dict(UserRecommendations.objects.values_list("user_id", "product_ids"))
+
+    def test_shards_match_a_single_process_run(self):
+        recommender.generate_recommendations(self.index, top_n=2)
+        expected = self.saved()
+        UserRecommendations.objects.all().delete()
+
+        with mock.patch("products.recommender.ProcessPoolExecutor", InlineExecutor):
+            reports = recommender.generate_recommendations(self.index, top_n=2, workers=2, shard_size=2)
+
+        self.assertEqual([r["users"] for r in reports], [2, 2, 2])
+        self.assertEqual([r["first_user"] for r in reports], self.user_ids[::2])
+        self.assertEqual(self.saved(), expected)
+        self.assertEqual(expected[self.users[0].id], [self.products[1].id, self.products[2].id])
+
+    def test_a_failed_shard_does_not_stop_the_others(self):
+        generate_shard = recommender._generate_shard
+
+        def fail_second(arrays, version, shard, *args):
+            if shard == 1:
+                raise RuntimeError("boom")
+            return generate_shard(arrays, version, shard, *args)
+
+        with mock.patch("products.recommender.ProcessPoolExecutor", InlineExecutor), \
+                mock.patch("products.recommender._generate_shard", fail_second):
+            reports = recommender.generate_recommendations(self.index, top_n=2, workers=2, shard_size=2)
+
+        self.assertEqual([r["shard"] for r in reports], [0, 2])
+        self.assertEqual(sorted(self.saved()), self.user_ids[:2] + self.user_ids[4:])
+
+
+def index_of(neighbours):
+    """ A SimilarityIndex from {product id: [neighbour id, ...]}, similarity falling with rank. """
+    product_ids = sorted(neighbours)
+    rows = {pid: row for row, pid in enumerate(product_ids)}
+    k = max(len(n) for n in neighbours.values())
+    top = np.full((len(product_ids), k), -1, dtype=np.int32)
+    scores = np.zeros((len(product_ids), k), dtype=np.float32)
+    for pid, row_neighbours in neighbours.items():
+        for i, neighbour in enumerate(row_neighbours):
+            top[rows[pid], i] = rows[neighbour]
+            scores[rows[pid], i] = 0.9 - 0.1 * i
+    return recommender.SimilarityIndex(product_ids, top, scores)
+
+
+class DirtyUserTests(TestCase):
+    """Only users whose recommendations can change are regenerated."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="d@example.com", password="pass", name="D", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        cls.products = make_products(5, cls.artisan)
+        cls.users = [
+            CustomUser.objects.create_user(email=f"d{i}@example.com", password="pass", name=f"D{i}", role="seller")
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        artifacts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, artifacts, ignore_errors=True)
+        settings_override = override_settings(ARTIFACT_DIR=artifacts)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def view(self, user, product):
+        UserActivity.objects.create(user=user, product=product, action=UserActivity.ACTION_VIEW)
+
+    def test_activity_changed_neighbours_deleted_products_and_new_users(self):
+        p = [product.id for product in self.products]
+        quiet, reviewer, shown_deleted, active, newcomer = self.users
+        self.view(quiet, self.products[0])
+        self.view(reviewer, self.products[2])
+        for user, shown in ((self.user, [p[0]]), (quiet, [p[1]]), (reviewer, [p[3]]), (shown_deleted, [p[4]]),
+                            (active, [p[0]])):
+            UserRecommendations.objects.create(user=user, product_ids=shown)
+        activity_at, activity_id = recommender.activity_mark()
+        self.view(active, self.products[1])
+
+        old = index_of({p[0]: [p[1]], p[1]: [p[0]], p[2]: [p[3]], p[3]: [p[2]], p[4]: [p[0]]})
+        new = index_of({p[0]: [p[1]], p[1]: [p[0]], p[2]: [p[1]], p[3]: [p[2]]})
+
+        self.assertEqual(
+            recommender.dirty_users(activity_at, activity_id, old, new),
+            {reviewer.id, shown_deleted.id, active.id, newcomer.id},
+        )
+
+    def test_reordered_neighbours_are_not_a_change(self):
+        p = [product.id for product in self.products]
+        old = index_of({p[0]: [p[1], p[2]], p[1]: [p[0]], p[2]: [p[0]]})
+        new = index_of({p[0]: [p[2], p[1]], p[1]: [p[0]], p[2]: [p[0], p[1]]})
+        self.assertEqual(recommender.changed_products(old, new), ({p[2]}, set()))
+
+    def test_runs_after_a_sweep_only_regenerate_users_with_new_activity(self):
+        first = generate_all_recommendations(workers=1)
+        self.assertEqual(sum(shard["users"] for shard in first), CustomUser.objects.count())
+
+        self.assertEqual(generate_all_recommendations(workers=1)[0]["users"], 0)
+
+        self.view(self.users[0], self.products[0])
+        self.assertEqual(generate_all_recommendations(workers=1)[0]["users"], 1)
+        self.assertEqual(RecommendationRun.objects.filter(full_sweep=True).count(), 1)
+
+
+class CollaborativeIndexTests(TestCase):
+    """Item-item similarity from orders, carts, likes and views."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="f@example.com", password="pass", name="F", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        cls.address = ShippingAddress.objects.create(
+            user=cls.user, full_name="F", phone="1", address="x", barangay="b", city="c", province="p",
+        )
+        cls.products = make_products(5, cls.artisan)
+        cls.buyers = [
+            CustomUser.objects.create_user(email=f"f{i}@example.com", password="pass", name=f"F{i}", role="seller")
+            for i in range(4)
+        ]
+        bag, mat, lamp, tray, _ = cls.products
+        for buyer in cls.buyers[:2]:
+            cls.order(buyer, [bag, mat])
+        cls.order(cls.buyers[3], [bag, tray], Order.STATUS_CANCELLED)
+        ProductLike.objects.create(user=cls.buyers[2], product=lamp)
+        Cart.objects.create(user=cls.buyers[2], product=tray)
+
+    @classmethod
+    def order(cls, user, products, status=Order.STATUS_COMPLETED):
+        order = Order.objects.create(user=user, artisan=cls.artisan, shipping_address=cls.address, status=status)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=100)
+
+    def setUp(self):
+        self.content = chain_index([p.id for p in self.products])
+
+    def ids(self, *positions):
+        return [self.products[i].id for i in positions]
+
+    def neighbours(self, index, position):
+        return [pid for pid, _ in index.similar(self.products[position].id)]
+
+    def test_products_shared_by_the_same_users_are_neighbours(self):
+        index, stats = collaborative.build_collaborative_index(self.content, k=3)
+        self.assertEqual(self.neighbours(index, 0), self.ids(1))
+        self.assertEqual(self.neighbours(index, 2), self.ids(3))
+        self.assertEqual(self.neighbours(index, 4), [])
+        self.assertEqual((stats["users"], stats["products_with_interactions"], stats["interactions"]), (3, 4, 6))
+
+    def test_purchases_outweigh_carts_and_cancelled_orders_do_not_count(self):
+        matrix = collaborative.interaction_matrix(self.content.rows, len(self.content))
+        bag, tray = self.content.rows[self.products[0].id], self.content.rows[self.products[3].id]
+        self.assertAlmostEqual(matrix[self.buyers[0].id, bag], np.log1p(collaborative.SIGNAL_WEIGHTS["purchase"]))
+        self.assertAlmostEqual(matrix[self.buyers[2].id, tray], np.log1p(collaborative.SIGNAL_WEIGHTS["cart"]))
+        self.assertNotIn(self.buyers[3].id, matrix.nonzero()[0])
+
+    def test_pages_of_any_size_read_the_same_matrix(self):
+        whole = collaborative.interaction_matrix(self.content.rows, len(self.content))
+        paged = collaborative.interaction_matrix(self.content.rows, len(self.content), chunk=1)
+        self.assertEqual((whole != paged).nnz, 0)
+
+    def test_blend_keeps_content_neighbours_of_products_nobody_bought(self):
+        with override_settings(RECOMMENDATION_CONTENT_WEIGHT=0.5, RECOMMENDATION_COLLABORATIVE_WEIGHT=0.5):
+            blended, stats = collaborative.blended_index(self.content)
+        self.assertIsNotNone(stats)
+        self.assertEqual(self.neighbours(blended, 4), self.ids(0, 1))
+        self.assertEqual(self.neighbours(blended, 0)[0], self.products[1].id)
+
+        content_only, stats = collaborative.blended_index(self.content, 1.0, 0.0)
+        self.assertIsNone(stats)
+        self.assertEqual(content_only.neighbours.tolist(), self.content.neighbours.tolist())
+
+
+class RecommenderEvaluationTests(TestCase):
+    """Offline scores of each strategy on interactions held out by time."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="e@example.com", password="pass", name="E", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        cls.bag, cls.tote, cls.lamp, cls.sconce = [
+            Product.objects.create(
+                name=name, description=description, stock_quantity=1, regular_price=100,
+                main_image="media/products/main/item.png", artisan=cls.artisan,
+            )
+            for name, description in (
+                ("Abaca bag", "woven abaca bag"),
+                ("Abaca tote", "woven abaca tote bag"),
+                ("Capiz lamp", "capiz shell lamp"),
+                ("Capiz sconce", "capiz shell wall lamp"),
+            )
+        ]
+        cls.users = [
+            CustomUser.objects.create_user(email=f"e{i}@example.com", password="pass", name=f"E{i}", role="seller")
+            for i in range(5)
+        ]
+        first, second, third, fourth, fifth = cls.users
+        start = timezone.now() - timedelta(days=10)
+        history = [
+            (first, cls.bag), (second, cls.lamp), (third, cls.bag), (third, cls.tote), (fourth, cls.tote),
+            (fifth, cls.bag),
+            # held out: the latest two
+            (first, cls.tote), (second, cls.sconce),
+        ]
+        for day, (user, product) in enumerate(history):
+            UserActivity.objects.create(
+                user=user, product=product, action=UserActivity.ACTION_VIEW, timestamp=start + timedelta(days=day),
+            )
+
+    def scores(self, output):
+        """ {strategy: (precision, recall, coverage)} from the command's table. """
+        rows = {}
+        for line in output.splitlines():
+            name, *values = line.split()
+            if name in ("popularity", "content", "collaborative", "blended"):
+                rows[name] = (float(values[0]), float(values[1]), float(values[3]))
+        return rows
+
+    def test_held_out_views_score_each_strategy(self):
+        out = io.StringIO()
+        call_command("evaluate_recommender", k=1, test_fraction=0.22, stdout=out)
+
+        self.assertIn("train 6 / test 2 interactions, 2 users", out.getvalue())
+        scores = self.scores(out.getvalue())
+        # the text neighbour of what each tester saw is what they went on to view
+        self.assertEqual(scores["content"], (1.0, 1.0, 0.5))
+        # the bag, most viewed, is wrong for the lamp viewer
+        self.assertEqual(scores["popularity"], (0.5, 0.5, 0.5))
+
+    def test_products_seen_before_the_cutoff_are_not_held_out(self):
+        product_ids = [p.id for p in (self.bag, self.tote, self.lamp, self.sconce)]
+        UserActivity.objects.create(user=self.users[0], product=self.bag, action=UserActivity.ACTION_VIEW)
+        history = evaluation.load_history(product_ids)
+
+        split, reports = evaluation.evaluate(history, lambda: chain_index(product_ids), k=1, test_fraction=0.3)
+        self.assertEqual((split["train"], split["test"], split["users"]), (6, 3, 2))
+        content = next(report for report in reports if report["strategy"] == "content")
+        self.assertEqual(content["recall"], 1.0)     # the bag viewed again isn't something to find
+
+
+class InteractionScoreTests(TestCase):
+    """Weighted, time-decayed interactions summed in the database."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="t@example.com", password="pass", name="T", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        cls.products = make_products(3, cls.artisan)
+        cls.now = timezone.now()
+
+    def act(self, action, product, days_ago=0):
+        UserActivity.objects.create(
+            user=self.user, product=product, action=action, timestamp=self.now - timedelta(days=days_ago),
+        )
+
+    def scores(self, **kwargs):
+        rows = recommender.interaction_scores(UserActivity.objects.all(), now=self.now, **kwargs)
+        return {(user_id, product_id): score for user_id, product_id, score in rows}
+
+    def test_each_half_life_halves_an_event(self):
+        bag, mat, _ = self.products
+        self.act(UserActivity.ACTION_VIEW, bag)
+        self.act(UserActivity.ACTION_PURCHASE, bag, days_ago=30)
+        self.act(UserActivity.ACTION_LIKE, mat, days_ago=60)
+
+        scores = self.scores()
+        self.assertAlmostEqual(scores[(self.user.id, bag.id)], 1.0 + 4.0 * 0.5, places=4)
+        self.assertAlmostEqual(scores[(self.user.id, mat.id)], 2.0 * 0.25, places=4)
+        self.assertAlmostEqual(self.scores(half_life_days=60)[(self.user.id, mat.id)], 2.0 * 0.5, places=4)
+
+    def test_one_row_per_user_and_product(self):
+        bag, mat, _ = self.products
+        for days_ago in range(5):
+            self.act(UserActivity.ACTION_VIEW, bag, days_ago)
+        self.act(UserActivity.ACTION_CART, mat)
+        UserActivity.objects.create(user=self.user, action=UserActivity.ACTION_VIEW)
+
+        with self.assertNumQueries(1):
+            scores = self.scores()
+        self.assertEqual(set(scores), {(self.user.id, bag.id), (self.user.id, mat.id)})
+        self.assertLess(scores[(self.user.id, bag.id)], 5.0)
+        self.assertGreater(scores[(self.user.id, bag.id)], 4.5)
+
+    def test_recent_interactions_rank_first(self):
+        bag, mat, lamp = self.products
+        index = chain_index([p.id for p in self.products])
+        self.act(UserActivity.ACTION_PURCHASE, bag, days_ago=365)
+        self.act(UserActivity.ACTION_VIEW, mat)
+
+        with mock.patch("products.recommender.timezone.now", return_value=self.now):
+            interactions = recommender.load_interactions(index, [self.user.id])
+        self.assertGreater(interactions[0, index.rows[mat.id]], interactions[0, index.rows[bag.id]])
+        (_, recommended), = recommender.personalize(index, interactions, top_n=1)
+        self.assertEqual(recommended, [[lamp.id]])
+
+
+class RecentViewsTests(TestCase):
+    """Stored recommendations re-ranked by the user's latest views."""
+
+    def setUp(self):
+        cache.clear()
+        artifacts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, artifacts, ignore_errors=True)
+        settings_override = override_settings(ARTIFACT_DIR=artifacts)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        recent_views._index = None
+        self.addCleanup(setattr, recent_views, "_index", None)
+
+    def save_blended(self, neighbours):
+        """ neighbours: {product id: [(neighbour id, similarity), ...]} """
+        product_ids = sorted(neighbours)
+        rows = {pid: row for row, pid in enumerate(product_ids)}
+        k = max(len(n) for n in neighbours.values())
+        top = np.full((len(product_ids), k), -1, dtype=np.int32)
+        scores = np.zeros((len(product_ids), k), dtype=np.float32)
+        for pid, row_neighbours in neighbours.items():
+            for i, (neighbour, score) in enumerate(row_neighbours):
+                top[rows[pid], i] = rows[neighbour]
+                scores[rows[pid], i] = score
+        recommender.save_similarity_index(recommender.SimilarityIndex(product_ids, top, scores), BLENDED_ARRAYS)
+
+    def test_views_are_kept_newest_first_without_repeats(self):
+        for pid in [1, 2, 1, *range(10, 20)]:
+            recent_views.record_view(7, pid)
+        views = recent_views.recent_views(7)
+        self.assertEqual(views[:3], [19, 18, 17])
+        self.assertEqual(len(views), recent_views.RECENT_VIEWS)
+        self.assertEqual(len(set(views)), len(views))
+
+    def test_rerank_boosts_neighbours_in_the_blended_index(self):
+        self.save_blended({1: [(3, 0.9)], 2: [], 3: [(1, 0.9)], 4: []})
+        self.assertEqual(recent_views.rerank([2, 4, 3], [1]), [3, 2, 4])
+
+    def test_rerank_follows_the_index_the_job_saves_next(self):
+        self.save_blended({1: [(3, 0.9)], 2: [], 3: [(1, 0.9)], 4: []})
+        recent_views.rerank([2, 4, 3], [1])
+        self.save_blended({1: [(4, 0.9)], 2: [], 3: [], 4: [(1, 0.9)]})
+        self.assertEqual(recent_views.rerank([2, 4, 3], [1]), [4, 2, 3])
+
+    def test_rerank_keeps_the_order_without_an_index(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(recent_views.rerank([2, 4, 3], [1]), [2, 4, 3])
@@ -9,5 +9,6 @@ urlpatterns = [
     path('orders/', include('products.orders.urls')),
     path('dashboard/', include('products.dashboard.urls')),
     path('admin/', include('products.admin.urls')),
+    path('bulk/', include('products.bulk.urls')),
 
 ]
@@ -0,0 +1,280 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+import numpy as np
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+
+from products.models import Category, Material, Product
+from products.product.cache import feed_position, read_changes, record_change
+from users.models import Artisan
+from .tokenizer import WORD_RE, fold
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# AUTOCOMPLETE OVER NAMES
+# ---------------------------------------------------------
+# Product, artisan, category and material names, each with a popularity
+# weight. The prefix structure is a trie flattened into one sorted list of
+# (key, kind, id): all keys under a prefix are a contiguous slice found with
+# two bisects, and its most popular names come from argpartition over the
+# weight column kept beside the keys. Every name is stored under each of
+# its word starts, so "bag" completes "Abaca Bag" too. Prefixes with very
+# many keys (one or two letters) keep their top completions memoized until
+# a key under them changes.
+#
+# Answering never touches the database. Saves are appended to the
+# "autocomplete" change feed with the new name and weight, so every worker
+# patches its copy from the cache alone; if the feed has a gap the worker
+# keeps answering from what it has while a new copy is built in the
+# background.
+
+PRODUCT = "product"
+ARTISAN = "artisan"
+CATEGORY = "category"
+MATERIAL = "material"
+
+FEED = "autocomplete"
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+SCAN_LIMIT = 2000            # larger slices are memoized
+MAX_WORD_STARTS = 6
+
+
+def normalize(text):
+    return " ".join(WORD_RE.findall(fold(text or "")))
+
+
+def _keys(text):
+    words = WORD_RE.findall(fold(text))
+    return list(dict.fromkeys(" ".join(words[i:]) for i in range(min(len(words), MAX_WORD_STARTS))))
+
+
+class Completions:
+    def __init__(self):
+        self.entries = {}       # (kind, id) -> (text, weight)
+        self.keys = []          # sorted [(key, kind, id)]
+        self.weights = np.zeros(0)  # weight of each key, aligned with self.keys
+        self.memo = {}          # prefix -> best entries under it
+        self.position = 0       # last change-feed entry applied
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self, items):
+        """ Bulk build from (kind, id, text, weight); much faster than put(). """
+        keys = []
+        for kind, pk, text, weight in items:
+            if text:
+                self.entries[(kind, pk)] = (text, weight)
+                keys.extend((key, kind, pk) for key in _keys(text))
+        keys.sort()
+        self.keys = keys
+        self.weights = np.fromiter(
+            (self.entries[(kind, pk)][1] for _, kind, pk in keys), dtype=np.float64, count=len(keys)
+        )
+        self.memo = {}
+
+        # the first keystroke has the widest slices: memoize those now
+        for first in {key[0] for key, _, _ in keys}:
+            self.complete(first, MAX_LIMIT)
+
+    def _forget(self, key):
+        for end in range(1, len(key) + 1):
+            self.memo.pop(key[:end], None)
+
+    def remove(self, kind, pk):
+        entry = self.entries.pop((kind, pk), None)
+        if entry is None:
+            return
+        for key in _keys(entry[0]):
+            at = bisect_left(self.keys, (key, kind, pk))
+            if at < len(self.keys) and self.keys[at] == (key, kind, pk):
+                del self.keys[at]
+                self.weights = np.delete(self.weights, at)
+            self._forget(key)
+
+    def put(self, kind, pk, text, weight):
+        """ Add or replace one name; a falsy text removes it. """
+        self.remove(kind, pk)
+        if not text:
+            return
+        self.entries[(kind, pk)] = (text, weight)
+        for key in _keys(text):
+            at = bisect_left(self.keys, (key, kind, pk))
+            self.keys.insert(at, (key, kind, pk))
+            self.weights = np.insert(self.weights, at, weight)
+            self._forget(key)
+
+    def _best(self, lo, hi, count):
+        weights = self.weights[lo:hi]
+        if len(weights) > count:
+            top = np.argpartition(-weights, count - 1)[:count]
+            top = top[np.argsort(-weights[top], kind="stable")]
+        else:
+            top = np.argsort(-weights, kind="stable")
+
+        # a name can sit under one prefix through several of its words
+        best = {}
+        for i in top:
+            _, kind, pk = self.keys[lo + i]
+            best[(kind, pk)] = True
+        return list(best)
+
+    def complete(self, prefix, limit=DEFAULT_LIMIT):
+        """ [(kind, id, text), ...]: the most popular names under `prefix`. """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        lo = bisect_left(self.keys, (prefix,))
+        hi = bisect_left(self.keys, (prefix + "\uffff",))
+        if hi - lo > SCAN_LIMIT:
+            best = self.memo.get(prefix)
+            if best is None:
+                best = self.memo[prefix] = self._best(lo, hi, MAX_LIMIT * 2)
+        else:
+            best = self._best(lo, hi, limit * 2)
+
+        # the same name can come from several products: show it once
+        results, seen = [], set()
+        for kind, pk in best:
+            text = self.entries[(kind, pk)][0]
+            if (kind, text.lower()) in seen:
+                continue
+            seen.add((kind, text.lower()))
+            results.append((kind, pk, text))
+            if len(results) == limit:
+                break
+        return results
+
+
+# ---------------------------------------------------------
+# NAMES AND WEIGHTS FROM THE DATABASE
+# ---------------------------------------------------------
+def _product_weight(sold, orders, likes, ratings):
+    return 1 + 2 * (sold or 0) + (orders or 0) + (likes or 0) + (ratings or 0)
+
+
+def product_items(product_ids=None):
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    rows = products.values_list(
+        "id", "name", "stats__sold_count", "stats__order_count", "stats__like_count", "stats__rating_count"
+    )
+    for pk, name, *counts in rows.iterator(chunk_size=5000):
+        yield PRODUCT, pk, name, _product_weight(*counts)
+
+
+def artisan_items(artisan_ids=None):
+    artisans = Artisan.objects.all()
+    if artisan_ids is not None:
+        artisans = artisans.filter(id__in=artisan_ids)
+    rows = artisans.annotate(
+        weight=1 + 2 * Count("followers", distinct=True) + Count("products", distinct=True)
+    ).values_list("id", "name", "weight")
+    for pk, name, weight in rows.iterator(chunk_size=5000):
+        yield ARTISAN, pk, name, weight
+
+
+def _taxonomy_items(kind, model, ids=None):
+    objects = model.objects.all()
+    if ids is not None:
+        objects = objects.filter(id__in=ids)
+    rows = objects.annotate(weight=1 + Count("products")).values_list("id", "name", "weight")
+    for pk, name, weight in rows:
+        yield kind, pk, name, weight
+
+
+def category_items(ids=None):
+    return _taxonomy_items(CATEGORY, Category, ids)
+
+
+def material_items(ids=None):
+    return _taxonomy_items(MATERIAL, Material, ids)
+
+
+ITEMS = {PRODUCT: product_items, ARTISAN: artisan_items, CATEGORY: category_items, MATERIAL: material_items}
+
+
+def build_completions():
+    started = time.monotonic()
+    completions = Completions()
+    completions.position = feed_position(FEED)
+    completions.load(item for items in ITEMS.values() for item in items())
+    logger.info(
+        "Built autocomplete: %s names, %s keys in %.0f ms",
+        len(completions), len(completions.keys), (time.monotonic() - started) * 1000,
+    )
+    return completions
+
+
+# ---------------------------------------------------------
+# THIS WORKER'S COPY
+# ---------------------------------------------------------
+_completions = None
+_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+
+def _rebuild_in_background():
+    def run():
+        global _completions
+        close_old_connections()
+        try:
+            fresh = build_completions()
+            with _lock:
+                _completions = fresh
+        except Exception:
+            logger.exception("Could not rebuild autocomplete")
+        finally:
+            _rebuilding.clear()
+            close_old_connections()
+
+    if not _rebuilding.is_set():
+        _rebuilding.set()
+        threading.Thread(target=run, name="autocomplete-rebuild", daemon=True).start()
+
+
+def complete(prefix, limit=DEFAULT_LIMIT):
+    """ Completions for `prefix`, patched from the change feed first. """
+    with _lock:
+        completions = _completions
+        if completions is None:
+            _rebuild_in_background()
+            return []
+
+        position, changes = read_changes(FEED, completions.position)
+        if changes is None:
+            _rebuild_in_background()
+        elif changes:
+            for entry in changes:
+                for kind, pk, text, weight in entry:
+                    completions.put(kind, pk, text, weight)
+            completions.position = position
+        return completions.complete(prefix, limit)
+
+
+def warm_completions():
+    """ Build at worker start; never fatal. """
+    global _completions
+    try:
+        _completions = build_completions()
+    except Exception:
+        logger.exception("Could not build autocomplete at startup")
+
+
+def refresh(kind, ids):
+    """ Send the current names / weights of `ids` to every worker once the transaction commits. """
+    ids = list(dict.fromkeys(ids))
+
+    def publish():
+        found = {item[1]: item for item in ITEMS[kind](ids)}
+        record_change(FEED, [found.get(pk, (kind, pk, None, 0)) for pk in ids])
+
+    if ids:
+        transaction.on_commit(publish)
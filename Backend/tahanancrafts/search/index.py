@@ -0,0 +1,391 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.db import transaction
+
+from products.artifacts import load_artifact, save_artifact
+from products.models import Product
+from products.product.cache import feed_position, read_changes, record_change
+from users.models import Artisan
+from .tokenizer import MIN_LENGTH, STOPWORDS, WORD_RE, fold, normalize_term, tokenize
+from .trigrams import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# INVERTED INDEX WITH BM25 RANKING
+# ---------------------------------------------------------
+# One document per product and per artisan, keyed ("product", id) /
+# ("artisan", id). Fields are weighted by adding `weight` to a term's
+# frequency for every occurrence, so a word in the name counts more than
+# the same word in the description. A query only touches the postings of
+# its own terms, scored as NumPy arrays, and the page is picked with
+# argpartition instead of sorting every match.
+#
+# Every worker keeps its own index. Saves are appended to the "search"
+# change feed on commit; before answering, a worker re-reads the documents
+# changed since the last entry it applied. The index can also be built
+# offline (rebuild_search_index) and is then loaded from ARTIFACT_DIR at
+# worker start instead of from the database.
+
+PRODUCT = "product"
+ARTISAN = "artisan"
+KINDS = (PRODUCT, ARTISAN)
+
+FIELD_WEIGHTS = {
+    PRODUCT: {
+        "name": 3.0,
+        "categories": 2.0,
+        "materials": 2.0,
+        "brand": 1.5,
+        "location": 1.0,
+        "description": 1.0,
+        "long_description": 0.5,
+    },
+    ARTISAN: {
+        "name": 3.0,
+        "location": 1.5,
+        "short_description": 1.0,
+        "about_shop": 0.5,
+    },
+}
+
+# words of these fields feed the trigram index behind fuzzy search
+FUZZY_FIELDS = {
+    PRODUCT: ("name", "categories", "materials", "location"),
+    ARTISAN: ("name", "location"),
+}
+
+K1 = 1.2
+B = 0.75
+
+FEED = "search"
+ARTIFACT_NAME = "search_index.pickle"
+ARTIFACT_FORMAT = 2
+ID_BATCH = 1000
+INITIAL_CAPACITY = 1024
+
+
+class InvertedIndex:
+    """
+    Documents live in rows of NumPy arrays (length, kind); postings map
+    term -> {row: weighted term frequency} and are compiled to arrays the
+    first time a query needs them, so scoring a term is a few vectorized
+    operations however many documents contain it.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.postings = defaultdict(dict)   # term -> {row: weighted term frequency}
+        self.doc_terms = {}                 # row -> {term: weighted term frequency}
+        self.rows = {}                      # doc -> row
+        self.docs = [None] * capacity       # row -> doc
+        self.free_rows = []
+        self.lengths = np.zeros(capacity, dtype=np.float32)
+        self.kinds = np.full(capacity, -1, dtype=np.int8)
+        self.total_length = 0.0
+        self.position = 0                   # last change-feed entry applied
+        self._compiled = {}                 # term -> (rows, frequencies)
+        self.fuzzy_words = {}               # row -> words added to the vocabulary
+        self.vocabulary = TrigramIndex()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _new_row(self):
+        if self.free_rows:
+            return self.free_rows.pop()
+        row = len(self.rows)
+        if row == len(self.docs):
+            grow = len(self.docs)
+            self.docs.extend([None] * grow)
+            self.lengths = np.concatenate([self.lengths, np.zeros(grow, dtype=np.float32)])
+            self.kinds = np.concatenate([self.kinds, np.full(grow, -1, dtype=np.int8)])
+        return row
+
+    def add(self, doc, fields):
+        self.remove(doc)
+
+        weights = FIELD_WEIGHTS[doc[0]]
+        fuzzy_fields = FUZZY_FIELDS[doc[0]]
+        frequencies = Counter()
+        fuzzy_words = set()
+        for field, text in fields.items():
+            terms = tokenize(text)
+            for term in terms:
+                frequencies[term] += weights[field]
+            if field in fuzzy_fields:
+                fuzzy_words.update(terms)
+        if not frequencies:
+            return
+
+        row = self._new_row()
+        length = sum(frequencies.values())
+        self.rows[doc] = row
+        self.docs[row] = doc
+        self.lengths[row] = length
+        self.kinds[row] = KINDS.index(doc[0])
+        self.total_length += length
+
+        self.doc_terms[row] = dict(frequencies)
+        for term, frequency in frequencies.items():
+            self.postings[term][row] = frequency
+            self._compiled.pop(term, None)
+
+        self.fuzzy_words[row] = tuple(fuzzy_words)
+        for word in fuzzy_words:
+            self.vocabulary.add(word)
+
+    def remove(self, doc):
+        row = self.rows.pop(doc, None)
+        if row is None:
+            return
+
+        self.total_length -= float(self.lengths[row])
+        self.docs[row] = None
+        self.lengths[row] = 0
+        self.kinds[row] = -1
+        self.free_rows.append(row)
+
+        for term in self.doc_terms.pop(row):
+            posting = self.postings[term]
+            del posting[row]
+            if not posting:
+                del self.postings[term]
+            self._compiled.pop(term, None)
+
+        for word in self.fuzzy_words.pop(row):
+            self.vocabulary.discard(word)
+
+    def _posting_arrays(self, term):
+        compiled = self._compiled.get(term)
+        if compiled is None:
+            posting = self.postings[term]
+            compiled = (
+                np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                np.fromiter(posting.values(), dtype=np.float32, count=len(posting)),
+            )
+            self._compiled[term] = compiled
+        return compiled
+
+    def query_terms(self, query, fuzzy=False):
+        """
+        {term: factor} to score. With `fuzzy`, a term the index doesn't know
+        is replaced by the closest vocabulary words, scaled by similarity.
+        """
+        terms = {}
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                terms[term] = 1.0
+            elif fuzzy:
+                for word, similarity in self.vocabulary.similar(term):
+                    terms[word] = max(terms.get(word, 0.0), similarity)
+        return terms
+
+    def suggest(self, query):
+        """ The query with unknown words replaced by their closest match, or None. """
+        corrected, changed = [], False
+        for word in WORD_RE.findall(fold(query)):
+            term = normalize_term(word)
+            if len(word) < MIN_LENGTH or word in STOPWORDS or term in self.postings:
+                corrected.append(word)
+                continue
+
+            best = self.vocabulary.similar(term, limit=1)
+            if best:
+                corrected.append(best[0][0])
+                changed = True
+            else:
+                corrected.append(word)
+        return " ".join(corrected) if changed else None
+
+    def search(self, query, kind=None, offset=0, limit=20, fuzzy=False):
+        """ (number of matches, [(doc, score), ...] for the page), best first. """
+        total_docs = len(self.rows)
+        terms = self.query_terms(query, fuzzy)
+        if not total_docs or not terms:
+            return 0, []
+
+        average_length = self.total_length / total_docs
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+
+        for term, factor in terms.items():
+            rows, tf = self._posting_arrays(term)
+            df = len(rows)
+            idf = factor * math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            norm = K1 * (1 - B + B * self.lengths[rows] / average_length)
+            scores[rows] += idf * tf * (K1 + 1) / (tf + norm)    # rows are unique per term
+
+        if kind:
+            scores[self.kinds != KINDS.index(kind)] = 0
+
+        matched = np.flatnonzero(scores)
+        wanted = offset + limit
+        if len(matched) > wanted:
+            matched = matched[np.argpartition(-scores[matched], wanted - 1)[:wanted]]
+        best = matched[np.argsort(-scores[matched], kind="stable")][offset:]
+
+        count = int(np.count_nonzero(scores))
+        return count, [(self.docs[row], float(scores[row])) for row in best]
+
+
+# ---------------------------------------------------------
+# DOCUMENTS FROM THE DATABASE
+# ---------------------------------------------------------
+def _batches(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_BATCH):
+        yield ids[start:start + ID_BATCH]
+
+
+def _link_names(through, column, product_ids):
+    links = through.objects.all()
+    if product_ids is not None:
+        links = links.filter(product_id__in=product_ids)
+    names = defaultdict(list)
+    for product_id, name in links.values_list("product_id", column).iterator(chunk_size=5000):
+        names[product_id].append(name)
+    return names
+
+
+def product_documents(product_ids=None):
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+
+    categories = _link_names(Product.categories.through, "category__name", product_ids)
+    materials = _link_names(Product.materials.through, "material__name", product_ids)
+    rows = products.values_list(
+        "id", "name", "brandName", "description", "long_description", "artisan__location"
+    ).iterator(chunk_size=2000)
+
+    for pk, name, brand, description, long_description, location in rows:
+        yield (PRODUCT, pk), {
+            "name": name,
+            "categories": " ".join(categories[pk]),
+            "materials": " ".join(materials[pk]),
+            "brand": brand,
+            "location": location,
+            "description": description,
+            "long_description": long_description,
+        }
+
+
+def artisan_documents(artisan_ids=None):
+    artisans = Artisan.objects.all()
+    if artisan_ids is not None:
+        artisans = artisans.filter(id__in=artisan_ids)
+
+    rows = artisans.values_list("id", "name", "location", "short_description", "about_shop")
+    for pk, name, location, short_description, about_shop in rows.iterator(chunk_size=2000):
+        yield (ARTISAN, pk), {
+            "name": name,
+            "location": location,
+            "short_description": short_description,
+            "about_shop": about_shop,
+        }
+
+
+DOCUMENTS = {PRODUCT: product_documents, ARTISAN: artisan_documents}
+
+
+def build_index():
+    started = time.monotonic()
+    index = InvertedIndex()
+    # read before loading: changes made meanwhile are replayed afterwards
+    index.position = feed_position(FEED)
+
+    for kind in KINDS:
+        for doc, fields in DOCUMENTS[kind]():
+            index.add(doc, fields)
+
+    logger.info(
+        "Built search index: %s documents, %s terms in %.0f ms",
+        len(index), len(index.postings), (time.monotonic() - started) * 1000,
+    )
+    return index
+
+
+def apply_changes(index, docs):
+    """ Re-read `docs` from the database; the ones that are gone are dropped. """
+    by_kind = defaultdict(set)
+    for kind, pk in docs:
+        by_kind[kind].add(pk)
+
+    for kind, ids in by_kind.items():
+        for batch in _batches(ids):
+            found = set()
+            for doc, fields in DOCUMENTS[kind](batch):
+                index.add(doc, fields)
+                found.add(doc)
+            for pk in batch:
+                if (kind, pk) not in found:
+                    index.remove((kind, pk))
+
+
+# ---------------------------------------------------------
+# OFFLINE ARTIFACT
+# ---------------------------------------------------------
+def save_index(index, path=None):
+    return save_artifact(ARTIFACT_NAME, index, ARTIFACT_FORMAT, path)
+
+
+def load_index(path=None):
+    return load_artifact(ARTIFACT_NAME, ARTIFACT_FORMAT, path)
+
+
+# ---------------------------------------------------------
+# THIS WORKER'S INDEX
+# ---------------------------------------------------------
+_index = None
+_lock = threading.RLock()
+
+
+def _current_index():
+    global _index
+    if _index is None:
+        _index = load_index() or build_index()
+
+    position, changes = read_changes(FEED, _index.position)
+    if changes is None:
+        # entries we needed are gone: start over
+        _index = build_index()
+    elif changes:
+        apply_changes(_index, [doc for entry in changes for doc in entry])
+        _index.position = position
+    return _index
+
+
+def search(query, kind=None, offset=0, limit=20, fuzzy=False):
+    """ BM25 search over products and artisans; see InvertedIndex.search. """
+    with _lock:
+        return _current_index().search(query, kind, offset, limit, fuzzy)
+
+
+def suggest(query):
+    """ "Did you mean" text for `query`, or None when every word is known. """
+    with _lock:
+        return _current_index().suggest(query)
+
+
+def warm_index():
+    """ Load or build the index at worker start; never fatal. """
+    try:
+        with _lock:
+            _current_index()
+    except Exception:
+        logger.exception("Could not build the search index at startup")
+
+
+def reindex(*docs):
+    """ Have every worker re-read `docs` once the current transaction commits. """
+    docs = list(dict.fromkeys(docs))
+    if docs:
+        transaction.on_commit(lambda: record_change(FEED, docs))
+
+
+def reindex_products(product_ids):
+    reindex(*[(PRODUCT, pk) for pk in product_ids])
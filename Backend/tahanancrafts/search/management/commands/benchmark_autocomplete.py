@@ -0,0 +1,79 @@
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from search.autocomplete import ARTISAN, CATEGORY, MATERIAL, PRODUCT, Completions
+
+SYLLABLES = ["ba", "ka", "la", "ma", "na", "pa", "sa", "ta", "yo", "ngi", "bu", "ri", "to", "li", "ha", "wi"]
+ADJECTIVES = ["handwoven", "handmade", "native", "embroidered", "carved", "painted", "braided", "natural"]
+ITEMS = ["bag", "basket", "mat", "banig", "lamp", "tray", "hat", "coaster", "runner", "bayong", "fan", "bowl"]
+KINDS = [PRODUCT] * 85 + [ARTISAN] * 10 + [CATEGORY] * 3 + [MATERIAL] * 2
+
+
+class Command(BaseCommand):
+    help = (
+        "Build autocomplete over a synthetic vocabulary (no database) and report "
+        "build time, memory, and latency percentiles for prefix lookups and patches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--terms", type=int, default=100_000)
+        parser.add_argument("--lookups", type=int, default=20_000)
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        items = [self.item(rng, pk) for pk in range(options["terms"])]
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        completions = Completions()
+        completions.load(items)
+        build = time.perf_counter() - started
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(
+            f"{len(completions)} names, {len(completions.keys)} keys | build {build:.2f} s | "
+            f"memory {memory / 1e6:.1f} MB"
+        )
+
+        prefixes = []
+        for _ in range(options["lookups"]):
+            words = rng.choice(items)[2].lower().split()
+            start = rng.randrange(len(words))
+            text = " ".join(words[start:])
+            prefixes.append(text[: rng.randint(1, min(len(text), 10))])
+
+        self.report("lookup", [self.timed(completions.complete, prefix) for prefix in prefixes])
+
+        patches = []
+        for pk in rng.sample(range(options["terms"]), min(2000, options["terms"])):
+            kind, _, _, weight = items[pk]
+            patches.append(self.timed(completions.put, kind, pk, self.name(rng), weight * 2))
+        self.report("patch", patches)
+        self.report("lookup after patches", [self.timed(completions.complete, p) for p in prefixes])
+
+    def timed(self, function, *args):
+        started = time.perf_counter()
+        function(*args)
+        return (time.perf_counter() - started) * 1000
+
+    def report(self, name, timings):
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        self.stdout.write(
+            f"{name:<21} median {statistics.median(timings):.3f} ms | p99 {p99:.3f} ms | "
+            f"max {timings[-1]:.3f} ms"
+        )
+
+    def name(self, rng):
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        return f"{rng.choice(ADJECTIVES).title()} {word.title()} {rng.choice(ITEMS).title()}"
+
+    def item(self, rng, pk):
+        # heavy-tailed popularity, like real sales
+        return rng.choice(KINDS), pk, self.name(rng), int(rng.paretovariate(1.2))
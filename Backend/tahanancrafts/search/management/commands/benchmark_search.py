@@ -0,0 +1,141 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from products.models import Category, Material, Product
+from search.index import build_index
+from users.models import Artisan, CustomUser
+
+QUERIES = [
+    "abaca",
+    "handwoven bag",
+    "rattan basket",
+    "banig na gawa sa Romblon",
+    "bamboo lamp",
+    "pina cloth",
+    "capiz",
+]
+MISSPELLED = ["abca", "handwoven bga", "ratan baskit", "bambo lamp", "pinya clth", "Romblom"]
+
+# vocabulary for synthetic listings
+ADJECTIVES = ["handwoven", "handmade", "native", "embroidered", "carved", "painted", "braided", "natural"]
+MATERIALS = ["abaca", "rattan", "bamboo", "buri", "pandan", "pina", "capiz", "coconut", "nito", "narra"]
+ITEMS = ["bag", "basket", "mat", "banig", "lamp", "tray", "hat", "coaster", "runner", "bayong", "fan", "bowl"]
+PLACES = ["Romblon", "Iloilo", "Bohol", "Aklan", "Antique", "Cebu", "Pampanga", "Batangas", "Ifugao"]
+FILLER = (
+    "Made by local artisans using traditional techniques passed down for generations. "
+    "Each piece is unique and may vary slightly in color and size."
+)
+
+
+def icontains_search(query):
+    """ The previous GeneralSearchView body: substring filters over every row. """
+    products = Product.objects.filter(
+        Q(name__icontains=query) |
+        Q(description__icontains=query) |
+        Q(materials__name__icontains=query)
+    ).distinct()
+    results = [(p.id, p.name, p.description, p.sales_price or p.regular_price) for p in products]
+    results += [(a.id, a.name, a.location) for a in Artisan.objects.filter(name__icontains=query)]
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare BM25 index search with the old icontains queries on synthetic catalogs "
+        "of increasing size (inserted in a transaction that is rolled back)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated catalog sizes.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs of every query per engine.")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(s) for s in options["sizes"].split(","))
+        rng = random.Random(7)
+
+        with transaction.atomic():
+            artisans = self.seed_artisans(rng)
+            for size in sizes:
+                self.seed_products(size, artisans, rng)
+
+                started = time.perf_counter()
+                index = build_index()
+                build = time.perf_counter() - started
+
+                bm25 = self.time_queries(options["repeat"], QUERIES, lambda q: self.bm25(index, q))
+                fuzzy = self.time_queries(options["repeat"], MISSPELLED, lambda q: self.bm25(index, q, True))
+                icontains = self.time_queries(options["repeat"], QUERIES, icontains_search)
+                self.stdout.write(
+                    f"{size:>7} products | index build {build:6.2f} s, {len(index.postings):>6} terms | "
+                    f"bm25 median {statistics.median(bm25):7.2f} ms, max {max(bm25):7.2f} ms | "
+                    f"fuzzy median {statistics.median(fuzzy):7.2f} ms | "
+                    f"icontains median {statistics.median(icontains):8.2f} ms, max {max(icontains):8.2f} ms"
+                )
+
+            transaction.set_rollback(True)
+
+    def bm25(self, index, query, fuzzy=False):
+        # the same work as the view: one page of hits, then their rows
+        _, hits = index.search(query, limit=20, fuzzy=fuzzy)
+        ids = [pk for (kind, pk), _ in hits if kind == "product"]
+        return list(Product.objects.only("id", "name", "description", "regular_price", "sales_price").in_bulk(ids))
+
+    def time_queries(self, repeat, queries, run):
+        timings = []
+        for query in queries:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run(query)
+                timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def seed_artisans(self, rng):
+        user = CustomUser.objects.create_user(
+            email="search-benchmark@example.com", password=None, name="Benchmark", role="seller"
+        )
+        return Artisan.objects.bulk_create(
+            Artisan(user=user, name=f"{place} {item.title()} Weavers", location=f"{place}, Philippines")
+            for place in PLACES
+            for item in rng.sample(ITEMS, 3)
+        )
+
+    def seed_products(self, size, artisans, rng):
+        missing = size - Product.objects.count()
+        if missing <= 0:
+            return
+
+        self.stdout.write(f"Seeding {missing} products...")
+        categories = [Category.objects.get_or_create(name=f"Benchmark {item}")[0] for item in ITEMS]
+        materials = [Material.objects.get_or_create(name=f"Benchmark {name}")[0] for name in MATERIALS]
+
+        products, links = [], []
+        for _ in range(missing):
+            adjective, material, item = rng.choice(ADJECTIVES), rng.choice(MATERIALS), rng.choice(ITEMS)
+            products.append(Product(
+                artisan=rng.choice(artisans),
+                name=f"{adjective.title()} {material.title()} {item.title()}",
+                description=f"A {adjective} {item} of {material} from {rng.choice(PLACES)}. {FILLER}",
+                stock_quantity=10,
+                regular_price=rng.randint(100, 3000),
+                main_image="products/main/benchmark.png",
+            ))
+            links.append((ITEMS.index(item), MATERIALS.index(material)))
+
+        created = Product.objects.bulk_create(products, batch_size=2000)
+        if created[0].pk is None:
+            # MySQL does not return the new ids
+            created = list(Product.objects.order_by("-id")[:missing])[::-1]
+
+        Product.categories.through.objects.bulk_create(
+            [Product.categories.through(product_id=p.pk, category_id=categories[c].id) for p, (c, _) in zip(created, links)],
+            batch_size=2000,
+        )
+        Product.materials.through.objects.bulk_create(
+            [Product.materials.through(product_id=p.pk, material_id=materials[m].id) for p, (_, m) in zip(created, links)],
+            batch_size=2000,
+        )
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from search.index import build_index, save_index
+
+
+class Command(BaseCommand):
+    help = "Build the search index from the database and write it to ARTIFACT_DIR for workers to load at start."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", help="Artifact path (default: ARTIFACT_DIR/search_index.pickle).")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        index = build_index()
+        path = save_index(index, options["output"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index)} documents ({len(index.postings)} terms) "
+            f"in {time.monotonic() - started:.1f}s -> {path}"
+        ))
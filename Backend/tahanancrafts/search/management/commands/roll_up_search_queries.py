@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from search.querylog import ROLLUP_DAYS, flush, roll_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the daily search analytics from the search query log, for every day since the last "
+        "rollup, and prune old log rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=ROLLUP_DAYS,
+            help="Recount at least this many recent days, besides every day since the last rollup.",
+        )
+
+    def handle(self, *args, **options):
+        flush()
+        count = roll_up(days=options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {count} (day, query) rows."))
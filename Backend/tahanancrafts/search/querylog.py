@@ -0,0 +1,193 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from products.models import SearchQueryDaily, SearchQueryLog
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------
+# BUFFERED QUERY LOG
+# ---------------------------------------------------------
+# The request only puts the row on an in-memory queue; a writer thread
+# bulk-inserts it with others every FLUSH_INTERVAL seconds or FLUSH_SIZE
+# rows. When the database falls far behind, new rows are dropped instead of
+# slowing searches down.
+
+FLUSH_SIZE = 200
+FLUSH_INTERVAL = 5
+QUEUE_LIMIT = 10_000
+
+_queue = queue.Queue(maxsize=QUEUE_LIMIT)
+_writer = None
+_writer_lock = threading.Lock()
+_dropped = 0
+
+
+def _write(batch):
+    close_old_connections()
+    try:
+        SearchQueryLog.objects.bulk_create(batch, batch_size=FLUSH_SIZE)
+    except Exception:
+        logger.exception("Could not write %s search log rows", len(batch))
+    finally:
+        close_old_connections()
+
+
+def _drain(limit=None):
+    batch = []
+    while limit is None or len(batch) < limit:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _run():
+    while True:
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        batch = []
+        while len(batch) < FLUSH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        if batch:
+            _write(batch)
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run, name="search-query-log", daemon=True)
+            _writer.start()
+
+
+def log_query(query, mode, result_count, cache_hit, user_id=None):
+    """ Record one search without touching the database on this thread. """
+    global _dropped
+    if _writer is None:
+        _start_writer()
+    try:
+        _queue.put_nowait(SearchQueryLog(
+            query=query,
+            mode=mode,
+            result_count=result_count,
+            cache_hit=cache_hit,
+            user_id=user_id,
+            created_at=timezone.now(),
+        ))
+    except queue.Full:
+        _dropped += 1
+        if _dropped % 1000 == 1:
+            logger.warning("Search log queue is full; %s rows dropped so far", _dropped)
+
+
+@atexit.register
+def flush():
+    """ Write everything still queued, on the calling thread. """
+    while True:
+        batch = _drain(FLUSH_SIZE)
+        if not batch:
+            return
+        _write(batch)
+
+
+# ---------------------------------------------------------
+# DAILY ROLLUPS
+# ---------------------------------------------------------
+LOG_RETENTION_DAYS = 30
+ROLLUP_DAYS = 2          # today and yesterday, so late rows around midnight count
+
+WINDOW_DAYS = {"7d": 7, "30d": 30, "all": None}
+TOP_QUERIES = 20
+
+
+def first_unrolled_day(today):
+    """
+    The last day already in SearchQueryDaily (it may have been partial), or
+    the first day in the log when nothing was rolled up yet.
+    """
+    last = SearchQueryDaily.objects.order_by("-day").values_list("day", flat=True).first()
+    if last is not None:
+        return last
+    first = SearchQueryLog.objects.order_by("created_at").values_list("created_at", flat=True).first()
+    return timezone.localdate(first) if first else today
+
+
+def roll_up(days=ROLLUP_DAYS):
+    """
+    Recount SearchQueryDaily from the log (one grouped query) for every day
+    since the last rollup, and at least the last `days` days, so days missed
+    while the job was not running are counted before their log rows are
+    pruned; then prune log rows past the retention period.
+    """
+    today = timezone.localdate()
+    first_day = min(today - timedelta(days=days - 1), first_unrolled_day(today))
+
+    rows = (
+        SearchQueryLog.objects.filter(created_at__date__gte=first_day)
+        .annotate(day=TruncDate("created_at"))
+        .values_list("day", "query")
+        .annotate(
+            searches=Count("id"),
+            zero_results=Count("id", filter=Q(result_count=0)),
+            cache_hits=Count("id", filter=Q(cache_hit=True)),
+        )
+    )
+    totals = [
+        SearchQueryDaily(day=day, query=query, searches=searches, zero_results=zero, cache_hits=hits)
+        for day, query, searches, zero, hits in rows
+    ]
+
+    with transaction.atomic():
+        SearchQueryDaily.objects.filter(day__gte=first_day).delete()
+        SearchQueryDaily.objects.bulk_create(totals, batch_size=500)
+
+    # only rows already counted into SearchQueryDaily may go
+    cutoff = min(first_day, today - timedelta(days=LOG_RETENTION_DAYS))
+    pruned, _ = SearchQueryLog.objects.filter(created_at__date__lt=cutoff).delete()
+
+    logger.info("Rolled up %s search queries; pruned %s log rows", len(totals), pruned)
+    return len(totals)
+
+
+def parse_window(value):
+    return value if value in WINDOW_DAYS else "7d"
+
+
+def search_report(window="7d", limit=TOP_QUERIES):
+    """ Top queries, zero-result queries and cache hit rate over a window of rollups. """
+    daily = SearchQueryDaily.objects.all()
+    days = WINDOW_DAYS[window]
+    if days:
+        daily = daily.filter(day__gt=timezone.localdate() - timedelta(days=days))
+
+    totals = daily.aggregate(total=Sum("searches"), zero=Sum("zero_results"), hits=Sum("cache_hits"))
+    searches = totals["total"] or 0
+
+    by_query = daily.values("query").annotate(total=Sum("searches"), zero=Sum("zero_results"))
+    top = by_query.order_by("-total", "query")[:limit]
+    zero = by_query.filter(zero__gt=0).order_by("-zero", "query")[:limit]
+
+    return {
+        "window": window,
+        "searches": searches,
+        "zero_result_searches": totals["zero"] or 0,
+        "cache_hit_rate": round((totals["hits"] or 0) / searches, 4) if searches else 0.0,
+        "top_queries": [{"query": r["query"], "searches": r["total"]} for r in top],
+        "zero_result_queries": [{"query": r["query"], "searches": r["zero"]} for r in zero],
+    }
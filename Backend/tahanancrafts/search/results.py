@@ -0,0 +1,75 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from products.product.cache import CATALOG, feed_position, get_versions
+from .index import FEED
+from .tokenizer import WORD_RE, fold, tokenize
+
+# ---------------------------------------------------------
+# PER-WORKER CACHE OF SEARCH RESPONSES
+# ---------------------------------------------------------
+# Popular queries repeat, so finished responses are kept in a small LRU
+# with a TTL, keyed by what the search reads of the query (see query_key)
+# and its parameters. Each entry is tagged with the catalog version and the
+# search change-feed position it was computed at; any product / artisan change moves one of them and
+# makes every older entry a miss.
+
+RESULT_CACHE_SIZE = 1000
+RESULT_CACHE_TTL = 60
+
+# TfidfVectorizer's default token pattern (products/recommender.py)
+SEMANTIC_TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+
+def normalize_query(query):
+    """ Lowercase, accent-free words separated by single spaces. """
+    return " ".join(WORD_RE.findall(fold(query)))[:255]
+
+
+def query_key(query, mode):
+    """
+    The query as the search sees it, so two queries share a cache entry only
+    when they get the same results: BM25's index terms plus the words "did
+    you mean" checks ("hand-woven" also indexes "handwoven", "hand woven"
+    does not), or the TF-IDF vectorizer's lowercase tokens.
+    """
+    if mode == "semantic":
+        return tuple(SEMANTIC_TOKEN_RE.findall(query.lower()))
+    return tuple(tokenize(query)), normalize_query(query)
+
+
+def catalog_version():
+    return (*get_versions([CATALOG]), feed_position(FEED))
+
+
+class ResultCache:
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()    # key -> (expires, version, payload)
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, entry_version, payload = entry
+            if expires < time.monotonic() or entry_version != version:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return payload
+
+    def set(self, key, version, payload):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, version, payload)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
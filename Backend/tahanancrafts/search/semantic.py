@@ -0,0 +1,71 @@
+import numpy as np
+
+from products.artifacts import artifact_mtime
+from products.recommender import TFIDF_ARTIFACT, tfidf_model
+
+# ---------------------------------------------------------
+# "SEARCH BY DESCRIPTION" OVER THE RECOMMENDER'S TF-IDF
+# ---------------------------------------------------------
+# The recommendation job saves its fitted vectorizer and product matrix
+# (products/recommender.py); a query is projected into that space and
+# ranked by cosine similarity with one sparse matrix product. The
+# scheduler patches the saved model from the catalog change feed, so new
+# and edited products are found within a few minutes of being saved.
+#
+# Shoppers and artisans don't always pick the same word ("bag", "tote"),
+# so the query is first expanded with words that share products with its
+# own. Column q of the matrix dotted with every column scores how much
+# each word occurs alongside q, relative to q with itself; the best
+# EXPANSION_TERMS of each query word join the query at EXPANSION_WEIGHT
+# times that share. Products naming only a related word then match, below
+# the ones with the query's own words.
+
+EXPANSION_TERMS = 5
+EXPANSION_WEIGHT = 0.5
+
+
+def expand(matrix, query_vector, terms=EXPANSION_TERMS, weight=EXPANSION_WEIGHT):
+    """ The query as a dense, L2-normalized vector: its own words plus co-occurring ones (see above). """
+    query_vector = query_vector.tocsr()
+    own = query_vector.indices
+    vector = query_vector.toarray().ravel()
+    if terms <= 0:
+        return vector
+
+    cooccurrence = (matrix[:, own].T @ matrix).toarray()     # query words x vocabulary
+    for row, (term, value) in enumerate(zip(own, query_vector.data)):
+        itself = cooccurrence[row, term]
+        if itself <= 0:
+            continue    # no product has the word (anymore)
+        share = np.minimum(cooccurrence[row] / itself, 1)
+        share[term] = 0
+        count = min(terms, len(share))
+        top = np.argpartition(-share, count - 1)[:count]
+        top = top[share[top] > 0]
+        vector[top] = np.maximum(vector[top], weight * value * share[top])
+    return vector / np.linalg.norm(vector)
+
+
+def model_version():
+    """ The saved model searches are answered from (its artifact's mtime), or None. """
+    return artifact_mtime(TFIDF_ARTIFACT)
+
+
+def search(query, offset=0, limit=20):
+    """ (number of matches, [(product_id, similarity), ...]) best first; (0, []) until a model is saved. """
+    model = tfidf_model()
+    if model is None:
+        return 0, []
+    query_vector = model.vectorizer.transform([query])
+    if not query_vector.nnz:
+        return 0, []
+
+    scores = model.matrix @ expand(model.matrix, query_vector)
+    matched = np.flatnonzero(scores > 0)
+    wanted = offset + limit
+    if len(matched) > wanted:
+        matched = matched[np.argpartition(-scores[matched], wanted - 1)[:wanted]]
+    best = matched[np.argsort(-scores[matched], kind="stable")][offset:]
+
+    count = int(np.count_nonzero(scores > 0))
+    return count, [(int(model.product_ids[i]), float(scores[i])) for i in best]
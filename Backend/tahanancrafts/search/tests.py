@@ -0,0 +1,494 @@
+import queue
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from products import recommender
+from products.models import Category, Product, SearchQueryDaily, SearchQueryLog
+from search import autocomplete, index as search_index
+from search import querylog
+from search import views as search_views
+from search.autocomplete import Completions
+from search.index import ARTISAN, PRODUCT, InvertedIndex
+from search.results import ResultCache, query_key
+from search.trigrams import TrigramIndex
+from users.models import Artisan, CustomUser
+
+
+def log_searches(query, day, count=1, result_count=1):
+    created_at = timezone.now().replace(hour=12) - timedelta(days=(timezone.localdate() - day).days)
+    SearchQueryLog.objects.bulk_create([
+        SearchQueryLog(query=query, mode="keyword", result_count=result_count, created_at=created_at)
+        for _ in range(count)
+    ])
+
+
+class SearchRollupTests(TestCase):
+    """Daily search analytics rolled up from the query log."""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+
+    def daily(self):
+        return {(row.day, row.query): row.searches for row in SearchQueryDaily.objects.all()}
+
+    def test_first_rollup_counts_the_whole_log(self):
+        week_ago = self.today - timedelta(days=7)
+        log_searches("basket", week_ago, 2)
+        log_searches("basket", self.today)
+        log_searches("bag", self.today, result_count=0)
+
+        querylog.roll_up()
+
+        self.assertEqual(self.daily(), {
+            (week_ago, "basket"): 2, (self.today, "basket"): 1, (self.today, "bag"): 1,
+        })
+        self.assertEqual(querylog.search_report("7d")["zero_result_queries"], [{"query": "bag", "searches": 1}])
+
+    def test_days_missed_by_the_job_are_rolled_up_before_pruning(self):
+        last_run = self.today - timedelta(days=45)
+        missed = self.today - timedelta(days=40)
+        SearchQueryDaily.objects.create(day=last_run, query="mat", searches=3)
+        log_searches("mat", last_run, 3)
+        log_searches("lamp", missed, 4)
+
+        querylog.roll_up(days=2)
+
+        self.assertEqual(self.daily(), {(last_run, "mat"): 3, (missed, "lamp"): 4})
+        # counted, but not yet pruned: the next run starts after them
+        self.assertEqual(SearchQueryLog.objects.count(), 7)
+
+        log_searches("lamp", self.today)
+        querylog.roll_up(days=2)
+        self.assertEqual(SearchQueryLog.objects.filter(query="mat").count(), 0)
+        self.assertEqual(self.daily()[(missed, "lamp")], 4)
+
+    def test_rollups_are_idempotent(self):
+        log_searches("basket", self.today, 2)
+        querylog.roll_up()
+        querylog.roll_up()
+        self.assertEqual(self.daily(), {(self.today, "basket"): 2})
+
+
+class ResultCacheKeyTests(SimpleTestCase):
+    """Queries share a cached response only when the search reads them the same."""
+
+    def test_hyphenated_words_do_not_share_an_entry_with_separate_ones(self):
+        self.assertNotEqual(query_key("hand-woven", "keyword"), query_key("hand woven", "keyword"))
+
+    def test_case_and_spacing_do_share_one(self):
+        self.assertEqual(query_key("Woven  Baskets", "fuzzy"), query_key("woven baskets", "fuzzy"))
+        self.assertEqual(query_key("Woven  Baskets", "semantic"), query_key("woven baskets", "semantic"))
+
+    def test_semantic_keeps_accents_the_vectorizer_keeps(self):
+        self.assertNotEqual(query_key("piña", "semantic"), query_key("pina", "semantic"))
+
+
+class InvertedIndexTests(SimpleTestCase):
+    """BM25 ranking over weighted fields, one document at a time."""
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add((PRODUCT, 1), {"name": "Abaca bag", "description": "Sturdy tote"})
+        self.index.add((PRODUCT, 2), {"name": "Rattan chair", "description": "Chair with abaca cushion"})
+        self.index.add((ARTISAN, 1), {"name": "Abaca Weavers", "location": "Catanduanes"})
+
+    def docs(self, *args, **kwargs):
+        return [doc for doc, _ in self.index.search(*args, **kwargs)[1]]
+
+    def test_matches_in_the_name_outrank_the_description(self):
+        self.assertEqual(self.docs("abaca", kind=PRODUCT), [(PRODUCT, 1), (PRODUCT, 2)])
+        self.assertEqual(self.docs("abaca", kind=ARTISAN), [(ARTISAN, 1)])
+
+    def test_pages_count_every_match(self):
+        count, page = self.index.search("abaca", offset=1, limit=1)
+        self.assertEqual(count, 3)
+        self.assertEqual(len(page), 1)
+        self.assertEqual(self.index.search("abaca", offset=3)[1], [])
+
+    def test_terms_are_folded_and_stemmed(self):
+        self.assertEqual(self.docs("CHAIRS"), [(PRODUCT, 2)])
+        self.assertEqual(self.docs("abaka bags"), self.docs("abaca bag"))
+
+    def test_removed_documents_are_not_found_and_their_rows_reused(self):
+        row = self.index.rows[(PRODUCT, 1)]
+        self.index.remove((PRODUCT, 1))
+        self.assertNotIn((PRODUCT, 1), self.docs("abaca"))
+        self.assertNotIn("bag", self.index.postings)
+
+        self.index.add((PRODUCT, 3), {"name": "Capiz lamp"})
+        self.assertEqual(self.index.rows[(PRODUCT, 3)], row)
+        self.assertEqual(self.docs("lamp"), [(PRODUCT, 3)])
+
+    def test_readding_a_document_replaces_its_terms(self):
+        self.index.add((PRODUCT, 1), {"name": "Capiz lamp"})
+        self.assertEqual(self.docs("tote"), [])
+        self.assertEqual(self.docs("lamp"), [(PRODUCT, 1)])
+        self.assertEqual(len(self.index), 3)
+
+
+class SearchIndexFeedTests(TestCase):
+    """Each worker's index follows saves through the search change feed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="s@example.com", password="pass", name="S", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        variants = mock.patch("products.product.signals.queue_variants")     # no image files here
+        variants.start()
+        self.addCleanup(variants.stop)
+        artifacts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, artifacts, ignore_errors=True)
+        settings_override = override_settings(ARTIFACT_DIR=artifacts)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        search_index._index = None
+        self.addCleanup(setattr, search_index, "_index", None)
+
+    def product(self, name, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                name=name, description="Handwoven", stock_quantity=1, regular_price=100,
+                main_image="media/products/main/basket.png", artisan=self.artisan, **fields,
+            )
+
+    def found(self, query):
+        return [pk for (kind, pk), _ in search_index.search(query, kind=PRODUCT)[1]]
+
+    def test_saves_reach_a_warm_index_without_a_rebuild(self):
+        basket = self.product("Abaca basket")
+        search_index.warm_index()
+
+        with mock.patch("search.index.build_index", side_effect=AssertionError("rebuilt")):
+            lamp = self.product("Capiz lamp")
+            self.assertEqual(self.found("capiz"), [lamp.id])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                basket.name = "Abaca tray"
+                basket.save()
+            self.assertEqual(self.found("basket"), [])
+            self.assertEqual(self.found("tray"), [basket.id])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                lamp.delete()
+            self.assertEqual(self.found("capiz"), [])
+
+    def test_tagging_reindexes_the_product(self):
+        basket = self.product("Abaca basket")
+        search_index.warm_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            basket.categories.add(Category.objects.create(name="Home decor"))
+        self.assertEqual(self.found("decor"), [basket.id])
+
+    def test_an_index_too_far_behind_is_rebuilt(self):
+        search_index.warm_index()
+        with mock.patch("products.product.cache.FEED_MAX_GAP", 0):
+            basket = self.product("Abaca basket")
+            self.assertEqual(self.found("basket"), [basket.id])
+
+
+class CompletionsTests(SimpleTestCase):
+    """The flattened prefix trie behind the search box."""
+
+    def setUp(self):
+        self.completions = Completions()
+        self.completions.load([
+            (autocomplete.PRODUCT, 1, "Abaca Bag", 5),
+            (autocomplete.PRODUCT, 2, "Abaca Basket", 9),
+            (autocomplete.PRODUCT, 3, "Abaca Basket", 2),
+            (autocomplete.MATERIAL, 1, "Abaca", 20),
+            (autocomplete.ARTISAN, 1, "Bagobo Crafts", 1),
+        ])
+
+    def texts(self, prefix, limit=autocomplete.DEFAULT_LIMIT):
+        return [text for _, _, text in self.completions.complete(prefix, limit)]
+
+    def test_most_popular_first_and_each_name_once(self):
+        self.assertEqual(self.texts("ab"), ["Abaca", "Abaca Basket", "Abaca Bag"])
+        self.assertEqual(self.texts("ab", limit=1), ["Abaca"])
+
+    def test_any_word_start_completes_the_name(self):
+        self.assertEqual(self.texts("BAG"), ["Abaca Bag", "Bagobo Crafts"])
+        self.assertEqual(self.texts("  abaca   bas"), ["Abaca Basket"])
+        self.assertEqual(self.texts(""), [])
+
+    def test_put_and_remove_update_memoized_prefixes(self):
+        with mock.patch("search.autocomplete.SCAN_LIMIT", 1):
+            self.assertEqual(self.texts("ba", limit=1), ["Abaca Basket"])
+            self.completions.put(autocomplete.PRODUCT, 4, "Banig mat", 50)
+            self.assertEqual(self.texts("ba", limit=1), ["Banig mat"])
+            self.completions.put(autocomplete.PRODUCT, 4, None, 0)
+            self.assertEqual(self.texts("ba", limit=1), ["Abaca Basket"])
+        self.assertEqual(len(self.completions), 5)
+
+
+class AutocompleteFeedTests(TestCase):
+    """Every worker patches its completions from the autocomplete change feed."""
+
+    url = "/api/search/autocomplete/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="a@example.com", password="pass", name="A", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        variants = mock.patch("products.product.signals.queue_variants")     # no image files here
+        variants.start()
+        self.addCleanup(variants.stop)
+        autocomplete._completions = autocomplete.build_completions()
+        self.addCleanup(setattr, autocomplete, "_completions", None)
+
+    def texts(self, prefix):
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {"q": prefix})
+        return [result["text"] for result in response.json()["results"]]
+
+    def test_saved_names_are_completed_without_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name="Capiz lamp", description="Shell lamp", stock_quantity=1, regular_price=450,
+                main_image="media/products/main/lamp.png", artisan=self.artisan,
+            )
+        self.assertEqual(self.texts("capi"), ["Capiz lamp"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(self.texts("capi"), [])
+
+    def test_renamed_categories_are_completed_by_their_new_name(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(name="Lighting")
+        with self.captureOnCommitCallbacks(execute=True):
+            category.name = "Lamps"
+            category.save()
+        self.assertEqual(self.texts("lig"), [])
+        self.assertEqual(self.texts("lam"), ["Lamps"])
+
+    @mock.patch("search.autocomplete._rebuild_in_background")
+    def test_a_gap_in_the_feed_rebuilds_in_the_background(self, rebuild):
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name="Lighting")
+        with mock.patch("products.product.cache.FEED_MAX_GAP", 0):
+            self.assertEqual(autocomplete.complete("lig"), [])
+        rebuild.assert_called_once_with()
+
+
+class TrigramMatchTests(SimpleTestCase):
+    """Misspelled words matched to indexed ones through shared trigrams."""
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add((PRODUCT, 1), {"name": "Rattan chair", "description": "Sturdy frame"})
+        self.index.add((PRODUCT, 2), {"name": "Rattan basket"})
+        self.index.add((ARTISAN, 1), {"name": "Banig Makers", "location": "Romblon"})
+
+    def test_similar_words_share_trigrams(self):
+        vocabulary = TrigramIndex()
+        for word in ("rattan", "rattan", "bamboo"):
+            vocabulary.add(word)
+        self.assertEqual([word for word, _ in vocabulary.similar("ratan")], ["rattan"])
+        self.assertEqual(vocabulary.similar("capiz"), [])
+
+        vocabulary.discard("rattan")
+        self.assertIn("rattan", vocabulary)
+        vocabulary.discard("rattan")
+        self.assertNotIn("rattan", vocabulary)
+        self.assertEqual(vocabulary.similar("ratan"), [])
+
+    def test_fuzzy_search_matches_misspellings_below_exact_ones(self):
+        self.assertEqual(self.index.search("ratan chair")[1][0][0], (PRODUCT, 1))
+        self.assertEqual(self.index.search("ratan")[0], 0)
+        count, hits = self.index.search("ratan", fuzzy=True)
+        self.assertEqual(count, 2)
+        self.assertLess(hits[0][1], self.index.search("rattan")[1][0][1])
+        self.assertEqual(self.index.search("romblom", kind=ARTISAN, fuzzy=True)[1][0][0], (ARTISAN, 1))
+
+    def test_only_name_fields_feed_the_vocabulary(self):
+        self.assertNotIn("frame", self.index.vocabulary)
+        self.assertEqual(self.index.search("frme", fuzzy=True)[0], 0)
+
+    def test_removed_documents_leave_the_vocabulary(self):
+        self.index.remove((ARTISAN, 1))
+        self.assertNotIn("romblon", self.index.vocabulary)
+        self.index.remove((PRODUCT, 1))
+        self.assertIn("rattan", self.index.vocabulary)
+
+    def test_suggest_corrects_only_unknown_words(self):
+        self.assertEqual(self.index.suggest("ratan chairr"), "rattan chair")
+        self.assertIsNone(self.index.suggest("rattan chair"))
+        self.assertIsNone(self.index.suggest("capiz"))
+
+
+class SemanticSearchTests(TestCase):
+    """GeneralSearchView?mode=semantic over the recommender's TF-IDF model."""
+
+    url = "/api/search/general_search/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="m@example.com", password="pass", name="M", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+        for name, description in (
+            ("Abaca tote", "Woven abaca shoulder bag"),
+            ("Rattan chair", "Handwoven rattan armchair for the porch"),
+            ("Capiz lamp", "Shell lamp for the bedside table"),
+        ):
+            Product.objects.create(
+                name=name, description=description, stock_quantity=1, regular_price=100,
+                main_image="media/products/main/item.png", artisan=cls.artisan,
+            )
+
+    def setUp(self):
+        cache.clear()
+        artifacts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, artifacts, ignore_errors=True)
+        settings_override = override_settings(ARTIFACT_DIR=artifacts)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        recommender._model = recommender._model_mtime = recommender._index = None
+        self.addCleanup(setattr, recommender, "_model", None)
+        self.addCleanup(setattr, recommender, "_index", None)
+        search_views.result_cache.clear()
+
+    def save_model(self):
+        recommender.save_model(recommender.build_model()[1])
+
+    def search(self, query):
+        return self.client.get(self.url, {"query": query, "mode": "semantic"}).json()
+
+    def test_products_are_ranked_by_similarity_to_the_query(self):
+        self.save_model()
+
+        response = self.search("woven bag")
+        self.assertEqual(response["results"][0]["name"], "Abaca tote")
+        self.assertIsNone(response["did_you_mean"])
+        self.assertEqual([r["name"] for r in self.search("bedside lamp")["results"]], ["Capiz lamp"])
+        self.assertEqual(self.search("xylophone")["count"], 0)
+
+    def test_products_with_only_a_related_word_rank_below_direct_matches(self):
+        Product.objects.create(
+            name="Buri carryall", description="Sturdy market tote", stock_quantity=1, regular_price=100,
+            main_image="media/products/main/item.png", artisan=self.artisan,
+        )
+        self.save_model()
+
+        # the carryall never says "bag", but "tote" shares a product with it
+        self.assertEqual([r["name"] for r in self.search("bag")["results"]], ["Abaca tote", "Buri carryall"])
+
+    def test_cached_results_follow_the_saved_model(self):
+        self.save_model()
+        with mock.patch("search.views.catalog_version", return_value=(1, 0)):
+            self.assertEqual(self.search("lamp")["count"], 1)
+            Product.objects.create(
+                name="Shell lamp", description="Capiz shell lamp", stock_quantity=1, regular_price=100,
+                main_image="media/products/main/item.png", artisan=self.artisan,
+            )
+            self.save_model()
+            self.assertEqual(self.search("lamp")["count"], 2)
+
+    def test_no_model_and_no_products_gives_no_results(self):
+        Product.objects.all().delete()
+
+        response = self.search("woven bag")
+        self.assertEqual((response["count"], response["results"]), (0, []))
+
+
+@mock.patch("search.querylog._start_writer")
+class QueryLogTests(TestCase):
+    """Searches are logged off the request thread and answered from the result cache."""
+
+    url = "/api/search/general_search/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="q@example.com", password="pass", name="Q", role="seller")
+        cls.artisan = Artisan.objects.create(user=cls.user, name="Taal Weavers")
+
+    def setUp(self):
+        cache.clear()
+        variants = mock.patch("products.product.signals.queue_variants")     # no image files here
+        variants.start()
+        self.addCleanup(variants.stop)
+        search_views.result_cache.clear()
+        querylog._drain()
+        self.addCleanup(querylog._drain)
+        artifacts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, artifacts, ignore_errors=True)
+        settings_override = override_settings(ARTIFACT_DIR=artifacts)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        search_index._index = None
+        self.addCleanup(setattr, search_index, "_index", None)
+
+    def logged(self):
+        querylog.flush()
+        return list(SearchQueryLog.objects.order_by("id").values_list("query", "result_count", "cache_hit"))
+
+    def test_logging_waits_for_the_writer(self, start_writer):
+        with self.assertNumQueries(0):
+            querylog.log_query("abaca bag", "keyword", 3, False)
+        self.assertEqual(SearchQueryLog.objects.count(), 0)
+        self.assertEqual(self.logged(), [("abaca bag", 3, False)])
+
+    def test_rows_past_the_queue_limit_are_dropped(self, start_writer):
+        with mock.patch("search.querylog._queue", queue.Queue(maxsize=1)):
+            querylog.log_query("bag", "keyword", 1, False)
+            querylog.log_query("mat", "keyword", 0, False)
+            self.assertEqual(self.logged(), [("bag", 1, False)])
+
+    def test_repeated_searches_hit_the_cache_until_the_catalog_changes(self, start_writer):
+        search = {"query": "Abaca  Basket"}
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name="Abaca basket", description="Woven", stock_quantity=1, regular_price=100,
+                main_image="media/products/main/basket.png", artisan=self.artisan,
+            )
+        self.assertEqual(self.client.get(self.url, search).json()["count"], 1)
+        self.assertEqual(self.client.get(self.url, {"query": "abaca basket"}).json()["count"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name="Abaca basket tray", description="Woven", stock_quantity=1, regular_price=100,
+                main_image="media/products/main/basket.png", artisan=self.artisan,
+            )
+        self.assertEqual(self.client.get(self.url, search).json()["count"], 2)
+        self.assertEqual(self.logged(), [
+            ("abaca basket", 1, False), ("abaca basket", 1, True), ("abaca basket", 2, False),
+        ])
+
+
+class ResultCacheTests(SimpleTestCase):
+    """The per-worker LRU of search responses."""
+
+    def test_entries_of_another_version_are_misses(self):
+        results = ResultCache()
+        results.set("bag", (1, 0), {"count": 1})
+        self.assertEqual(results.get("bag", (1, 0)), {"count": 1})
+        self.assertIsNone(results.get("bag", (1, 1)))
+        self.assertEqual(results.entries, {})
+
+    def test_least_recently_used_entries_go_first(self):
+        results = ResultCache(maxsize=2)
+        results.set("bag", 1, "bags")
+        results.set("mat", 1, "mats")
+        results.get("bag", 1)
+        results.set("lamp", 1, "lamps")
+        self.assertEqual(list(results.entries), ["bag", "lamp"])
+
+    def test_entries_expire(self):
+        results = ResultCache(ttl=60)
+        with mock.patch("search.results.time.monotonic", return_value=0):
+            results.set("bag", 1, "bags")
+        with mock.patch("search.results.time.monotonic", return_value=61):
+            self.assertIsNone(results.get("bag", 1))
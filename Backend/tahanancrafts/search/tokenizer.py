@@ -0,0 +1,83 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# ---------------------------------------------------------
+# TOKENIZER FOR PRODUCT / ARTISAN TEXT
+# ---------------------------------------------------------
+# Listings mix English and Filipino ("Handwoven Abaca Bayong", "Banig na
+# gawa sa Romblon"), so: lowercase, fold accents (piña -> pina), drop
+# stopwords of both languages, and keep hyphenated words both whole and
+# split ("hand-woven" -> handwoven, hand, woven). Only English plurals are
+# stemmed; Filipino pluralizes with "mga", which is a stopword already.
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+WORD_RE = re.compile(r"[a-z0-9]+")
+SPLIT_RE = re.compile(r"['-]")
+MIN_LENGTH = 2
+
+ENGLISH_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "with", "you", "your",
+}
+FILIPINO_STOPWORDS = {
+    "ang", "ng", "mga", "sa", "na", "at", "ay", "si", "ni", "kay", "para", "ito", "iyan", "yan",
+    "yung", "iyong", "nang", "pa", "din", "rin", "lang", "lamang", "po", "ko", "mo", "niya",
+    "nila", "namin", "natin", "ating", "kami", "tayo", "kanila", "may", "mayroon", "nina",
+}
+STOPWORDS = ENGLISH_STOPWORDS | FILIPINO_STOPWORDS
+
+# spelling variants / Filipino names of common craft materials
+CANONICAL = {
+    "abaka": "abaca",
+    "kawayan": "bamboo",
+    "yantok": "rattan",
+    "uway": "rattan",
+    "niyog": "coconut",
+    "hinabi": "handwoven",
+    "habi": "weave",
+    "weaving": "weave",
+    "woven": "weave",
+    "handcrafted": "handmade",
+}
+
+
+def fold(text):
+    """ Lowercase and strip accents. """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def stem(word):
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("sses", "shes", "ches", "xes")):
+        return word[:-2]
+    # "-as" is left alone: mostly Filipino place names (Batangas, Visayas)
+    if word.endswith("s") and not word.endswith(("ss", "us", "is", "as")):
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=65536)
+def normalize_term(word):
+    word = CANONICAL.get(word, word)
+    return CANONICAL.get(stem(word), stem(word))
+
+
+def tokenize(text):
+    """ Index terms of `text`, in order, with repeats. """
+    if not text:
+        return []
+
+    terms = []
+    for match in TOKEN_RE.findall(fold(text)):
+        parts = [p for p in SPLIT_RE.split(match) if p]
+        if len(parts) > 1:
+            terms.append(normalize_term("".join(parts)))
+        for part in parts:
+            if len(part) >= MIN_LENGTH and part not in STOPWORDS:
+                terms.append(normalize_term(part))
+    return terms
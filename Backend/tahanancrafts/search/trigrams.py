@@ -0,0 +1,62 @@
+from collections import Counter, defaultdict
+
+# ---------------------------------------------------------
+# CHARACTER TRIGRAM INDEX FOR TYPO TOLERANCE
+# ---------------------------------------------------------
+# Maps each trigram to the vocabulary words containing it. A misspelled
+# word is compared only with the words sharing at least one of its
+# trigrams, never with every word (or row). Words are reference counted so
+# documents can be added and removed one at a time.
+
+MIN_SIMILARITY = 0.3
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    def __init__(self):
+        self.words = Counter()            # word -> documents using it
+        self.sizes = {}                   # word -> number of distinct trigrams
+        self.grams = defaultdict(set)     # trigram -> words
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def add(self, word):
+        self.words[word] += 1
+        if self.words[word] == 1:
+            grams = trigrams(word)
+            self.sizes[word] = len(grams)
+            for gram in grams:
+                self.grams[gram].add(word)
+
+    def discard(self, word):
+        if word not in self.words:
+            return
+        self.words[word] -= 1
+        if self.words[word] <= 0:
+            del self.words[word]
+            del self.sizes[word]
+            for gram in trigrams(word):
+                self.grams[gram].discard(word)
+                if not self.grams[gram]:
+                    del self.grams[gram]
+
+    def similar(self, word, limit=3, min_similarity=MIN_SIMILARITY):
+        """ [(word, similarity), ...] best first; Jaccard similarity of trigram sets. """
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.grams.get(gram, ()))
+
+        scored = []
+        for candidate, common in shared.items():
+            similarity = common / (len(grams) + self.sizes[candidate] - common)
+            if similarity >= min_similarity:
+                scored.append((similarity, self.words[candidate], candidate))
+
+        scored.sort(reverse=True)
+        return [(candidate, similarity) for similarity, _, candidate in scored[:limit]]
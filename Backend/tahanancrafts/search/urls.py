@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import GeneralSearchView
+from .views import AutocompleteView, GeneralSearchView
 
 urlpatterns = [
     path(
@@ -7,4 +7,9 @@ urlpatterns = [
         GeneralSearchView.as_view(),
         name="general-search"
     ),
+    path(
+        "autocomplete/",
+        AutocompleteView.as_view(),
+        name="search-autocomplete"
+    ),
 ]
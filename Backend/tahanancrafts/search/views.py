@@ -2,14 +2,36 @@ from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import Q
 
 from products.models import Product
 from users.models import Artisan   # adjust if your artisan model path differs
 
+from . import autocomplete, index as search_index, semantic
+from .index import ARTISAN, PRODUCT
+from .querylog import log_query
+from .results import ResultCache, catalog_version, normalize_query, query_key
+
+result_cache = ResultCache()
+
 
 class GeneralSearchView(APIView):
+    """
+    Ranked search over products and artisans (BM25, see search/index.py).
+    ?query=&type=product|artisan&page=&page_size=&fuzzy=true&mode=semantic
+    With fuzzy, misspelled words also match their closest indexed words.
+    mode=semantic ranks products only, by TF-IDF cosine similarity of the
+    query, expanded with co-occurring words, to their text (search/semantic.py).
+    """
     permission_classes = [AllowAny]
+    page_size = 20
+    max_page_size = 100
+
+    def _int_param(self, request, name, default, maximum=None):
+        try:
+            value = max(1, int(request.query_params.get(name, default)))
+        except (TypeError, ValueError):
+            value = default
+        return min(value, maximum) if maximum else value
 
     def get(self, request, format=None):
         query = request.query_params.get("query", "").strip()
@@ -20,42 +42,102 @@ class GeneralSearchView(APIView):
                 status=status.HTTP_200_OK
             )
 
-        results = []
+        kind = request.query_params.get("type")
+        if kind not in search_index.KINDS:
+            kind = None
+        page = self._int_param(request, "page", 1)
+        page_size = self._int_param(request, "page_size", self.page_size, self.max_page_size)
+
+        fuzzy = request.query_params.get("fuzzy", "").lower() in ("1", "true", "yes")
+        mode = "semantic" if request.query_params.get("mode") == "semantic" else ("fuzzy" if fuzzy else "keyword")
 
-        # =========================
-        # 🔍 PRODUCT SEARCH
-        # =========================
-        products = Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(materials__name__icontains=query)
-        ).distinct()
-
-        for p in products:
-            results.append({
-                "type": "product",
-                "id": p.id,
-                "name": p.name,
-                "description": p.description,
-                "price": str(p.sales_price or p.regular_price),
-            })
-
-        # =========================
-        # 🔍 ARTISAN SEARCH
-        # =========================
-        artisans = Artisan.objects.filter(
-            Q(name__icontains=query)
-        ).distinct()
-
-        for a in artisans:
-            results.append({
-                "type": "artisan",
-                "id": a.id,
-                "name": a.name,
-                "location": a.location if hasattr(a, "location") else "",
-            })
-
-        return Response(
-            {"results": results},
-            status=status.HTTP_200_OK
+        # identical searches are answered from the per-worker result cache
+        key = (query_key(query, mode), mode, kind, page, page_size)
+        version = catalog_version()
+        if mode == "semantic":
+            # the scheduler saves the model minutes after the feed moves
+            version = (*version, semantic.model_version())
+        payload = result_cache.get(key, version)
+        cache_hit = payload is not None
+        if not cache_hit:
+            payload = self.run_search(query, mode, kind, page, page_size)
+            result_cache.set(key, version, payload)
+
+        log_query(
+            normalize_query(query), mode, payload["count"], cache_hit,
+            request.user.id if request.user.is_authenticated else None,
         )
+        return Response(payload, status=status.HTTP_200_OK)
+
+    def run_search(self, query, mode, kind, page, page_size):
+        offset = (page - 1) * page_size
+
+        if mode == "semantic":
+            count, matches = semantic.search(query, offset, page_size)
+            hits = [((PRODUCT, pk), score) for pk, score in matches]
+            did_you_mean = None
+        else:
+            count, hits = search_index.search(query, kind, offset, page_size, mode == "fuzzy")
+            did_you_mean = search_index.suggest(query)
+
+        # load only the rows on this page
+        wanted = {PRODUCT: [], ARTISAN: []}
+        for (doc_kind, pk), _ in hits:
+            wanted[doc_kind].append(pk)
+        products = Product.objects.only(
+            "id", "name", "description", "regular_price", "sales_price"
+        ).in_bulk(wanted[PRODUCT])
+        artisans = Artisan.objects.only("id", "name", "location").in_bulk(wanted[ARTISAN])
+
+        results = []
+        for (doc_kind, pk), score in hits:
+            if doc_kind == PRODUCT and pk in products:
+                p = products[pk]
+                results.append({
+                    "type": "product",
+                    "id": p.id,
+                    "name": p.name,
+                    "description": p.description,
+                    "price": str(p.sales_price or p.regular_price),
+                    "score": round(score, 4),
+                })
+            elif doc_kind == ARTISAN and pk in artisans:
+                a = artisans[pk]
+                results.append({
+                    "type": "artisan",
+                    "id": a.id,
+                    "name": a.name,
+                    "location": a.location,
+                    "score": round(score, 4),
+                })
+
+        return {
+            "results": results,
+            "count": count,
+            "page": page,
+            "page_size": page_size,
+            "did_you_mean": did_you_mean,
+        }
+
+
+class AutocompleteView(APIView):
+    """
+    Completions for the search box, most popular first; answered from
+    memory (search/autocomplete.py), never from the database.
+    ?q=&limit=
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, format=None):
+        prefix = request.query_params.get("q", "")
+        try:
+            limit = int(request.query_params.get("limit", autocomplete.DEFAULT_LIMIT))
+        except ValueError:
+            limit = autocomplete.DEFAULT_LIMIT
+        limit = min(max(limit, 1), autocomplete.MAX_LIMIT)
+
+        results = [
+            {"type": kind, "id": pk, "text": text}
+            for kind, pk, text in autocomplete.complete(prefix, limit)
+        ]
+        return Response({"query": prefix, "results": results}, status=status.HTTP_200_OK)
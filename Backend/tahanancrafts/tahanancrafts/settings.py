@@ -35,6 +35,18 @@ KUDOSITY_API_SECRET = "TahananCrafts"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Prebuilt indexes written by management commands and loaded by workers
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', os.path.join(BASE_DIR, 'artifacts'))
+
+# Recommendation job (products/scheduler.py): worker processes and users per
+# shard; with 1 worker it runs in the calling process
+RECOMMENDATION_WORKERS = int(os.environ.get('RECOMMENDATION_WORKERS', 1))
+RECOMMENDATION_SHARD_SIZE = int(os.environ.get('RECOMMENDATION_SHARD_SIZE', 20000))
+# Weights of content (TF-IDF) and co-occurrence similarity in the blended
+# index the job personalizes from (products/collaborative.py)
+RECOMMENDATION_CONTENT_WEIGHT = float(os.environ.get('RECOMMENDATION_CONTENT_WEIGHT', 0.6))
+RECOMMENDATION_COLLABORATIVE_WEIGHT = float(os.environ.get('RECOMMENDATION_COLLABORATIVE_WEIGHT', 0.4))
+
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = [
@@ -261,6 +273,31 @@ REST_FRAMEWORK = {
 }
 
 
+# Cache used for catalog responses (products/product/cache.py).
+# Set REDIS_URL so every gunicorn worker shares versions and entries;
+# without it each worker falls back to its own in-memory cache.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "tahanancrafts",
+        }
+    }
+
+# Cached responses and ETags are only right when every worker sees the same
+# versions, so without REDIS_URL they are off; LOCAL_RESPONSE_CACHE=1 turns
+# them on for a single process (runserver). `manage.py check --deploy`
+# fails without a shared cache.
+RESPONSE_CACHE_ENABLED = bool(os.environ.get("REDIS_URL")) or os.environ.get("LOCAL_RESPONSE_CACHE") == "1"
+
+
 LALAMOVE_BASE_URL = "https://rest.sandbox.lalamove.com/v3"
 LALAMOVE_API_KEY = os.environ.get("LALAMOVE_API_KEY", default="")
 LALAMOVE_SECRET = os.environ.get("LALAMOVE_SECRET", default="")
@@ -14,3 +14,19 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tahanancrafts.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory catalog snapshot before the first request
+from products.product.facets import warm_snapshot
+warm_snapshot()
+
+# ...and the search index (from ARTIFACT_DIR when rebuild_search_index has run)
+from search.index import warm_index
+warm_index()
+
+# ...and the autocomplete names
+from search.autocomplete import warm_completions
+warm_completions()
+
+# ...and the recommender's similarity index (the TF-IDF model waits for a semantic search)
+from products.recommender import warm_model
+warm_model()